@@ -4,14 +4,21 @@ from optparse import OptionParser
 import json
 import logging
 import sys
-import redis
+import time
 from meerkat_backend_interface import redis_tools
+from meerkat_backend_interface.metrics import Counter, Histogram, start_metrics_server
+from meerkat_backend_interface.tracing import parse_alert
+from meerkat_backend_interface.node_registry import GroupDistributor, MESSAGES_PUBLISHED
 from meerkat_backend_interface.logger import log
 
 CHANNEL     = redis_tools.REDIS_CHANNELS.alerts  # Redis channel to listen on
 STREAM_TYPE = 'cbf.antenna_channelised_voltage'  # Type of stream to distribute
-NCHANNELS   = 64                                 # Number of channels to distribute into
+NCHANNELS   = 64                                 # Number of channels to distribute into (without --registry)
 CHANNELS = ["chan{:03d}".format(n) for n in range(NCHANNELS)]
+POLL_INTERVAL = 1.0  # seconds between checks of the node registry
+
+ALERTS_RECEIVED = Counter('distributor_alerts_total', 'Alerts received', ['type'])
+ALERT_LATENCY = Histogram('distributor_alert_seconds', 'Time taken to handle an alert', ['type'])
 
 def json_str_formatter(str_dict):
     """Formatting for json.loads
@@ -69,40 +76,74 @@ def cli():
     usage = "usage: %prog [options]"
     parser = OptionParser(usage=usage)
     parser.add_option('-p', '--port', dest='port', type=long,
-                      help='Redis port to connect to', default=6379)
+                      help='Redis port to connect to (default: $BLUSE_REDIS_PORT or 6379)')
+    parser.add_option('--redis-host', dest='redis_host', type=str,
+                      help='Redis host to connect to (default: $BLUSE_REDIS_HOST or localhost)')
+    parser.add_option('--redis-socket', dest='redis_socket', type=str,
+                      help='Redis unix-domain socket, used instead of host and port')
+    parser.add_option('--metrics-port', dest='metrics_port', type=int,
+                      help='Port to serve metrics on (0 to disable)', default=9121)
+    parser.add_option('--group-gbps', dest='group_gbps', type=float, default=1.0,
+                      help='Bandwidth one multicast group needs, in Gb/s')
+    parser.add_option('--group-gpu-slots', dest='group_gpu_slots', type=int, default=1,
+                      help='GPU slots one multicast group needs')
+    parser.add_option('--registry', dest='registry', action='store_true', default=False,
+                      help='Assign groups to the live nodes of the node registry, rather than group n to chan[n]')
     (opts, args) = parser.parse_args()
     # if not opts.port:
     #     print "MissingArgument: Port number"
     #     sys.exit(-1)
-    main(port=opts.port)
+    redis_tools.configure_redis(host=opts.redis_host, unix_socket_path=opts.redis_socket)
+    main(port=opts.port, metrics_port=opts.metrics_port, group_gbps=opts.group_gbps,
+         group_gpu_slots=opts.group_gpu_slots, registry=opts.registry)
 
-def main(port):
+def main(port=None, metrics_port=0, group_gbps=1.0, group_gpu_slots=1, registry=False):
     FORMAT = "[ %(levelname)s - %(asctime)s - %(filename)s:%(lineno)s] %(message)s"
     # logger = logging.getLogger('reynard')
     logging.basicConfig(format=FORMAT)
     log.setLevel(logging.DEBUG)
     log.info("Starting distributor")
-    red = redis.StrictRedis(port=port)
-    ps = red.pubsub(ignore_subscribe_messages=True)
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    redis_tools.configure_redis(port=port)
+    red = redis_tools.get_redis()  # product metadata
+    control = redis_tools.get_redis(redis_tools.CONTROL)  # alerts and the compute node channels
+    ps = redis_tools.get_redis(redis_tools.CONTROL, listener=True).pubsub(ignore_subscribe_messages=True)
     ps.subscribe(CHANNEL)
+    distributor = GroupDistributor(red, control, group_gbps, group_gpu_slots) if registry else None
+    last_poll = 0.0
     try:
-        for message in ps.listen():
-            msg_parts = message['data'].split(':')
-            if len(msg_parts) != 2:
+        while True:
+            message = ps.get_message(timeout=POLL_INTERVAL)
+            if distributor is not None and time.time() - last_poll >= POLL_INTERVAL:
+                distributor.poll()  # moves the groups of nodes whose heartbeat expired
+                last_poll = time.time()
+            if message is None:
+                continue
+            alert = parse_alert(message['data'])
+            if alert is None:
                 log.info("Not processing this message --> {}".format(message))
                 continue
-            msg_type = msg_parts[0]
-            product_id = msg_parts[1]
+            msg_type, product_id, trace_id = alert
+            started = time.time()
+            ALERTS_RECEIVED.labels(msg_type).inc()
             if msg_type == 'configure':
                 all_streams = json.loads(json_str_formatter(red.get("{}:streams".format(product_id))))
                 streams = all_streams[STREAM_TYPE]
                 addr_list, port = parse_spead_addresses(streams.values()[0])
                 nstreams = len(addr_list)
-                if nstreams > NCHANNELS:
-                    log.warning("More than {} ({}) stream addresses found".format(NCHANNELS, nstreams))
-                for i in range(min(nstreams, NCHANNELS)):
-                    msg = "{}:configure:stream:{}".format(product_id, addr_list[i])
-                    red.publish(CHANNELS[i], msg)
+                if distributor is not None:
+                    distributor.configure(product_id, addr_list)
+                else:
+                    if nstreams > NCHANNELS:
+                        log.warning("More than {} ({}) stream addresses found".format(NCHANNELS, nstreams))
+                    for i in range(min(nstreams, NCHANNELS)):
+                        msg = "{}:configure:stream:{}".format(product_id, addr_list[i])
+                        control.publish(CHANNELS[i], msg)
+                        MESSAGES_PUBLISHED.inc()
+            elif msg_type == 'deconfigure' and distributor is not None:
+                distributor.deconfigure(product_id)
+            ALERT_LATENCY.labels(msg_type).observe(time.time() - started)
     except KeyboardInterrupt:
         log.info("Stopping distributor")
         sys.exit(0)
@@ -4,12 +4,17 @@ from argparse import (
     ArgumentParser,
     ArgumentDefaultsHelpFormatter)
 import logging
+import os
 import signal
 import sys
+import tempfile
 import tornado
 
 from meerkat_backend_interface.katcp_server import BLBackendInterface
 from meerkat_backend_interface.logger import set_logger
+from meerkat_backend_interface.slack_tools import get_notifier
+from meerkat_backend_interface.metrics import start_metrics_server
+from meerkat_backend_interface.redis_tools import add_redis_arguments, configure_redis_from_args
 
 
 def cli(prog=sys.argv[0]):
@@ -35,6 +40,21 @@ def cli(prog=sys.argv[0]):
         type=str,
         default="effelsberg",
         help='name of the nodeset to use')
+    parser.add_argument(
+        '--slack',
+        action='store_true',
+        help='post lifecycle requests to slack (needs $SLACK_TOKEN)')
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        default=9122,
+        help='port to serve metrics on (0 to disable)')
+    parser.add_argument(
+        '--spool',
+        type=str,
+        default=os.path.join(tempfile.gettempdir(), 'bluse_katcp.spool'),
+        help='file to spool redis writes to while redis is down (empty to disable)')
+    add_redis_arguments(parser)
 
     # Options for development and testing
     title = "development and testing"
@@ -47,7 +67,9 @@ def cli(prog=sys.argv[0]):
         help='verbose logger output for debugging')
 
     args = parser.parse_args()
-    main(ip=args.ip, port=args.port, debug=args.debug)
+    configure_redis_from_args(args)
+    main(ip=args.ip, port=args.port, debug=args.debug, slack=args.slack,
+         metrics_port=args.metrics_port, spool=args.spool)
 
 
 @tornado.gen.coroutine
@@ -57,7 +79,7 @@ def on_shutdown(ioloop, server, log):
     ioloop.stop()
 
 
-def main(ip, port, debug):
+def main(ip, port, debug, slack=False, metrics_port=0, spool=None):
     if debug:
         # note: debug logging will only go to logfile
         log_level = logging.DEBUG
@@ -66,9 +88,12 @@ def main(ip, port, debug):
 
     log = set_logger(log_level=log_level)
     log.info("Starting BLBackendInterface instance")
+    if metrics_port:
+        start_metrics_server(metrics_port)
 
     ioloop = tornado.ioloop.IOLoop.current()
-    server = BLBackendInterface(ip, port)
+    server = BLBackendInterface(ip, port, notifier=get_notifier() if slack else None,
+                                spool_path=spool)
     signal.signal(signal.SIGINT,
                   lambda sig, frame: ioloop.add_callback_from_signal(
                       on_shutdown, ioloop, server, log))
@@ -1,26 +1,95 @@
 #!/usr/bin/env python
 
+from argparse import (
+    ArgumentParser,
+    ArgumentDefaultsHelpFormatter)
+import os
 import signal
 import sys
+import tempfile
 
 from meerkat_backend_interface.katportal_server import BLKATPortalClient
+from meerkat_backend_interface.sharding import KATPortalSupervisor
+from meerkat_backend_interface.metrics import start_metrics_server
+from meerkat_backend_interface.slack_tools import get_notifier
+from meerkat_backend_interface.redis_health import start_spooling
+from meerkat_backend_interface.redis_tools import add_redis_arguments, configure_redis_from_args, get_redis
 from meerkat_backend_interface.logger import log, set_logger
 
 
-def on_shutdown():
+def on_shutdown(supervisor=None):
     # TODO: uncomment when you deploy
     # notify_slack("KATPortal module at MeerKAT has halted. Might want to check that!")
     log.info("Shutting Down Katportal Clients")
+    if supervisor is not None:
+        supervisor.stop()
     sys.exit()
 
 
+def cli(prog=sys.argv[0]):
+    usage = "{} [options]".format(prog)
+    description = 'start BLUSE katportal client'
+
+    parser = ArgumentParser(usage=usage,
+                            description=description,
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=0,
+        help='number of worker processes to shard products across '
+             '(0 runs a single client in this process)')
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        default=9120,
+        help='port to serve metrics on (0 to disable); with --workers, '
+             'worker n serves its metrics on this port + 1 + n')
+    parser.add_argument(
+        '--slack',
+        action='store_true',
+        help='post changes in the number of good antennas to slack (needs $SLACK_TOKEN)')
+    parser.add_argument(
+        '--spool',
+        type=str,
+        default=os.path.join(tempfile.gettempdir(), 'bluse_katportal.spool'),
+        help='file to spool redis writes to while redis is down (empty to disable); '
+             'with --workers, worker n uses this path + ".worker[n]"')
+    parser.add_argument(
+        '--archive-dir',
+        type=str,
+        default=None,
+        help='directory to archive the metadata of each observation to (by default, no archives are written)')
+    parser.add_argument(
+        '--no-sensor-alerts',
+        dest='sensor_alerts',
+        action='store_false',
+        help='do not also publish sensor updates on the old "sensor_alerts" channel')
+    add_redis_arguments(parser)
+    return parser.parse_args()
+
+
 def main():
+    args = cli()
+    configure_redis_from_args(args)
     log = set_logger()
     log.info("Starting Katportal Client")
 
-    client = BLKATPortalClient()
-    signal.signal(signal.SIGINT, lambda sig, frame: on_shutdown())
-    client.start()
+    if args.workers > 0:
+        supervisor = KATPortalSupervisor(args.workers, metrics_port=args.metrics_port, slack=args.slack,
+                                         spool_path=args.spool, archive_dir=args.archive_dir,
+                                         sensor_alerts=args.sensor_alerts)
+        signal.signal(signal.SIGINT, lambda sig, frame: on_shutdown(supervisor))
+        supervisor.start()
+    else:
+        if args.metrics_port:
+            start_metrics_server(args.metrics_port)
+        if args.spool:
+            start_spooling(get_redis(), args.spool)
+        client = BLKATPortalClient(notifier=get_notifier() if args.slack else None,
+                                   archive_dir=args.archive_dir, sensor_alerts=args.sensor_alerts)
+        signal.signal(signal.SIGINT, lambda sig, frame: on_shutdown())
+        client.start()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,98 @@
+import numpy as np
+import six
+
+
+class AntennaHealth(object):
+    """Incrementally maintained health of the antennas of one subarray
+
+    Keeps a boolean antenna x sensor matrix of raised flags (e.g.
+    'marked_faulty', 'data_suspect') together with aggregates derived from it:
+    the number of usable antennas and a bitmask of them (bit i is set when
+    antennas[i] has no flag raised). Each update touches one matrix cell and
+    adjusts the aggregates in constant time, and reports whether they changed.
+
+    Examples:
+        >>> health = AntennaHealth(['m000', 'm001'], ['marked_faulty', 'data_suspect'])
+        >>> health.update('m001_data_suspect', True)
+        True
+        >>> health.good_count, hex(health.good_mask)
+        (1, '0x1')
+        >>> health.update('m001_marked_faulty', True)  # m001 was already unusable
+        False
+    """
+
+    def __init__(self, antennas, sensors):
+        """Incrementally maintained health of the antennas of one subarray
+
+        Args:
+            antennas (list): antenna names, in the order used for the bitmask
+            sensors (list): per-antenna sensors whose truth marks an antenna unusable
+
+        Antennas start out as good until a sensor update says otherwise.
+        """
+        self.antennas = list(antennas)
+        self.sensors = list(sensors)
+        self._ant_index = dict((ant, i) for i, ant in enumerate(self.antennas))
+        self._sensor_index = dict((sensor, j) for j, sensor in enumerate(self.sensors))
+        self.flags = np.zeros((len(self.antennas), len(self.sensors)), dtype=bool)
+        self._n_flags = np.zeros(len(self.antennas), dtype=np.int32)  # raised flags per antenna
+        self.good_count = len(self.antennas)
+        self.good_mask = (1 << len(self.antennas)) - 1
+
+    def index(self, sensor_name):
+        """Returns the (antenna, sensor) matrix cell of a full sensor name
+
+        Args:
+            sensor_name (str): e.g. 'm000_marked_faulty'
+
+        Returns:
+            (int, int) or None if the sensor is not tracked
+        """
+        ant, _, sensor = sensor_name.partition('_')
+        i = self._ant_index.get(ant)
+        j = self._sensor_index.get(sensor)
+        if i is None or j is None:
+            return None
+        return i, j
+
+    def update(self, sensor_name, value):
+        """Records a new sensor value
+
+        Args:
+            sensor_name (str): full sensor name, e.g. 'm000_marked_faulty'
+            value (bool or str): the sensor value, True (or '1'/'true') if raised
+
+        Returns:
+            True if the good antenna count/mask changed, False otherwise
+        """
+        cell = self.index(sensor_name)
+        if cell is None:
+            return False
+        raised = self._as_bool(value)
+        i, j = cell
+        if self.flags[i, j] == raised:
+            return False
+        self.flags[i, j] = raised
+        if raised:
+            self._n_flags[i] += 1
+            if self._n_flags[i] == 1:  # antenna just became unusable
+                self.good_count -= 1
+                self.good_mask &= ~(1 << i)
+                return True
+        else:
+            self._n_flags[i] -= 1
+            if self._n_flags[i] == 0:  # antenna just became usable again
+                self.good_count += 1
+                self.good_mask |= 1 << i
+                return True
+        return False
+
+    def good_antennas(self):
+        """Returns the names of the antennas that have no flag raised"""
+        return [ant for i, ant in enumerate(self.antennas) if not self._n_flags[i]]
+
+    @staticmethod
+    def _as_bool(value):
+        if isinstance(value, six.string_types):
+            return value.strip().lower() in ('1', 'true')
+        return bool(value)
@@ -0,0 +1,225 @@
+"""
+Append-only, compressed archives of the metadata of an observation.
+
+The katportal client opens an archive per product on ?capture-init, streams
+every lifecycle event, sensor update and schedule block snapshot into it,
+and finalizes it on ?capture-done. An archive file is laid out as:
+
+    MAGIC
+    chunk*:  CHUNK_HEADER (compressed length, first time, last time, records)
+             zlib-compressed JSON lines, one [time, kind, name, value] per record
+    index:   zlib-compressed JSON list of [first time, last time, offset, length, records]
+    FOOTER:  (index offset, index length, INDEX_MAGIC)
+
+so a reader can find the chunks overlapping a time slice from the index (or,
+for an archive that was never finalized, by hopping from chunk header to
+chunk header) and only decompress those.
+"""
+
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+from six.moves import queue
+
+from .logger import log
+
+MAGIC = b"BLUSEARC1\n"
+INDEX_MAGIC = b"BLARCIDX"
+CHUNK_HEADER = struct.Struct('<IddI')  # compressed length, first time, last time, records
+FOOTER = struct.Struct('<QQ8s')  # index offset, index length, INDEX_MAGIC
+
+
+class ArchiveWriter(object):
+    """Streams records into an archive file from a background thread
+
+    append() only puts the record on a queue, so it can be called from the
+    ioloop. Records are compressed and written in chunks of up to
+    `chunk_records` records or `chunk_seconds` seconds.
+
+    Examples:
+        >>> archive = ArchiveWriter('array_1_bc856M4k_20181015T120000.blarc')
+        >>> archive.append('lifecycle', 'capture-init')
+        >>> archive.append('sensor', 'target', 'J1939-6342, radec, ...', timestamp)
+        >>> archive.close()  # finalizes the file in the background
+    """
+
+    POLL_INTERVAL = 1.0  # seconds between checks of whether the archive was closed
+
+    def __init__(self, path, chunk_records=1000, chunk_seconds=10.0, max_queue=100000):
+        """Streams records into an archive file from a background thread
+
+        Args:
+            path (str): the archive file to create
+            chunk_records (int): records per chunk, at most
+            chunk_seconds (float): seconds a record may wait to be written, at most
+            max_queue (int): records that may wait for the writer; further ones are dropped
+        """
+        self.path = path
+        self.chunk_records = chunk_records
+        self.chunk_seconds = chunk_seconds
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._closed = False
+        self._stop = threading.Event()  # set by close(); the writer finishes once the queue is drained
+        self._thread = threading.Thread(target=self._run, name="archive-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def append(self, kind, name, value=None, timestamp=None):
+        """Queues a record, without blocking
+
+        Args:
+            kind (str): e.g. 'lifecycle', 'sensor' or 'schedule_blocks'
+            name (str): e.g. the lifecycle event or sensor name
+            value: anything JSON-serialisable (anything else is stored as its repr)
+            timestamp (float): when the value applies --> defaults to now
+
+        Returns:
+            True if queued, False if the record was dropped
+        """
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait((time.time() if timestamp is None else timestamp, kind, name, value))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self, wait=False):
+        """Writes the remaining records and the index, then closes the file
+
+        Args:
+            wait (bool): block until the file is finalized
+        """
+        if not self._closed:
+            self._closed = True
+            self._stop.set()
+            try:
+                self._queue.put_nowait(None)  # wakes the writer
+            except queue.Full:
+                pass  # the writer checks self._stop while it waits for records
+        if wait:
+            self._thread.join()
+
+    def _run(self):
+        index = []
+        with open(self.path, 'wb') as f:
+            f.write(MAGIC)
+            chunk = []
+            deadline = None
+            while True:
+                try:
+                    timeout = self.POLL_INTERVAL
+                    if deadline is not None:
+                        timeout = max(0.0, min(timeout, deadline - time.time()))
+                    record = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    record = False
+                if record:
+                    if not chunk:
+                        deadline = time.time() + self.chunk_seconds
+                    chunk.append(record)
+                done = record is None or (record is False and self._stop.is_set() and self._queue.empty())
+                if chunk and (done or len(chunk) >= self.chunk_records or time.time() >= deadline):
+                    index.append(self._write_chunk(f, chunk))
+                    chunk = []
+                    deadline = None
+                if done:
+                    break
+            data = zlib.compress(json.dumps(index).encode('utf-8'))
+            offset = f.tell()
+            f.write(data)
+            f.write(FOOTER.pack(offset, len(data), INDEX_MAGIC))
+        if self.dropped:
+            log.warning("{} records were dropped from {}".format(self.dropped, self.path))
+        log.info("Finalized archive {}".format(self.path))
+
+    def _write_chunk(self, f, chunk):
+        lines = "\n".join(json.dumps(record, default=repr) for record in chunk)
+        data = zlib.compress(lines.encode('utf-8'))
+        first = min(record[0] for record in chunk)
+        last = max(record[0] for record in chunk)
+        offset = f.tell()
+        f.write(CHUNK_HEADER.pack(len(data), first, last, len(chunk)))
+        f.write(data)
+        f.flush()
+        return [first, last, offset, len(data), len(chunk)]
+
+
+class ArchiveReader(object):
+    """Reads time slices of an archive, decompressing only the chunks needed
+
+    Examples:
+        >>> archive = ArchiveReader('array_1_bc856M4k_20181015T120000.blarc')
+        >>> archive.start_time, archive.end_time
+        (1539604800.1, 1539608400.7)
+        >>> for t, kind, name, value in archive.read(t0, t1, kinds=['sensor']):
+        ...     print(t, name, value)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a BLUSE metadata archive".format(path))
+            self.finalized, self.index = self._read_index(f)
+
+    @property
+    def start_time(self):
+        return min(entry[0] for entry in self.index) if self.index else None
+
+    @property
+    def end_time(self):
+        return max(entry[1] for entry in self.index) if self.index else None
+
+    def read(self, t0=None, t1=None, kinds=None):
+        """Returns the records with t0 <= time <= t1, sorted by time
+
+        Args:
+            t0 (float): start of the slice --> defaults to the start of the archive
+            t1 (float): end of the slice --> defaults to the end of the archive
+            kinds (list): only return records of these kinds
+
+        Returns:
+            list of (time, kind, name, value)
+        """
+        records = []
+        with open(self.path, 'rb') as f:
+            for first, last, offset, length, n in self.index:
+                if (t0 is not None and last < t0) or (t1 is not None and first > t1):
+                    continue
+                f.seek(offset + CHUNK_HEADER.size)
+                for line in zlib.decompress(f.read(length)).decode('utf-8').split("\n"):
+                    record = tuple(json.loads(line))
+                    if ((t0 is None or record[0] >= t0) and (t1 is None or record[0] <= t1)
+                            and (kinds is None or record[1] in kinds)):
+                        records.append(record)
+        records.sort(key=lambda record: record[0])
+        return records
+
+    @staticmethod
+    def _read_index(f):
+        """Returns (finalized, index), scanning the chunk headers if there is no index"""
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size >= len(MAGIC) + FOOTER.size:
+            f.seek(size - FOOTER.size)
+            offset, length, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic == INDEX_MAGIC:
+                f.seek(offset)
+                return True, json.loads(zlib.decompress(f.read(length)).decode('utf-8'))
+        index = []
+        offset = len(MAGIC)
+        while offset + CHUNK_HEADER.size <= size:
+            f.seek(offset)
+            length, first, last, n = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+            if offset + CHUNK_HEADER.size + length > size:
+                break  # the last chunk was cut short
+            index.append([first, last, offset, length, n])
+            offset += CHUNK_HEADER.size + length
+        return False, index
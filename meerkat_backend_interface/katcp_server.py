@@ -33,20 +33,36 @@ from __future__ import print_function
 import sys
 import json
 import time
-from katcp import Sensor, AsyncDeviceServer, AsyncReply
+import hashlib
+from katcp import Sensor, AsyncDeviceServer, AsyncReply, Message
 from katcp.kattypes import request, return_reply, Int, Str
 from reynard.utils import unpack_dict
 
 import redis
-from redis_tools import REDIS_CHANNELS, write_pair_redis, write_list_redis, publish_to_redis
+from redis_tools import (
+    REDIS_CHANNELS,
+    write_pair_redis,
+    write_list_redis,
+    publish_to_redis,
+    get_redis,
+    CONTROL
+    )
 
 # to handle halt request
 from concurrent.futures import Future
 from tornado import gen
 from tornado.concurrent import chain_future
 
+from .tracing import Trace, format_alert
+from .lifecycle import ProductLifecycle, InvalidTransition, STATES, DECONFIGURED
+from .metrics import Counter
+from .redis_health import RedisHealthMonitor, start_spooling
 from .logger import log
 
+CONFIGURE_REQUESTS = Counter('katcp_configure_total', 'Configure requests accepted', ['outcome'])
+_CONFIGURE_APPLIED = CONFIGURE_REQUESTS.labels('applied')
+_CONFIGURE_UNCHANGED = CONFIGURE_REQUESTS.labels('unchanged')
+
 
 class BLBackendInterface(AsyncDeviceServer):
     """Breakthrough Listen's KATCP Server Backend Interface
@@ -73,15 +89,32 @@ class BLBackendInterface(AsyncDeviceServer):
         * request-timeout-hint (pre-standard only if protocol flags indicates
                               timeout hints, supported for KATCP v5.1 or later)
         * sensor-sampling-clear (non-standard)
+
+    Requests that are not valid in the product's lifecycle state (e.g. a
+    ?capture-start for a product that was never configured, or a ?configure
+    mid-capture) are rejected with "fail" before anything is published; see
+    lifecycle.py. The state of each product is reported by a
+    "[product_id].state" sensor.
     """
 
     VERSION_INFO = ("BLUSE-katcp-interface", 1, 0)
     BUILD_INFO = ("BLUSE-katcp-implementation", 1, 0, "rc?")
     DEVICE_STATUSES = ["ok", "fail", "degraded"]
+    DEVICE_SEVERITIES = [("ok", Sensor.NOMINAL), ("degraded", Sensor.WARN), ("fail", Sensor.ERROR)]  # least first
+    REDIS_SLOW_RTT = 0.05  # seconds; redis is degraded above this round-trip time
 
-    def __init__(self, server_host, server_port):
+    def __init__(self, server_host, server_port, notifier=None, spool_path=None):
         self.port = server_port
-        self.redis_server = redis.StrictRedis()
+        self.redis_server = get_redis()
+        self.control_server = get_redis(CONTROL)  # alerts, kept apart from sensor traffic
+        self.spool_path = spool_path  # where writes are spooled while redis is down, if set
+        self.redis_monitors = []  # redis_health.RedisHealthMonitor of each watched instance
+        self.notifier = notifier  # slack_tools.SlackNotifier for lifecycle events, if any
+        self.lifecycle = ProductLifecycle(self.redis_server)
+        self.lifecycle.load()  # before setup_sensors (called below) adds their state sensors
+        self._state_sensors = dict()  # product id --> "[product_id].state" sensor
+        self._config_hashes = dict()  # product id --> content hash of its last ?configure
+        self._device_health = dict()  # source, e.g. 'redis' --> one of DEVICE_STATUSES
         super(BLBackendInterface, self).__init__(
             server_host, server_port)
 
@@ -93,6 +126,12 @@ class BLBackendInterface(AsyncDeviceServer):
         set up.
         """
         super(BLBackendInterface, self).start()
+        on_update = lambda rtt: self.ioloop.add_callback(self._on_redis_health, rtt)
+        if self.spool_path:
+            self.redis_monitors = start_spooling(self.redis_server, self.spool_path, on_update=on_update)
+        else:
+            self.redis_monitors = [RedisHealthMonitor(self.redis_server, on_update=on_update)]
+            self.redis_monitors[0].start()
         print(R"""
                       ,'''''-._
                      ;  ,.  <> `-._
@@ -191,10 +230,19 @@ ___,-| |----''    / |         `._`-.          `----
             - subarray1_abc65555:n_channels" -> "4096" :: Redis String
             - subarray1_abc65555:proxy_name "-> "BLUSE_whatever" :: Redis String
             - subarray1_abc65555:streams" -> {....} :: Redis Hash !!!CURRENTLY A STRING!!!
+            - subarray1_abc65555:version" -> "6" :: Redis String (incremented per write)
+            - subarray1_abc65555:versions" -> {"antennas": "1", ...} :: Redis Hash (incremented per write)
             - current:obs:id -> "subbary1_abc65555"
+            - subarray1_abc65555:state" -> "configured" :: Redis String (see lifecycle.py)
+            - subarray1_abc65555:config_hash" -> "3f7a...":: Redis String (see _config_hash)
+
+        A ?configure that repeats the arguments of the product's current
+        configuration (e.g. resent by CAM after a reconnect) writes and
+        publishes nothing, and is simply acknowledged, whatever the state of
+        the product (an observation in progress is left as it is).
 
         Publishes:
-            redis-channel: 'alerts' <-- "configure"
+            redis-channel: 'alerts' <-- "configure:[product_id]:[trace_id]"
 
         Examples:
             > ?configure array_1_bc856M4k a1,a2,a3,a4 128000 {"cam.http":{"camdata":"http://monctl.devnmk.camlab.kat.ac.za/api/client/2"},"stream_type2":{"stream_name1":"stream_address1","stream_name2":"stream_address2"}} BLUSE_3
@@ -206,17 +254,37 @@ ___,-| |----''    / |         `._`-.          `----
         except Exception as e:
             log.error(e)
             return ("fail", e)
+        config_hash = self._config_hash(antennas_list, n_channels, json_dict, proxy_name)
+        if self._is_current_config(product_id, config_hash):
+            _CONFIGURE_UNCHANGED.inc()
+            log.info("Configuration of {} is unchanged; not reconfiguring".format(product_id))
+            try:
+                state = self.lifecycle.next_state(product_id, 'configure')
+            except InvalidTransition:
+                return ("ok",)  # resent during an observation, which carries on as it is
+            if self.lifecycle.state(product_id) != state:
+                self._set_state(product_id, state)
+            return ("ok",)
+        try:
+            state = self.lifecycle.next_state(product_id, 'configure')
+        except InvalidTransition as e:
+            return ("fail", str(e))
+        trace = Trace(None, product_id, 'configure', 'katcp')
         statuses = []
-        statuses.append(write_pair_redis(self.redis_server, "{}:timestamp".format(product_id), time.time()))
-        statuses.append(write_list_redis(self.redis_server, "{}:antennas".format(product_id), antennas_list))
-        statuses.append(write_pair_redis(self.redis_server, "{}:n_channels".format(product_id), n_channels))
-        statuses.append(write_pair_redis(self.redis_server, "{}:proxy_name".format(product_id), proxy_name))
-        statuses.append(write_pair_redis(self.redis_server, "{}:streams".format(product_id), json.dumps(json_dict)))
-        statuses.append(write_pair_redis(self.redis_server, "{}:cam:url".format(product_id), cam_url))
-        statuses.append(write_pair_redis(self.redis_server, "current:obs:id", product_id))
-        msg = "configure:{}".format(product_id)
-        statuses.append(publish_to_redis(self.redis_server, REDIS_CHANNELS.alerts, msg))
+        with trace.span('redis_write'):
+            statuses.append(write_pair_redis(self.redis_server, "{}:timestamp".format(product_id), time.time()))
+            statuses.append(write_list_redis(self.redis_server, "{}:antennas".format(product_id), antennas_list))
+            statuses.append(write_pair_redis(self.redis_server, "{}:n_channels".format(product_id), n_channels))
+            statuses.append(write_pair_redis(self.redis_server, "{}:proxy_name".format(product_id), proxy_name))
+            statuses.append(write_pair_redis(self.redis_server, "{}:streams".format(product_id), json.dumps(json_dict)))
+            statuses.append(write_pair_redis(self.redis_server, "{}:cam:url".format(product_id), cam_url))
+            statuses.append(write_pair_redis(self.redis_server, "current:obs:id", product_id, versioned=False))
+            statuses.append(write_pair_redis(self.redis_server, "{}:config_hash".format(product_id), config_hash))
+        statuses.append(self._publish_alert(trace))
         if all(statuses):
+            _CONFIGURE_APPLIED.inc()
+            self._config_hashes[product_id] = config_hash
+            self._set_state(product_id, state)
             return ("ok",)
         else:
             return ("fail", "Failed to publish to our local redis server")
@@ -227,15 +295,20 @@ ___,-| |----''    / |         `._`-.          `----
         """Signals that an observation will start soon
 
             Publishes a message to the 'alerts' channel of the form:
-                capture-init:product_id
-            The product_id should match what what was sent in the ?configure request
+                capture-init:product_id:trace_id
+            The product_id should match what what was sent in the ?configure request,
+            and trace_id identifies this request in the traces (see tracing.py)
 
             This alert should notify all backend processes (such as beamformer)
             to get ready for data
         """
-        msg = "capture-init:{}".format(product_id)
-        success = publish_to_redis(self.redis_server, REDIS_CHANNELS.alerts, msg)
+        try:
+            state = self.lifecycle.next_state(product_id, 'capture-init')
+        except InvalidTransition as e:
+            return ("fail", str(e))
+        success = self._publish_alert(Trace(None, product_id, 'capture-init', 'katcp'))
         if success:
+            self._set_state(product_id, state)
             return ("ok",)
         else:
             return ("fail", "Failed to publish to our local redis server")
@@ -246,15 +319,20 @@ ___,-| |----''    / |         `._`-.          `----
         """Signals that an observation is starting now
 
             Publishes a message to the 'alerts' channel of the form:
-                capture-start:product_id
-            The product_id should match what what was sent in the ?configure request
+                capture-start:product_id:trace_id
+            The product_id should match what what was sent in the ?configure request,
+            and trace_id identifies this request in the traces (see tracing.py)
 
             This alert should notify all backend processes (such as beamformer)
             that they need to be collecting data now
         """
-        msg = "capture-start:{}".format(product_id)
-        success = publish_to_redis(self.redis_server, REDIS_CHANNELS.alerts, msg)
+        try:
+            state = self.lifecycle.next_state(product_id, 'capture-start')
+        except InvalidTransition as e:
+            return ("fail", str(e))
+        success = self._publish_alert(Trace(None, product_id, 'capture-start', 'katcp'))
         if success:
+            self._set_state(product_id, state)
             return ("ok",)
         else:
             return ("fail", "Failed to publish to our local redis server")
@@ -265,15 +343,20 @@ ___,-| |----''    / |         `._`-.          `----
         """Signals that an observation is has stopped
 
             Publishes a message to the 'alerts' channel of the form:
-                capture-stop:product_id
-            The product_id should match what what was sent in the ?configure request
+                capture-stop:product_id:trace_id
+            The product_id should match what what was sent in the ?configure request,
+            and trace_id identifies this request in the traces (see tracing.py)
 
             This alert should notify all backend processes (such as beamformer)
             that they should stop collecting data now
         """
-        msg = "capture-stop:{}".format(product_id)
-        success = publish_to_redis(self.redis_server, REDIS_CHANNELS.alerts, msg)
+        try:
+            state = self.lifecycle.next_state(product_id, 'capture-stop')
+        except InvalidTransition as e:
+            return ("fail", str(e))
+        success = self._publish_alert(Trace(None, product_id, 'capture-stop', 'katcp'))
         if success:
+            self._set_state(product_id, state)
             return ("ok",)
         else:
             return ("fail", "Failed to publish to our local redis server")
@@ -284,16 +367,21 @@ ___,-| |----''    / |         `._`-.          `----
         """Signals that an observation has finished
 
             Publishes a message to the 'alerts' channel of the form:
-                capture-done:product_id
-            The product_id should match what what was sent in the ?configure request
+                capture-done:product_id:trace_id
+            The product_id should match what what was sent in the ?configure request,
+            and trace_id identifies this request in the traces (see tracing.py)
 
             This alert should notify all backend processes (such as beamformer)
             that their data streams are ending
         """
 
-        msg = "capture-done:{}".format(product_id)
-        success = publish_to_redis(self.redis_server, REDIS_CHANNELS.alerts, msg)
+        try:
+            state = self.lifecycle.next_state(product_id, 'capture-done')
+        except InvalidTransition as e:
+            return ("fail", str(e))
+        success = self._publish_alert(Trace(None, product_id, 'capture-done', 'katcp'))
         if success:
+            self._set_state(product_id, state)
             return ("ok",)
         else:
             return ("fail", "Failed to publish to our local redis server")
@@ -311,19 +399,120 @@ ___,-| |----''    / |         `._`-.          `----
             BLUSE instance, then it should disconnect at this time.
 
             Publishes a message to the 'alerts' channel of the form:
-                deconfigure:product_id
-            The product_id should match what what was sent in the ?configure request
+                deconfigure:product_id:trace_id
+            The product_id should match what what was sent in the ?configure request,
+            and trace_id identifies this request in the traces (see tracing.py)
 
             This alert should notify all backend processes (such as beamformer)
             that their data streams are ending
         """
-        msg = "deconfigure:{}".format(product_id)
-        success = publish_to_redis(self.redis_server, REDIS_CHANNELS.alerts, msg)
+        try:
+            state = self.lifecycle.next_state(product_id, 'deconfigure')
+        except InvalidTransition as e:
+            return ("fail", str(e))
+        success = self._publish_alert(Trace(None, product_id, 'deconfigure', 'katcp'))
         if success:
+            self._set_state(product_id, state)
             return ("ok",)
         else:
             return ("fail", "Failed to publish to our local redis server")
 
+    def _publish_alert(self, trace):
+        """Publishes "[stage]:[product_id]:[trace_id]" to the 'alerts' channel,
+        then writes the trace of the request
+
+        Returns:
+            True if the alert was published, False otherwise
+        """
+        msg = format_alert(trace.stage, trace.product_id, trace.trace_id)
+        with trace.span('publish'):
+            success = publish_to_redis(self.control_server, REDIS_CHANNELS.alerts, msg)
+        trace.write(self.redis_server)
+        if self.notifier is not None:
+            self.notifier.notify("{} {}".format(trace.stage, trace.product_id))  # never blocks
+        return success
+
+    def _on_redis_health(self, rtt):
+        """Updates the redis-rtt sensor and the health of redis after a redis ping
+
+        Args:
+            rtt (float): the round-trip time in seconds, or None if redis is unreachable
+        """
+        if rtt is None:
+            self._redis_rtt.set_value(0.0, Sensor.UNREACHABLE)
+            self._set_device_health('redis', "degraded")
+        elif rtt > self.REDIS_SLOW_RTT:
+            self._redis_rtt.set_value(rtt, Sensor.WARN)
+            self._set_device_health('redis', "degraded")
+        else:
+            self._redis_rtt.set_value(rtt, Sensor.NOMINAL)
+            self._set_device_health('redis', "ok")
+
+    def _set_device_health(self, source, status):
+        """Records the health of one source and sets device-status to the worst of them
+
+        Each source (e.g. 'redis') only ever changes its own entry, so one
+        recovering does not clear a status another source has raised.
+
+        Args:
+            source (str): what the status is about, e.g. 'redis'
+            status (str): one of DEVICE_STATUSES
+        """
+        self._device_health[source] = status
+        by_severity = [name for name, _ in self.DEVICE_SEVERITIES]
+        worst = max(self._device_health.values(), key=by_severity.index)
+        if self._device_status.value() != worst:
+            self._device_status.set_value(worst, dict(self.DEVICE_SEVERITIES)[worst])
+
+    @staticmethod
+    def _config_hash(antennas_list, n_channels, json_dict, proxy_name):
+        """Returns a content hash of the arguments of a ?configure request"""
+        content = json.dumps([antennas_list, n_channels, json_dict, proxy_name], sort_keys=True)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def _is_current_config(self, product_id, config_hash):
+        """Whether a configured product was configured with these exact arguments
+
+        The hash of the last ?configure is kept in memory, and read back from
+        "[product_id]:config_hash" after a restart.
+        """
+        if self.lifecycle.state(product_id) is None:
+            return False
+        if product_id not in self._config_hashes:
+            try:
+                self._config_hashes[product_id] = self.redis_server.get("{}:config_hash".format(product_id))
+            except redis.exceptions.ConnectionError:
+                return False
+        current = self._config_hashes[product_id]
+        if isinstance(current, bytes):
+            current = current.decode('utf-8')
+        return current == config_hash
+
+    def _set_state(self, product_id, state):
+        """Records the new lifecycle state of a product and updates its sensor"""
+        self.lifecycle.set_state(product_id, state)
+        sensor = self._state_sensors.get(product_id)
+        if state == DECONFIGURED:
+            self._config_hashes.pop(product_id, None)
+            if sensor is not None:
+                self.remove_sensor(self._state_sensors.pop(product_id))
+                self.mass_inform(Message.inform('interface-changed'))
+        elif sensor is None:
+            self._add_state_sensor(product_id, state)
+            self.mass_inform(Message.inform('interface-changed'))
+        else:
+            sensor.set_value(state)
+
+    def _add_state_sensor(self, product_id, state):
+        sensor = Sensor.discrete(
+            "{}.state".format(product_id),
+            description="Lifecycle state of product {}".format(product_id),
+            params=STATES,
+            default=state,
+            initial_status=Sensor.NOMINAL)
+        self._state_sensors[product_id] = sensor
+        self.add_sensor(sensor)
+
     def setup_sensors(self):
         """
         @brief    Set up monitoring sensors.
@@ -333,6 +522,10 @@ ___,-| |----''    / |         `._`-.          `----
 
                   device-status:      Reports the health status of the FBFUSE and associated devices:
                                       Among other things report HW failure, SW failure and observation failure.
+                  redis-rtt:          Round-trip time of the local redis server; redis counts as
+                                      degraded in device-status while it is above REDIS_SLOW_RTT or
+                                      redis is unreachable.
+                  [product_id].state: Lifecycle state of each configured product (see lifecycle.py)
         """
         self._device_status = Sensor.discrete(
             "device-status",
@@ -356,6 +549,17 @@ ___,-| |----''    / |         `._`-.          `----
             initial_status=Sensor.NOMINAL)
         self.add_sensor(self._version)
 
+        self._redis_rtt = Sensor.float(
+            "redis-rtt",
+            description="Round-trip time of a PING to the local redis server",
+            unit="s",
+            default=0.0,
+            initial_status=Sensor.UNKNOWN)
+        self.add_sensor(self._redis_rtt)
+
+        for product_id, state in self.lifecycle.states.items():
+            self._add_state_sensor(product_id, state)
+
     def request_halt(self, req, msg):
         """Halts the server, logs to syslog and slack, and exits the program
         Returns
@@ -1,20 +1,61 @@
 from __future__ import print_function
 
+import json
+import logging
+import os
+import re
 import tornado.gen
+import tornado.ioloop
 import uuid
 from katportalclient import KATPortalClient
 from katportalclient.client import SensorNotFoundError
-import redis
+import random
+import threading
+import time
 from functools import partial
+from six.moves.urllib.parse import urlparse
 
 from .redis_tools import (
     REDIS_CHANNELS,
     write_pair_redis,
     write_list_redis,
-    publish_to_redis
+    write_hash_redis,
+    publish_to_redis,
+    get_redis,
+    CONTROL,
+    SENSOR,
+    METADATA,
+    sensor_class
     )
-    
-from .logger import log as logger
+from .antenna_health import AntennaHealth
+from .target_tools import parse_target_description, target_to_hash, DEGREES_TO_RAD
+from .pointing import PointingBuffer
+from .sensor_filter import SensorUpdateFilter
+from .scheduler import PriorityScheduler, PRIORITIES, PRIORITY_NAMES
+from .sharding import worker_channel
+from .metrics import Counter, Gauge, Histogram
+from .tracing import Trace, parse_alert
+from .archive import ArchiveWriter
+from .sensor_channels import publish_sensor_updates
+from .sensor_plans import SensorQueryPlanner
+from .schedule_blocks import ScheduleBlockTracker, schedule_block_channel
+from .logger import log as logger, RateLimit
+
+ALERTS_RECEIVED = Counter('katportal_alerts_total', 'Alerts received', ['type'])
+SENSOR_UPDATES = Counter('katportal_sensor_updates_total',
+                         'Sensor updates from the portal websockets', ['outcome'])
+_UPDATES_RECEIVED = SENSOR_UPDATES.labels('received')
+_UPDATES_WRITTEN = SENSOR_UPDATES.labels('written')
+_UPDATES_DROPPED = SENSOR_UPDATES.labels('dropped')
+CAM_QUERY_LATENCY = Histogram('katportal_cam_query_seconds', 'Latency of CAM portal queries', ['query'])
+CAM_DEADLINE_MISSES = Counter('katportal_cam_deadline_misses_total',
+                              'CAM portal queries abandoned at their deadline', ['query'])
+QUEUE_DEPTH = Gauge('katportal_queue_depth', 'Alerts waiting to be handled', ['priority'])
+ACTIVE_PRODUCTS = Gauge('katportal_active_products', 'Products with a portal client')
+STAGE_SENSOR_VALUES = Counter('katportal_stage_sensor_values_total',
+                              'Sensor values written at lifecycle stages, by where they came from', ['source'])
+_ANTENNA_SENSOR = re.compile(r'^m\d{3}_')  # e.g. m000_target
+_NO_POINTING = PointingBuffer(capacity=1, target_capacity=1)  # stands in for the buffer of unknown products
 
 class BLKATPortalClient(object):
     """Our client server to the Katportal
@@ -28,13 +69,16 @@ class BLKATPortalClient(object):
     Once initialized, the client creates a Tornado ioloop and
     a connection to the local Redis server.
 
-    When start() is called, a loop starts that subscribes to the 'alerts'
-    channel of the Redis server. Depending on the message received, various
-    processes are run (asynchronously?). These include:
+    When start() is called, a thread starts that subscribes to the 'alerts'
+    channel of the Redis server, and the ioloop is started. Depending on the
+    message received, various coroutines are scheduled on the ioloop (see
+    MSG_SCHEDULING: capture-start/stop go ahead of everything else, and
+    a product's own alerts are handled in order). These include:
         1. Creating a new KATPortalClient object specific to the
             product id we just received in a ?configure request
         2. Querying for schedule block information when ?capture-init is
-            received and publishing this to Redis
+            received and publishing this to Redis, then refreshing it
+            every SCHEDULE_REFRESH_INTERVAL and publishing what changed
         3. Querying for target information when ?capture-start is
             received and publishing this to Redis
         4. Deleting the corresponding KATPortalClient object when
@@ -46,14 +90,96 @@ class BLKATPortalClient(object):
 
     VERSION = 1.0
 
-    def __init__(self):
-        """Our client server to the Katportal"""
-        self.redis_server = redis.StrictRedis()
-        self.p = self.redis_server.pubsub(ignore_subscribe_messages=True)
+    # msg_type --> (priority class, seconds within which its handler should start)
+    MSG_SCHEDULING = {
+        'configure'    : (PRIORITIES.configure, 10.0),
+        'capture-init' : (PRIORITIES.schedule, 10.0),
+        'capture-start': (PRIORITIES.capture, 1.0),
+        'capture-stop' : (PRIORITIES.capture, 1.0),
+        'capture-done' : (PRIORITIES.configure, 10.0),
+        'deconfigure'  : (PRIORITIES.configure, 10.0)
+    }
+
+    # lifecycle stage --> seconds within which its CAM queries must complete
+    CAM_DEADLINES = {
+        'configure'    : 10.0,
+        'capture-init' : 10.0,
+        'capture-start': 2.0,  # recorders are waiting on the target metadata
+        'capture-stop' : 2.0,
+        'capture-done' : 5.0,
+        'deconfigure'  : 5.0,
+        None           : 10.0  # anything else
+    }
+
+    # seconds between reconnect attempts: doubling from BASE up to MAX, +-50% jitter
+    RECONNECT_BASE_DELAY = 0.5
+    RECONNECT_MAX_DELAY = 30.0
+
+    # seconds sensor updates are held so that those of the same group are published together
+    SENSOR_BATCH_WINDOW = 0.02
+
+    # seconds between checks of the schedule blocks assigned to each product, and
+    # after which an unchanged block id is fetched again to notice edits
+    SCHEDULE_REFRESH_INTERVAL = 10.0
+    SCHEDULE_REVALIDATE_INTERVAL = 60.0
+
+    def __init__(self, worker_id=None, notifier=None, archive_dir=None, sensor_alerts=True):
+        """Our client server to the Katportal
+
+        Args:
+            worker_id (int): when run as one of several worker processes (see
+                sharding.KATPortalSupervisor), the id of this worker. Alerts are
+                then read from the worker's own channel and statistics are
+                written under "katportal:worker[id]:*" rather than "katportal:*".
+            notifier (slack_tools.SlackNotifier): posts changes in the number
+                of good antennas to slack, if given
+            archive_dir (str): directory to write an archive of each
+                observation's metadata to (see _open_archive) --> None disables archiving
+            sensor_alerts (bool): also publish every sensor update on the
+                'sensor_alerts' channel, for consumers of the old format
+                (updates are always published on the "sensors:*" channels, see sensor_channels.py)
+        """
+        self.notifier = notifier
+        self.archive_dir = archive_dir
+        self.archives = dict()  # product id --> archive.ArchiveWriter of its current observation
+        self.sensor_alerts = sensor_alerts
+        self._pending_updates = dict()  # product id --> (sensor name, value, timestamp) to publish
+        self._publish_scheduled = False
+        if worker_id is None:
+            self.alert_channel = REDIS_CHANNELS.alerts
+            self.stats_prefix = "katportal"
+        else:
+            self.alert_channel = worker_channel(worker_id)
+            self.stats_prefix = "katportal:worker{}".format(worker_id)
+        self.redis_server = get_redis()
+        self.sensor_server = get_redis(SENSOR)  # the sensor update firehose
+        self.p = get_redis(CONTROL, listener=True).pubsub(ignore_subscribe_messages=True)
         self.io_loop = io_loop = tornado.ioloop.IOLoop.current()
         self.subarray_katportals = dict()  # indexed by product id's
         self.ant_sensors = ['marked_faulty', 'data_suspect']  # sensors required from each antenna
-        self.async_sensor_list = []  # will be populated with sensors for subscription
+        self.sensor_plan = SensorQueryPlanner()  # which sensors each stage reads (see sensor_plans.py)
+        self.antenna_health = dict()  # indexed by product id's
+        self.pointing_buffers = dict()  # indexed by product id's
+        self.update_filter = SensorUpdateFilter()  # drops updates that carry no meaningful change
+        self._update_log_limit = RateLimit(interval=10.0)  # debug log each sensor's updates at most every 10 s
+        self._filter_flusher = tornado.ioloop.PeriodicCallback(self._flush_filtered_updates, 1000)
+        self.scheduler = PriorityScheduler(self.io_loop, host_limit=2)  # at most 2 concurrent jobs per CAM host
+        self._stats_writer = tornado.ioloop.PeriodicCallback(self._write_stats, 5000)
+        for priority, name in PRIORITY_NAMES.items():
+            QUEUE_DEPTH.labels(name).set_function(partial(self._queue_depth, priority))
+        ACTIVE_PRODUCTS.set_function(lambda: len(self.subarray_katportals))
+        self.deadline_misses = dict()  # CAM query type --> number of missed deadlines
+        self.sensor_value_cache = dict()  # product id --> sensor name --> last fetched value
+        self._sensor_queries = dict()  # (product id, sensor name) --> sensor_value query in flight
+        self.sensor_name_cache = dict()  # (product id, patterns) --> last resolved sensor names
+        self.schedule_blocks = ScheduleBlockTracker(self.SCHEDULE_REVALIDATE_INTERVAL)  # see schedule_blocks.py
+        self._schedule_refreshes = set()  # product ids with a schedule block refresh queued or running
+        self._schedule_refresher = tornado.ioloop.PeriodicCallback(self._refresh_schedules,
+                                                                   self.SCHEDULE_REFRESH_INTERVAL * 1000)
+        self.subscribed_sensors = dict()  # product id --> set of the sensor names subscribed to
+        self.reconnect_stats = dict()  # product id --> see _reconnect
+        self._reconnecting = set()  # product ids with a reconnect in progress
+        self._connection_supervisor = tornado.ioloop.PeriodicCallback(self._supervise_connections, 1000)
 
     def MSG_TO_FUNCTION(self, msg_type):
         MSG_TO_FUNCTION_DICT = {
@@ -66,21 +192,150 @@ class BLKATPortalClient(object):
         }
         return MSG_TO_FUNCTION_DICT.get(msg_type, self._other)
 
-    def start(self):
-        self.p.subscribe(REDIS_CHANNELS.alerts)
+    def start(self, ready=None):
+        """Listens for alerts and runs the ioloop until stopped
+
+        Args:
+            ready (multiprocessing.Event): set once the alert channel is
+                subscribed, so that alerts published from then on are received
+
+        Returns:
+            None
+        """
+        self.p.subscribe(self.alert_channel)
+        if ready is not None:
+            self._wait_subscribed()
+            ready.set()
         self._print_start_image()
+        listener = threading.Thread(target=self._listen, name="alert-listener")
+        listener.daemon = True
+        listener.start()
+        self._stats_writer.start()
+        self.io_loop.start()
+
+    def _wait_subscribed(self, timeout=10.0):
+        """Waits until redis has registered the subscription to the alert channel"""
+        control_server = get_redis(CONTROL)
+        give_up = time.time() + timeout
+        while time.time() < give_up:
+            if sum(count for _, count in control_server.pubsub_numsub(self.alert_channel)):
+                return
+            time.sleep(0.01)
+        logger.warning("Subscription to {} not confirmed after {} s".format(self.alert_channel, timeout))
+
+    def _listen(self):
+        """Hands every alert over to the ioloop thread (runs on its own thread)"""
         for message in self.p.listen():
-            msg_parts = message['data'].split(':')
-            if len(msg_parts) != 2:
-                logger.info("Not processing this message --> {}".format(message))
-                continue
-            msg_type = msg_parts[0]
-            product_id = msg_parts[1]
-            self.MSG_TO_FUNCTION(msg_type)(product_id)
+            self.io_loop.add_callback(self._on_alert, message)
+
+    def _on_alert(self, message):
+        """Schedules the handler of an alert by its priority class
+
+        Args:
+            message (dict): the message received on the 'alerts' channel
+
+        Returns:
+            None
+        """
+        alert = parse_alert(message['data'])
+        if alert is None:
+            logger.info("Not processing this message --> {}".format(message))
+            return
+        msg_type, product_id, trace_id = alert
+        ALERTS_RECEIVED.labels(msg_type).inc()
+        if msg_type not in self.MSG_SCHEDULING:
+            self._other(product_id, msg_type)
+            return
+        trace = Trace(trace_id, product_id, msg_type, 'katportal')
+        priority, deadline = self.MSG_SCHEDULING[msg_type]
+        self.scheduler.submit(priority, product_id, self._traced, self.MSG_TO_FUNCTION(msg_type),
+                              product_id, trace, host=self._cam_host(product_id), deadline=deadline)
+
+    @tornado.gen.coroutine
+    def _traced(self, handler, product_id, trace):
+        """Runs the handler of an alert, then writes its trace
+
+        The 'dispatch' span covers the time from the alert being received
+        to its handler starting; the handler records its own spans.
+        """
+        trace.add_span('dispatch', trace.created)
+        if trace.stage == 'capture-init':
+            self._open_archive(product_id)
+        archive = self.archives.get(product_id)
+        if archive is not None:
+            archive.append('lifecycle', trace.stage, trace.trace_id)
+        try:
+            yield handler(product_id, trace)
+        finally:
+            if trace.stage in ('capture-done', 'deconfigure'):
+                self._close_archive(product_id)
+            trace.write(self.redis_server)
+
+    def _open_archive(self, product_id):
+        """Starts a new metadata archive for the product's observation
+
+        Every lifecycle event, sensor update and schedule block snapshot of
+        the product is streamed into [archive_dir]/[product_id]_[UTC time].blarc
+        until ?capture-done (see archive.py).
+        """
+        if not self.archive_dir:
+            return
+        self._close_archive(product_id)
+        path = os.path.join(self.archive_dir, "{}_{}.blarc".format(
+            product_id, time.strftime("%Y%m%dT%H%M%S", time.gmtime())))
+        try:
+            if not os.path.isdir(self.archive_dir):
+                os.makedirs(self.archive_dir)
+            self.archives[product_id] = ArchiveWriter(path)
+        except (IOError, OSError) as e:
+            logger.error("Could not open archive {}: {}".format(path, e))
+            return
+        logger.info("Archiving the metadata of {} to {}".format(product_id, path))
+
+    def _close_archive(self, product_id):
+        """Finalizes the product's archive, if any, in the background"""
+        archive = self.archives.pop(product_id, None)
+        if archive is not None:
+            archive.close()
+
+    def _cam_host(self, product_id):
+        """Returns the host of the product's CAM portal (or None if unknown)"""
+        cam_url = self.redis_server.get("{}:cam:url".format(product_id))
+        return urlparse(cam_url).netloc if cam_url else None
+
+    def _queue_depth(self, priority):
+        """Number of alerts of a priority class waiting to be handled"""
+        return self.scheduler.stats().get(priority, {}).get('depth', 0)
+
+    def _write_stats(self):
+        """Publishes the scheduler's queue depths and wait times, and the
+        number of missed CAM query deadlines, to redis
+
+        Writes:
+            - katportal:scheduler :: Redis Hash of "[priority]:[stat]" --> value,
+                e.g. "capture:depth" --> "0", "schedule:wait_max" --> "0.52"
+            - katportal:deadline_misses :: Redis Hash of query type --> count
+            - katportal:reconnects :: Redis Hash of "[product_id]:[stat]" --> value (see _reconnect)
+        """
+        mapping = dict()
+        for priority, stats in self.scheduler.stats().items():
+            for stat, value in stats.items():
+                mapping["{}:{}".format(PRIORITY_NAMES[priority], stat)] = value
+        if mapping:
+            write_hash_redis(self.redis_server, "{}:scheduler".format(self.stats_prefix), mapping, versioned=False)
+        if self.deadline_misses:
+            write_hash_redis(self.redis_server, "{}:deadline_misses".format(self.stats_prefix), self.deadline_misses, versioned=False)
+        mapping = dict()
+        for product_id, stats in self.reconnect_stats.items():
+            for stat, value in stats.items():
+                mapping["{}:{}".format(product_id, stat)] = value
+        if mapping:
+            write_hash_redis(self.redis_server, "{}:reconnects".format(self.stats_prefix), mapping, versioned=False)
 
     def on_update_callback_fn(self, product_id, msg):
         """Handler for messages published over sensor websockets.
-        The received sensor values are stored in the redis database.
+        The received sensor values are stored in the redis database,
+        unless self.update_filter finds they carry no meaningful change.
 
         Args:
             product_id (str): the product id given in the ?configure request
@@ -89,17 +344,182 @@ class BLKATPortalClient(object):
         Returns:
             None
         """
-        for key, value in msg.items():
-            if key == 'msg_data':
-                sensor_name = msg['msg_data']['name']
-                sensor_value = msg['msg_data']['value']
-                if sensor_name in self.async_sensor_list:
-                    key = "{}:{}".format(product_id, sensor_name)
-                    write_pair_redis(self.redis_server, key, repr(sensor_value)) # ultimately this line may not be needed
-                    publish_to_redis(self.redis_server, REDIS_CHANNELS.sensor_alerts, '{}:{}'.format(sensor_name, sensor_value))
-                    print('Sensor value stored: {} = {}'.format(sensor_name, sensor_value))
+        msg_data = msg.get('msg_data')
+        if msg_data is None:
+            return
+        sensor_name = msg_data['name']
+        sensor_value = msg_data['value']
+        _UPDATES_RECEIVED.inc()
+        if self.sensor_plan.is_subscribed(product_id, sensor_name):
+            self.sensor_plan.record(product_id, sensor_name, {
+                'timestamp': msg_data.get('received_timestamp'), 'value_timestamp': msg_data.get('timestamp'),
+                'value': sensor_value, 'status': msg_data.get('status'), 'stale': False})
+        if sensor_name in self.subscribed_sensors.get(product_id, ()):
+            if self.update_filter.accept(product_id, sensor_name, sensor_value, msg_data.get('status')):
+                self._store_sensor_update(product_id, sensor_name, sensor_value, msg_data.get('timestamp'))
+            else:
+                _UPDATES_DROPPED.inc()
+        else:
+            _UPDATES_DROPPED.inc()
+            if logger.isEnabledFor(logging.DEBUG) and self._update_log_limit.allow(sensor_name) is not None:
+                logger.debug("Unlisted sensor %s; value discarded", sensor_name)
+
+    def _store_sensor_update(self, product_id, sensor_name, sensor_value, timestamp=None):
+        """Writes and publishes a sensor update that passed the update filter
+
+        Args:
+            product_id (str): the product id given in the ?configure request
+            sensor_name (str): the name of the sensor
+            sensor_value: the new value of the sensor
+            timestamp (float): when the value was sampled, if known
+
+        Returns:
+            None
+        """
+        key = "{}:{}".format(product_id, sensor_name)
+        _UPDATES_WRITTEN.inc()
+        archive = self.archives.get(product_id)
+        if archive is not None:
+            archive.append('sensor', sensor_name, sensor_value, timestamp)
+        self._write_sensor_value(product_id, sensor_name, sensor_value) # ultimately this line may not be needed
+        self._pending_updates.setdefault(product_id, []).append((sensor_name, sensor_value, timestamp))
+        if not self._publish_scheduled:
+            self._publish_scheduled = True
+            self.io_loop.call_later(self.SENSOR_BATCH_WINDOW, self._publish_sensor_updates)
+        if self.sensor_alerts:
+            publish_to_redis(self.sensor_server, REDIS_CHANNELS.sensor_alerts, '{}:{}'.format(sensor_name, sensor_value))
+        if logger.isEnabledFor(logging.DEBUG):
+            suppressed = self._update_log_limit.allow(key)
+            if suppressed is not None:
+                logger.debug("Sensor value stored: %s = %s (%d updates not logged)", key, sensor_value, suppressed)
+        self._update_antenna_health(product_id, sensor_name, sensor_value)
+        self._store_structured(product_id, sensor_name, sensor_value, timestamp)
+
+    def _write_sensor_value(self, product_id, sensor_name, value):
+        """Writes "[product_id]:[sensor_name]" to the redis instance of the sensor's traffic class"""
+        server = self.redis_server if sensor_class(sensor_name) == METADATA else self.sensor_server
+        write_pair_redis(server, "{}:{}".format(product_id, sensor_name), repr(value))
+
+    def _publish_sensor_updates(self):
+        """Publishes the sensor updates stored in the last SENSOR_BATCH_WINDOW,
+        batched per product and sensor group (see sensor_channels.py)"""
+        pending, self._pending_updates = self._pending_updates, dict()
+        self._publish_scheduled = False
+        for product_id, updates in pending.items():
+            publish_sensor_updates(self.sensor_server, product_id, updates)
+
+    def _flush_filtered_updates(self):
+        """Stores updates that the update filter held back for min_interval"""
+        for product_id, sensor_name, sensor_value, status in self.update_filter.flush_due():
+            self._store_sensor_update(product_id, sensor_name, sensor_value)
+
+    def _update_antenna_health(self, product_id, sensor_name, sensor_value):
+        """Feeds an antenna sensor update into the product's health matrix,
+        and publishes the good antenna count and bitmask when they change.
+
+        Args:
+            product_id (str): the product id given in the ?configure request
+            sensor_name (str): e.g. 'm000_marked_faulty'
+            sensor_value: the new value of the sensor
+
+        Returns:
+            None
+        """
+        health = self.antenna_health.get(product_id)
+        if health is None or not health.update(sensor_name, sensor_value):
+            return
+        self._publish_antenna_health(product_id, health)
+
+    def _publish_antenna_health(self, product_id, health):
+        """Writes and publishes the good antenna count and bitmask of a product"""
+        mask = hex(health.good_mask).rstrip('L')
+        write_pair_redis(self.redis_server, "{}:good_antennas".format(product_id), health.good_count)
+        write_pair_redis(self.redis_server, "{}:good_antennas_mask".format(product_id), mask)
+        publish_to_redis(self.redis_server, REDIS_CHANNELS.antenna_health,
+                         '{}:{}:{}'.format(product_id, health.good_count, mask))
+        if self.notifier is not None:
+            self.notifier.notify("{}: {} of {} antennas usable ({} changed)".format(
+                product_id, health.good_count, len(health.antennas), sensor_name))
+
+    def _store_structured(self, product_id, sensor_name, sensor_value, timestamp=None):
+        """Parses target and pointing sensor values once, at ingest, and
+        stores them as hashes so consumers don't have to re-parse the reprs.
+
+        Writes:
+            - [product_id]:target_info :: Redis Hash (see target_tools.target_to_hash)
+            - [product_id]:pointing :: Redis Hash with 'ra' and 'dec' in radians
+
+        Only the subarray's own sensors are stored this way; those of its
+        antennas (e.g. 'm000_target') would overwrite each other.
+
+        Args:
+            product_id (str): the product id given in the ?configure request
+            sensor_name (str): the name of the sensor, e.g. 'target'
+            sensor_value: the raw value of the sensor
+            timestamp (float): when the value was sampled, if known
+
+        Returns:
+            None
+        """
+        if _ANTENNA_SENSOR.match(sensor_name):
+            return
+        buf = self.pointing_buffers.get(product_id)
+        if sensor_name == 'target' or sensor_name.endswith('_target'):
+            try:
+                target = parse_target_description(sensor_value)
+            except (ValueError, AttributeError) as e:
+                logger.warning("Could not parse target {!r}: {}".format(sensor_value, e))
+                return
+            write_hash_redis(self.redis_server, "{}:target_info".format(product_id),
+                             target_to_hash(target, sensor_value))
+            if buf is not None:
+                buf.add_target(timestamp or time.time(), target)
+        elif sensor_name.endswith('pos_request_base_ra') or sensor_name.endswith('pos_request_base_dec'):
+            try:
+                angle = float(sensor_value) * DEGREES_TO_RAD
+            except (TypeError, ValueError):
+                logger.warning("Could not parse {} value {!r}".format(sensor_name, sensor_value))
+                return
+            field = 'ra' if sensor_name.endswith('_ra') else 'dec'
+            mapping = {field: repr(angle)}
+            if timestamp is not None:
+                mapping[field + '_timestamp'] = repr(timestamp)
+            write_hash_redis(self.redis_server, "{}:pointing".format(product_id), mapping, replace=False)
+            if buf is not None:
+                if field == 'ra':
+                    buf.add_ra(timestamp or time.time(), angle)
                 else:
-                    print('Unlisted sensor; value discarded')
+                    buf.add_dec(timestamp or time.time(), angle)
+
+    def interpolate_pointing(self, product_id, timestamps):
+        """Interpolates the pointing of a product's subarray at many timestamps
+
+        Args:
+            product_id (str): the product id given in the ?configure request
+            timestamps (array-like): UNIX timestamps of e.g. data blocks
+
+        Returns:
+            (ra, dec): NumPy arrays in radians, NaN outside the buffered history
+            (so all NaN for a product that is not configured)
+
+        Examples:
+            >>> ra, dec = client.interpolate_pointing(product_id, block_timestamps)
+        """
+        return self.pointing_buffers.get(product_id, _NO_POINTING).interpolate(timestamps)
+
+    def targets_between(self, product_id, start_time, end_time):
+        """Lists the parsed targets (see target_tools) active between two times
+
+        Args:
+            product_id (str): the product id given in the ?configure request
+            start_time (float): UNIX timestamp of the start of the range
+            end_time (float): UNIX timestamp of the end of the range
+
+        Returns:
+            list of (timestamp, target) pairs, where timestamp is when the target became active
+            (empty for a product that is not configured)
+        """
+        return self.pointing_buffers.get(product_id, _NO_POINTING).targets_between(start_time, end_time)
 
     def gen_ant_sensor_list(self, product_id, ant_sensors):
         """Automatically builds a list of sensor names for each antenna.
@@ -130,19 +550,141 @@ class BLKATPortalClient(object):
         Returns:
             None
         """
-        self.async_sensor_list = self.async_sensor_list + self.gen_ant_sensor_list(product_id, self.ant_sensors)
-        yield self.subarray_katportals[product_id].connect()
+        if product_id not in self.antenna_health:
+            # kept across capture-inits: the flags raised so far stay valid, and
+            # repeats of an unchanged sensor value need not arrive again
+            ant_key = '{}:antennas'.format(product_id)
+            self.antenna_health[product_id] = AntennaHealth(
+                self.redis_server.lrange(ant_key, 0, -1), self.ant_sensors)
+            self._publish_antenna_health(product_id, self.antenna_health[product_id])
+        self.pointing_buffers.setdefault(product_id, PointingBuffer())
+        if not self._filter_flusher.is_running():
+            self._filter_flusher.start()
+        client = self.subarray_katportals[product_id]
+        deadline = self._stage_deadline('capture-init')
+        try:
+            yield self._with_deadline('connect', deadline, client.connect())
+        except tornado.gen.TimeoutError:
+            logger.warning("Could not connect to the portal of {} in time; not subscribing".format(product_id))
+            return
+        yield self._resolve_sensor_plan(product_id, deadline)
+        # rebuilt on every subscribe, so sensors dropped from the plan stop being stored
+        self.subscribed_sensors[product_id] = set(self.gen_ant_sensor_list(product_id, self.ant_sensors)
+                                                  + self.sensor_plan.subscribed_names(product_id))
+        if not self._connection_supervisor.is_running():
+            self._connection_supervisor.start()
+        try:
+            yield self._restore_subscriptions(product_id, deadline)
+        except tornado.gen.TimeoutError:
+            # _reconnect keeps retrying the subscription, with backoff
+            logger.warning("Could not subscribe to the sensors of {} in time; retrying".format(product_id))
+            if product_id not in self._reconnecting:
+                self._reconnecting.add(product_id)
+                self.io_loop.add_callback(self._reconnect, product_id)
+
+    @tornado.gen.coroutine
+    def _restore_subscriptions(self, product_id, deadline):
+        """Subscribes to all of a product's sensors in one batch, on a new namespace
+
+        Args:
+            product_id (str): the product id given in the ?configure request
+            deadline (float): absolute deadline, in self.io_loop.time() terms
+
+        Returns:
+            None
+
+        Raises:
+            tornado.gen.TimeoutError if the deadline passed first
+        """
+        client = self.subarray_katportals[product_id]
+        sensors = sorted(self.subscribed_sensors[product_id])
         namespace = 'namespace_' + str(uuid.uuid4())
-        result = yield self.subarray_katportals[product_id].subscribe(namespace)
-        for sensor in self.async_sensor_list:
-            result = yield self.subarray_katportals[product_id].set_sampling_strategies(namespace, sensor, 'event')
-            print('Subscribed to sensor: {}'.format(sensor))
+        result = yield self._with_deadline('subscribe', deadline, client.subscribe(namespace))
+        result = yield self._with_deadline('set_sampling_strategies', deadline,
+                                           client.set_sampling_strategies(namespace, sensors, 'event'))
+        print('Subscribed to {} sensors for {}'.format(len(sensors), product_id))
+
+    def _supervise_connections(self):
+        """Starts a reconnect for every product whose portal websocket has dropped"""
+        for product_id in self.subscribed_sensors:
+            client = self.subarray_katportals.get(product_id)
+            if client is None or client.is_connected or product_id in self._reconnecting:
+                continue
+            self._reconnecting.add(product_id)
+            self.io_loop.add_callback(self._reconnect, product_id)
 
-    def _configure(self, product_id):
+    @tornado.gen.coroutine
+    def _reconnect(self, product_id):
+        """Reconnects a product's portal client, restores its subscriptions,
+        and fetches every subscribed sensor to fill in the updates missed
+        while disconnected. Retries with jittered exponential backoff.
+
+        Records, in self.reconnect_stats[product_id]:
+            - reconnects: number of completed reconnects
+            - attempts: number of failed reconnect attempts
+            - last_gap / max_gap: seconds from noticing the drop to being consistent again
+            - last_recovery: seconds from the successful connect to being consistent again
+            - last_filled: number of sensors whose value was refreshed by the gap-fill
+
+        Args:
+            product_id (str): the product id given in the ?configure request
+
+        Returns:
+            None
+        """
+        dropped_at = time.time()
+        stats = self.reconnect_stats.setdefault(product_id, {
+            'reconnects': 0, 'attempts': 0, 'last_gap': 0.0, 'max_gap': 0.0,
+            'last_recovery': 0.0, 'last_filled': 0})
+        logger.warning("Portal connection of {} dropped; reconnecting".format(product_id))
+        attempt = 0
+        try:
+            while True:
+                delay = min(self.RECONNECT_MAX_DELAY, self.RECONNECT_BASE_DELAY * 2 ** attempt)
+                yield tornado.gen.sleep(delay * random.uniform(0.5, 1.5))
+                if product_id not in self.subscribed_sensors:
+                    return  # deconfigured in the meantime
+                client = self.subarray_katportals[product_id]
+                attempt += 1
+                try:
+                    deadline = self._stage_deadline(None)
+                    if not client.is_connected:
+                        yield self._with_deadline('connect', deadline, client.connect())
+                    connected_at = time.time()
+                    yield self._restore_subscriptions(product_id, deadline)
+                    values = yield dict((sensor_name, self._get_sensor_value(product_id, sensor_name, deadline))
+                                        for sensor_name in self.subscribed_sensors[product_id])
+                except Exception as e:
+                    stats['attempts'] += 1
+                    logger.warning("Reconnect attempt {} for {} failed: {}".format(attempt, product_id, e))
+                    continue
+                filled = 0
+                for sensor_name, value in values.items():
+                    if value is None or value['stale']:
+                        continue
+                    filled += 1
+                    if self.update_filter.accept(product_id, sensor_name, value['value'], value['status']):
+                        self._store_sensor_update(product_id, sensor_name, value['value'],
+                                                  value['value_timestamp'])
+                now = time.time()
+                stats['reconnects'] += 1
+                stats['last_gap'] = now - dropped_at
+                stats['max_gap'] = max(stats['max_gap'], stats['last_gap'])
+                stats['last_recovery'] = now - connected_at
+                stats['last_filled'] = filled
+                logger.info("Reconnected {} after {:.1f} s; filled {} sensors".format(
+                    product_id, stats['last_gap'], filled))
+                return
+        finally:
+            self._reconnecting.discard(product_id)
+
+    @tornado.gen.coroutine
+    def _configure(self, product_id, trace):
         """Executes when configure request is processed
 
         Args:
             product_id (str): the product id given in the ?configure request
+            trace (tracing.Trace): records the time spent on the request
 
         Returns:
             None
@@ -152,59 +694,70 @@ class BLKATPortalClient(object):
         #client = KATPortalClient(cam_url, on_update_callback=lambda x: self.on_update_callback_fn(product_id), logger=logger)
         self.subarray_katportals[product_id] = client
         logger.info("Created katportalclient object for : {}".format(product_id))
-        sensors_to_query = []  # TODO: add sensors to query on ?configure
-        sensors_and_values = self.io_loop.run_sync(
-            lambda: self._get_sensor_values(product_id, sensors_to_query))
-        for sensor_name, value in sensors_and_values.items():
-            key = "{}:{}".format(product_id, sensor_name)
-            write_pair_redis(self.redis_server, key, repr(value))
-
-    def _capture_init(self, product_id):
+        with trace.span('cam:sensor_values'):
+            sensors_and_values = yield self._get_stage_sensor_values(product_id, 'configure')
+        with trace.span('redis_write'):
+            for sensor_name, value in sensors_and_values.items():
+                self._write_sensor_value(product_id, sensor_name, value)
+
+    @tornado.gen.coroutine
+    def _capture_init(self, product_id, trace):
         """Responds to capture-init request by getting schedule blocks
 
         Args:
             product_id (str): the product id given in the ?configure request
+            trace (tracing.Trace): records the time spent on the request
 
         Returns:
             None
         """
-        schedule_blocks = self.io_loop.run_sync(lambda: self._get_future_targets(product_id))
-        key = "{}:schedule_blocks".format(product_id)
-        write_list_redis(self.redis_server, key, repr(schedule_blocks))  # overrides previous list
-        # Start io_loop to listen to sensors whose values should be registered
+        # refreshed periodically from now on, even if this first fetch misses its deadline
+        self.schedule_blocks.track(product_id)
+        with trace.span('cam:schedule_blocks'):
+            diffs = yield self._update_schedule_blocks(product_id, 'capture-init')
+        with trace.span('redis_write'):
+            self._write_schedule_blocks(product_id, diffs)
+        if not self._schedule_refresher.is_running():
+            self._schedule_refresher.start()
+        # Subscribe to sensors whose values should be registered
         # immediately when they change.
-        self.io_loop.add_callback(lambda: self.subscribe_sensors(product_id))
-        self.io_loop.start()
-        # Once off sensor values
-        sensors_to_query = []  # TODO: add sensors to query on ?capture_init
-        sensors_and_values = self.io_loop.run_sync(
-            lambda: self._get_sensor_values(product_id, sensors_to_query))
-        for sensor_name, value in sensors_and_values.items():
-            key = "{}:{}".format(product_id, sensor_name)
-            write_pair_redis(self.redis_server, key, repr(value))
-
-    def _capture_start(self, product_id):
+        with trace.span('subscribe'):
+            yield self.subscribe_sensors(product_id)
+        # Once off sensor values (see sensor_plans.STAGE_SENSORS)
+        with trace.span('cam:sensor_values'):
+            sensors_and_values = yield self._get_stage_sensor_values(product_id, 'capture-init')
+        with trace.span('redis_write'):
+            for sensor_name, value in sensors_and_values.items():
+                self._write_sensor_value(product_id, sensor_name, value)
+
+    @tornado.gen.coroutine
+    def _capture_start(self, product_id, trace):
         """Responds to capture-start request
 
         Args:
             product_id (str): the product id given in the ?configure request
+            trace (tracing.Trace): records the time spent on the request
 
         Returns:
             None, but does many things!
         """
-        # TODO: get more information?
-        sensors_to_query = ['target', 'pos_request_base_ra', 'pos_request_base_dec', 'weight']
-        sensors_and_values = self.io_loop.run_sync(
-            lambda: self._get_sensor_values(product_id, sensors_to_query))
-        for sensor_name, value in sensors_and_values.items():
-            key = "{}:{}".format(product_id, sensor_name)
-            write_pair_redis(self.redis_server, key, repr(value))
-
-    def _capture_stop(self, product_id):
+        with trace.span('cam:sensor_values'):
+            sensors_and_values = yield self._get_stage_sensor_values(product_id, 'capture-start')
+        with trace.span('redis_write'):
+            for sensor_name, value in sensors_and_values.items():
+                self._write_sensor_value(product_id, sensor_name, value)
+                self._store_structured(product_id, sensor_name, value['value'], value['value_timestamp'])
+        if product_id in self.archives:
+            for sensor_name, value in sensors_and_values.items():
+                self.archives[product_id].append('sensor', sensor_name, value['value'], value['value_timestamp'])
+
+    @tornado.gen.coroutine
+    def _capture_stop(self, product_id, trace):
         """Responds to capture-stop request
 
         Args:
             product_id (str): the product id given in the ?configure request
+            trace (tracing.Trace): records the time spent on the request
 
         Returns:
             None, but does many things!
@@ -212,117 +765,343 @@ class BLKATPortalClient(object):
         #msg_parts = message['data'].split(':')
         #product_id = msg_parts[1] # the element after the capture-stop identifier
         #client = self.subarray_katportals[product_id]
-        # TODO: get more information?
+        with trace.span('cam:sensor_values'):
+            sensors_and_values = yield self._get_stage_sensor_values(product_id, 'capture-stop')
+        with trace.span('redis_write'):
+            for sensor_name, value in sensors_and_values.items():
+                self._write_sensor_value(product_id, sensor_name, value)
         print('Capture stopped')
 
-    def _capture_done(self, product_id):
+    @tornado.gen.coroutine
+    def _capture_done(self, product_id, trace):
         """Responds to capture-done request
 
         Args:
             product_id (str): the product id given in the ?configure request
+            trace (tracing.Trace): records the time spent on the request
 
         Returns:
             None, but does many things!
         """
-        # Stop io_loop for async_sensor_list
-        self.io_loop.stop()
-        # Once-off sensors to query on ?capture_done
-        sensors_to_query = []  # TODO: add sensors to query on ?capture_done
-        sensors_and_values = self.io_loop.run_sync(
-            lambda: self._get_sensor_values(product_id, sensors_to_query))
-        for sensor_name, value in sensors_and_values.items():
-            key = "{}:{}".format(product_id, sensor_name)
-            write_pair_redis(self.redis_server, key, repr(value))
-
-    def _deconfigure(self, product_id):
+        with trace.span('cam:sensor_values'):
+            sensors_and_values = yield self._get_stage_sensor_values(product_id, 'capture-done')
+        with trace.span('redis_write'):
+            for sensor_name, value in sensors_and_values.items():
+                self._write_sensor_value(product_id, sensor_name, value)
+
+    @tornado.gen.coroutine
+    def _deconfigure(self, product_id, trace):
         """Responds to deconfigure request
 
         Args:
             product_id (str): the product id given in the ?configure request
+            trace (tracing.Trace): records the time spent on the request
 
         Returns:
             None
         """
-        sensors_to_query = []  # TODO: add sensors to query on ?deconfigure
-        sensors_and_values = self.io_loop.run_sync(
-            lambda: self._get_sensor_values(product_id, sensors_to_query))
-        for sensor_name, value in sensors_and_values.items():
-            key = "{}:{}".format(product_id, sensor_name)
-            write_pair_redis(self.redis_server, key, repr(value))
+        with trace.span('cam:sensor_values'):
+            sensors_and_values = yield self._get_stage_sensor_values(product_id, 'deconfigure')
+        with trace.span('redis_write'):
+            for sensor_name, value in sensors_and_values.items():
+                self._write_sensor_value(product_id, sensor_name, value)
         if product_id not in self.subarray_katportals:
             logger.warning("Failed to deconfigure a non-existent product_id: {}".format(product_id))
         else:
-            self.subarray_katportals.pop(product_id)
+            self.subscribed_sensors.pop(product_id, None)  # stops connection supervision
+            self.reconnect_stats.pop(product_id, None)
+            client = self.subarray_katportals.pop(product_id)
+            client.disconnect()  # also ends its sensor subscriptions
+            self.antenna_health.pop(product_id, None)
+            self.pointing_buffers.pop(product_id, None)
+            self.update_filter.forget(product_id)
+            self.sensor_value_cache.pop(product_id, None)
+            self.sensor_plan.forget(product_id)
+            self.schedule_blocks.forget(product_id)
+            for names_key in [key for key in self.sensor_name_cache if key[0] == product_id]:
+                del self.sensor_name_cache[names_key]
             logger.info("Deleted KATPortalClient instance for product_id: {}".format(product_id))
 
-    def _other(self, product_id):
+    def _other(self, product_id, msg_type=None):
         """This is called when an unrecognized request is sent
 
         Args:
             product_id (str): the product id given in the ?configure request
+            msg_type (str): the unrecognized request
 
         Returns:
             None
         """
-        logger.warning("Unrecognized alert : {}".format(message['data']))
+        logger.warning("Unrecognized alert : {}:{}".format(msg_type, product_id))
 
     @tornado.gen.coroutine
-    def _get_future_targets(self, product_id):
-        """Gets the schedule blocks of the product_id's subarray
+    def _with_deadline(self, query_type, deadline, future):
+        """Waits for a CAM query, but no later than a deadline
+
+        The portal client offers no way to abort a request in flight, so on
+        timeout the query is abandoned: its eventual result or exception is
+        silently discarded.
+
+        Args:
+            query_type (str): name of the query, for self.deadline_misses
+            deadline (float): absolute deadline, in self.io_loop.time() terms
+            future (tornado.concurrent.Future): the pending query
+
+        Returns:
+            The result of the query
+
+        Raises:
+            tornado.gen.TimeoutError if the deadline passed first
+        """
+        started = time.time()
+        try:
+            result = yield tornado.gen.with_timeout(deadline, future, quiet_exceptions=(Exception,))
+        except tornado.gen.TimeoutError:
+            CAM_DEADLINE_MISSES.labels(query_type).inc()
+            self.deadline_misses[query_type] = self.deadline_misses.get(query_type, 0) + 1
+            logger.warning("CAM query {} missed its deadline".format(query_type))
+            raise
+        finally:
+            CAM_QUERY_LATENCY.labels(query_type).observe(time.time() - started)
+        raise tornado.gen.Return(result)
+
+    def _stage_deadline(self, stage):
+        """Returns the absolute deadline for the CAM queries of a lifecycle stage"""
+        return self.io_loop.time() + self.CAM_DEADLINES.get(stage, self.CAM_DEADLINES[None])
+
+    @tornado.gen.coroutine
+    def _update_schedule_blocks(self, product_id, stage=None):
+        """Fetches the schedule blocks of the product_id's subarray that are new
+        or due for revalidation (see schedule_blocks.ScheduleBlockTracker)
+
+        The blocks are fetched concurrently. Blocks that CAM does not return
+        before the stage's deadline are kept as last fetched (and new ones
+        are fetched on the next refresh).
 
         Args:
             product_id (str): the product id of a currently activated subarray
+            stage (str): the lifecycle stage asking, e.g. 'capture-init' (see CAM_DEADLINES)
 
         Returns:
-            List of dictionaries containing schedule block information
+            List of the changes to the blocks, see schedule_blocks.py
 
         Examples:
-            >>> self.io_loop.run_sync(lambda: self._get_future_targets(product_id))
+            >>> diffs = yield self._update_schedule_blocks(product_id, 'capture-init')
         """
         client = self.subarray_katportals[product_id]
-        sb_ids = yield client.schedule_blocks_assigned()
-        blocks = []
-        for sb_id in sb_ids:
-            # Should this be 'client' rather than 'portal_client'?
-            #block = yield portal_client.future_targets(sb_id)
-            block = yield client.future_targets(sb_id)
-            blocks.append(block)
-        # TODO: do something interesting with schedule blocks
-        raise tornado.gen.Return(blocks)
+        deadline = self._stage_deadline(stage)
+        try:
+            sb_ids = yield self._with_deadline('schedule_blocks_assigned', deadline,
+                                               client.schedule_blocks_assigned())
+        except tornado.gen.TimeoutError:
+            logger.warning("Using last known schedule blocks for {}".format(product_id))
+            raise tornado.gen.Return([])
+        fetched = yield dict((sb_id, self._get_schedule_block(product_id, sb_id, deadline))
+                             for sb_id in self.schedule_blocks.to_fetch(product_id, sb_ids))
+        fetched = dict((sb_id, targets) for sb_id, targets in fetched.items() if targets is not None)
+        raise tornado.gen.Return(self.schedule_blocks.update(product_id, sb_ids, fetched))
+
+    @tornado.gen.coroutine
+    def _get_schedule_block(self, product_id, sb_id, deadline):
+        """Gets the future targets of one schedule block before the deadline, or None"""
+        client = self.subarray_katportals[product_id]
+        try:
+            targets = yield self._with_deadline('future_targets', deadline, client.future_targets(sb_id))
+        except tornado.gen.TimeoutError:
+            raise tornado.gen.Return(None)
+        raise tornado.gen.Return(targets)
+
+    def _write_schedule_blocks(self, product_id, diffs):
+        """Writes the product's schedule blocks, and publishes what changed
+
+        Writes:
+            - [product_id]:schedule_blocks :: repr of the list of each block's targets
+        Publishes:
+            - schedule_blocks:[product_id] :: JSON list of diffs (if any), see schedule_blocks.py
+        """
+        schedule_blocks = self.schedule_blocks.blocks(product_id)
+        key = "{}:schedule_blocks".format(product_id)
+        write_pair_redis(self.redis_server, key, repr(schedule_blocks))  # overrides previous value
+        if diffs:
+            publish_to_redis(self.redis_server, schedule_block_channel(product_id), json.dumps(diffs, default=str))
+        if product_id in self.archives:
+            self.archives[product_id].append('schedule_blocks', 'schedule_blocks', schedule_blocks)
+
+    def _refresh_schedules(self):
+        """Queues a schedule block refresh for every product past ?capture-init
+        that does not have one queued already"""
+        for product_id in self.schedule_blocks.products():
+            if product_id in self._schedule_refreshes or product_id not in self.subarray_katportals:
+                continue
+            self._schedule_refreshes.add(product_id)
+            self.scheduler.submit(PRIORITIES.schedule, product_id, self._refresh_schedule, product_id,
+                                  host=self._cam_host(product_id), deadline=self.SCHEDULE_REFRESH_INTERVAL)
 
     @tornado.gen.coroutine
-    def _get_sensor_values(self, product_id, targets):
+    def _refresh_schedule(self, product_id):
+        """Updates the product's schedule blocks, writing and publishing them if they changed"""
+        try:
+            if product_id not in self.subarray_katportals:
+                return  # deconfigured in the meantime
+            diffs = yield self._update_schedule_blocks(product_id)
+            if diffs:
+                logger.info("Schedule blocks of {} changed: {}".format(
+                    product_id, ", ".join("{} {}".format(diff['block'], diff['change']) for diff in diffs)))
+                self._write_schedule_blocks(product_id, diffs)
+        finally:
+            self._schedule_refreshes.discard(product_id)
+
+    @tornado.gen.coroutine
+    def _get_sensor_values(self, product_id, targets, stage=None):
         """Gets sensor values associated with the product_id's subarray
 
+        The sensor values are fetched concurrently. Every CAM query shares
+        the deadline of the stage. A value that is not received in time is
+        replaced by the last value fetched for that sensor, with 'stale' set
+        to True. Sensors with no previous value are left out.
+
         Args:
             product_id (str): the product id of a currently activated subarray
             targets (list): expressions to look for in sensor names
+            stage (str): the lifecycle stage asking, e.g. 'capture-start' (see CAM_DEADLINES)
 
         Returns:
             A dictionary of sensor-name / value pairs
 
         Examples:
-            >>> self.io_loop.run_sync(lambda: self._get_sensor_values(product_id, ["target", "ra", "dec"]))
+            >>> values = yield self._get_sensor_values(product_id, ["target", "ra", "dec"], 'capture-start')
         """
         sensors_and_values = dict()
         if not targets:
             logger.warning("Sensor list empty. Not querying katportal...")
             raise tornado.gen.Return(sensors_and_values)
         client = self.subarray_katportals[product_id]
-        sensor_names = yield client.sensor_names(targets)
+        deadline = self._stage_deadline(stage)
+        names_key = (product_id, tuple(targets))
+        try:
+            sensor_names = yield self._with_deadline('sensor_names', deadline, client.sensor_names(targets))
+            self.sensor_name_cache[names_key] = sensor_names
+        except tornado.gen.TimeoutError:
+            sensor_names = self.sensor_name_cache.get(names_key, [])
         if not sensor_names:
             logger.warning("No matching sensors found!")
         else:
-            for sensor_name in sensor_names:
-                try:
-                    sensor_value = yield client.sensor_value(sensor_name, include_value_ts=True)
-                    sensors_and_values[sensor_name] = self._convert_SensorSampleValueTs_to_dict(sensor_value)
-                except SensorNotFoundError as exc:
-                    print("\n", exc)
-                    continue
+            values = yield dict((sensor_name, self._get_sensor_value(product_id, sensor_name, deadline))
+                                for sensor_name in sensor_names)
+            for sensor_name, value in values.items():
+                if value is not None:
+                    sensors_and_values[sensor_name] = value
             # TODO: get more information using the client?
         raise tornado.gen.Return(sensors_and_values)
 
+    @tornado.gen.coroutine
+    def _get_stage_sensor_values(self, product_id, stage):
+        """Gets the values of the sensors a lifecycle stage reads (see sensor_plans.STAGE_SENSORS)
+
+        Values already held (received over the subscription, or prefetched
+        recently enough) are used as they are; the others are fetched as by
+        _get_sensor_values. Then the values the stages that can follow will
+        need are prefetched in the background.
+
+        Args:
+            product_id (str): the product id of a currently activated subarray
+            stage (str): the lifecycle stage asking, e.g. 'capture-start'
+
+        Returns:
+            A dictionary of sensor-name / value pairs
+
+        Examples:
+            >>> values = yield self._get_stage_sensor_values(product_id, 'capture-start')
+        """
+        sensors_and_values = dict()
+        if product_id not in self.subarray_katportals:
+            raise tornado.gen.Return(sensors_and_values)
+        deadline = self._stage_deadline(stage)
+        yield self._resolve_sensor_plan(product_id, deadline)
+        served, missing = self.sensor_plan.plan(product_id, stage, self._subscription_live(product_id))
+        for sensor_name, (source, value) in served.items():
+            STAGE_SENSOR_VALUES.labels(source).inc()
+            sensors_and_values[sensor_name] = value
+        if missing:
+            values = yield dict((sensor_name, self._get_sensor_value(product_id, sensor_name, deadline))
+                                for sensor_name in missing)
+            for sensor_name, value in values.items():
+                if value is not None:
+                    STAGE_SENSOR_VALUES.labels('stale' if value['stale'] else 'cam').inc()
+                    sensors_and_values[sensor_name] = value
+        self.io_loop.add_callback(self._prefetch_sensor_values, product_id, stage)
+        raise tornado.gen.Return(sensors_and_values)
+
+    @tornado.gen.coroutine
+    def _prefetch_sensor_values(self, product_id, stage):
+        """Fetches the values the stages that can follow stage will read, ahead of their requests"""
+        sensor_names = self.sensor_plan.prefetch_names(product_id, stage, self._subscription_live(product_id))
+        if not sensor_names or product_id not in self.subarray_katportals:
+            return
+        deadline = self._stage_deadline(None)
+        try:
+            yield [self._get_sensor_value(product_id, sensor_name, deadline) for sensor_name in sensor_names]
+        except Exception as e:
+            logger.warning("Prefetch of {} sensor values for {} failed: {}".format(len(sensor_names), product_id, e))
+
+    @tornado.gen.coroutine
+    def _resolve_sensor_plan(self, product_id, deadline):
+        """Resolves the sensor names of every stage of a product, with a single
+        sensor_names query for the merged patterns of sensor_plans.STAGE_SENSORS.
+        If it misses the deadline, the next stage tries again.
+        """
+        if self.sensor_plan.resolved(product_id):
+            return
+        sensor_names = []
+        if self.sensor_plan.patterns:
+            client = self.subarray_katportals[product_id]
+            try:
+                sensor_names = yield self._with_deadline('sensor_names', deadline,
+                                                         client.sensor_names(self.sensor_plan.patterns))
+            except tornado.gen.TimeoutError:
+                logger.warning("Could not resolve the sensor names of {} in time".format(product_id))
+                return
+        self.sensor_plan.resolve(product_id, sensor_names)
+
+    def _subscription_live(self, product_id):
+        """Whether the product's sensor subscription is up, so that the values received are current"""
+        client = self.subarray_katportals.get(product_id)
+        return (product_id in self.subscribed_sensors and product_id not in self._reconnecting
+                and client is not None and client.is_connected)
+
+    @tornado.gen.coroutine
+    def _get_sensor_value(self, product_id, sensor_name, deadline):
+        """Gets one sensor value (as a dict) before the deadline, or its last known value
+
+        A query for a sensor that is already being fetched (e.g. prefetched)
+        waits for that one rather than asking CAM again.
+
+        Returns:
+            (dict) see _convert_SensorSampleValueTs_to_dict, with 'stale' set to
+            True if it is a cached value, or None if the sensor is unavailable
+        """
+        cache = self.sensor_value_cache.setdefault(product_id, dict())
+        query_key = (product_id, sensor_name)
+        query = self._sensor_queries.get(query_key)
+        if query is None:
+            client = self.subarray_katportals[product_id]
+            query = self._sensor_queries[query_key] = client.sensor_value(sensor_name, include_value_ts=True)
+            query.add_done_callback(lambda _: self._sensor_queries.pop(query_key, None))
+        try:
+            sensor_value = yield self._with_deadline('sensor_value', deadline, query)
+        except SensorNotFoundError as exc:
+            print("\n", exc)
+            raise tornado.gen.Return(None)
+        except tornado.gen.TimeoutError:
+            if sensor_name not in cache:
+                raise tornado.gen.Return(None)
+            stale_value = dict(cache[sensor_name])
+            stale_value['stale'] = True
+            raise tornado.gen.Return(stale_value)
+        cache[sensor_name] = self._convert_SensorSampleValueTs_to_dict(sensor_value)
+        self.sensor_plan.record(product_id, sensor_name, cache[sensor_name])
+        raise tornado.gen.Return(cache[sensor_name])
+
     def _convert_SensorSampleValueTs_to_dict(self, sensor_value):
         """Converts the named-tuple object returned by sensor_value
             query into a dictionary. This dictionary contains the following values:
@@ -339,6 +1118,9 @@ class BLKATPortalClient(object):
                     The status of the sensor when the sample was taken. As defined
                     by the KATCP protocol. Examples: 'nominal', 'warn', 'failure', 'error',
                     'critical', 'unreachable', 'unknown', etc.
+                - stale:  bool
+                    False here. True when _get_sensor_value falls back to a
+                    previously fetched value because CAM missed the deadline.
 
             Args:
                 sensor_value (SensorSampleValueTs)
@@ -351,6 +1133,7 @@ class BLKATPortalClient(object):
         sensor_value_dict['value_timestamp'] = sensor_value.value_timestamp
         sensor_value_dict['value'] = sensor_value.value
         sensor_value_dict['status'] = sensor_value.status
+        sensor_value_dict['stale'] = False
         return sensor_value_dict
 
     def _print_start_image(self):
@@ -0,0 +1,107 @@
+"""
+The lifecycle of a product, as driven by the requests CAM sends:
+
+    (unknown) --configure--> configured --capture-init--> initialised
+    initialised/stopped --capture-start--> capturing --capture-stop--> stopped
+    initialised/capturing/stopped --capture-done--> done --capture-init--> ...
+    configured/done --configure--> configured
+    any --deconfigure--> deconfigured (and unknown again)
+
+ProductLifecycle checks requests against this table in memory, so invalid
+ones are rejected before anything is written or published, and persists
+the state of every product to "[product_id]:state" so that it survives a
+restart of the KATCP server and can be read by downstream processes.
+"""
+
+import redis
+
+from .redis_tools import write_pair_redis
+from .logger import log
+
+STATES = ['configured', 'initialised', 'capturing', 'stopped', 'done']
+DECONFIGURED = 'deconfigured'  # written to redis; the product is then forgotten
+
+# request --> (states it is valid in, state it leads to); None is an unknown product
+TRANSITIONS = {
+    'configure'    : ((None, 'configured', 'done'), 'configured'),
+    'capture-init' : (('configured', 'done'), 'initialised'),
+    'capture-start': (('initialised', 'stopped'), 'capturing'),
+    'capture-stop' : (('capturing',), 'stopped'),
+    'capture-done' : (('initialised', 'capturing', 'stopped'), 'done'),
+    'deconfigure'  : (tuple(STATES), DECONFIGURED),
+}
+
+
+class InvalidTransition(ValueError):
+    """A request that is not valid in the product's current state"""
+
+
+class ProductLifecycle(object):
+    """Tracks the lifecycle state of every product
+
+    Examples:
+        >>> lifecycle = ProductLifecycle(redis.StrictRedis())
+        >>> state = lifecycle.next_state('array_1_bc856M4k', 'capture-start')
+        InvalidTransition: capture-start is not valid for array_1_bc856M4k (unknown product)
+    """
+
+    def __init__(self, redis_server):
+        """Tracks the lifecycle state of every product
+
+        Args:
+            redis_server (redis.StrictRedis): where states are persisted
+        """
+        self.redis_server = redis_server
+        self.states = dict()  # product id --> one of STATES
+
+    def load(self):
+        """Restores the states persisted by a previous run
+
+        Returns:
+            the product ids whose states were restored
+        """
+        try:
+            for key in self.redis_server.scan_iter(match="*:state"):
+                if isinstance(key, bytes):
+                    key = key.decode('utf-8')
+                state = self.redis_server.get(key)
+                if isinstance(state, bytes):
+                    state = state.decode('utf-8')
+                if state in STATES:
+                    self.states[key.rsplit(':', 1)[0]] = state
+        except redis.exceptions.ConnectionError:
+            log.warning("Could not restore product states from redis")
+        return list(self.states)
+
+    def state(self, product_id):
+        """Returns the state of a product, or None if it is not configured"""
+        return self.states.get(product_id)
+
+    def next_state(self, product_id, request):
+        """Returns the state a request would lead to, without changing anything
+
+        Args:
+            product_id (str): the product the request is for
+            request (str): one of TRANSITIONS, e.g. 'capture-start'
+
+        Raises:
+            InvalidTransition if the request is not valid in the current state
+        """
+        valid_states, new_state = TRANSITIONS[request]
+        state = self.states.get(product_id)
+        if state not in valid_states:
+            raise InvalidTransition("{} is not valid for {} ({})".format(
+                request, product_id, state or "unknown product"))
+        return new_state
+
+    def set_state(self, product_id, state):
+        """Records and persists the new state of a product
+
+        Returns:
+            True if the state was persisted, False otherwise
+        """
+        if state == DECONFIGURED:
+            self.states.pop(product_id, None)
+        else:
+            self.states[product_id] = state
+        return write_pair_redis(self.redis_server, "{}:state".format(product_id), state)
@@ -1,4 +1,14 @@
+import atexit
 import logging
+import threading
+import time
+
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:  # python 2
+    QueueHandler = QueueListener = None
+
+from six.moves import queue
 
 
 def get_logger():
@@ -9,11 +19,105 @@ def get_logger():
 log = get_logger()
 
 
-def set_logger(log_level=logging.DEBUG):
-    """Set up logging."""
+def set_logger(log_level=logging.DEBUG, queued=True):
+    """Set up logging.
+
+    Args:
+        log_level (int): level of the BLUSE.interface logger
+        queued (bool): write log records from a background thread, so that
+            logging on the ioloop never blocks on terminal, pipe or file I/O
+    """
     FORMAT = "[ %(levelname)s - %(asctime)s - %(filename)s:%(lineno)s] %(message)s"
-    logging.basicConfig(format=FORMAT)
+    root = logging.getLogger()
+    if not root.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(FORMAT))
+        if queued:
+            records = queue.Queue(-1)
+            listener = QueueListener(records, handler)
+            listener.start()
+            atexit.register(listener.stop)  # flush what is still queued
+            handler = QueueHandler(records)
+        root.addHandler(handler)
     log = get_logger()
     log.setLevel(log_level)
 
     return log
+
+
+class _QueueHandler(logging.Handler):
+    """Puts log records on a queue (logging.handlers.QueueHandler for python 2)"""
+
+    def __init__(self, records):
+        logging.Handler.__init__(self)
+        self.records = records
+
+    def emit(self, record):
+        try:
+            # the message must be formatted here: its args may change before it is written
+            record.msg = record.getMessage()
+            record.args = None
+            record.exc_info = None
+            self.records.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+
+class _QueueListener(object):
+    """Writes queued log records to a handler (logging.handlers.QueueListener for python 2)"""
+
+    _sentinel = None
+
+    def __init__(self, records, handler):
+        self.records = records
+        self.handler = handler
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor, name="log-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self.records.put_nowait(self._sentinel)
+            self._thread.join()
+            self._thread = None
+
+    def _monitor(self):
+        while True:
+            record = self.records.get()
+            if record is self._sentinel:
+                return
+            self.handler.handle(record)
+
+
+if QueueHandler is None:
+    QueueHandler, QueueListener = _QueueHandler, _QueueListener
+
+
+class RateLimit(object):
+    """Lets through at most one log message per key per interval
+
+    Examples:
+        >>> limit = RateLimit(interval=10.0)
+        >>> suppressed = limit.allow(sensor_name)
+        >>> if suppressed is not None:
+        ...     log.debug("Sensor value stored: %s (%d suppressed)", sensor_name, suppressed)
+    """
+
+    def __init__(self, interval=10.0):
+        self.interval = interval
+        self._last = dict()  # key --> (time of the last message let through, messages suppressed since)
+
+    def allow(self, key, now=None):
+        """Returns None if a message about key should be suppressed, otherwise
+        the number of messages about key suppressed since the last one let through
+        """
+        now = time.time() if now is None else now
+        last = self._last.get(key)
+        if last is not None and now - last[0] < self.interval:
+            self._last[key] = (last[0], last[1] + 1)
+            return None
+        self._last[key] = (now, 0)
+        return 0 if last is None else last[1]
@@ -0,0 +1,283 @@
+"""
+In-process cache of product metadata and sensor values for processing nodes.
+
+Consumers that poll "[product_id]:*" keys during an observation can read them
+through a MetadataCache instead. Hot reads are served from a local dictionary
+and redis only sees traffic when something changes: cached entries are dropped
+when redis reports that their key was modified (keyspace notifications), when
+a new value is announced on the product's "sensors:*" channels (see
+sensor_channels.py), or when the product is (de)configured on the 'alerts'
+channel. A cache given the products it serves only subscribes to their
+notifications, rather than to those of every subarray.
+
+Server-assisted client tracking (CLIENT TRACKING) would be the natural fit,
+but needs redis >= 6 and a RESP3 capable client, which redis-py 2.10 is not.
+"""
+
+import ast
+import threading
+import time
+
+import redis
+
+from .redis_tools import (REDIS_CHANNELS, CONTROL, METADATA, SENSOR, PRODUCT_METADATA_FIELDS,
+                          get_product_snapshot, get_redis, sensor_class)
+from .sensor_channels import parse_sensor_message, sensor_patterns
+from .logger import log
+
+# the keys read by get_product_snapshot, as "[product_id]:[field]"
+_SNAPSHOT_FIELDS = set([field for field, _ in PRODUCT_METADATA_FIELDS] + ['version'])
+
+
+class MetadataCache(object):
+    """Read-through cache of product metadata kept coherent by redis notifications
+
+    Examples:
+        >>> cache = MetadataCache(redis.StrictRedis())
+        >>> cache.start()
+        >>> cache.get_list('array_1_bc856M4k', 'antennas')  # goes to redis
+        ['m000', 'm001']
+        >>> cache.get_list('array_1_bc856M4k', 'antennas')  # local lookup
+        ['m000', 'm001']
+        >>> cache.stop()
+
+    While the notification listener is not running (before start(), after
+    stop(), or while its connection is down) every read goes to redis, so a
+    reader never sees a value whose invalidation could have been missed.
+    """
+
+    KEYSPACE_EVENTS = "KA"  # keyspace notifications for all event classes
+    SNAPSHOT = "__snapshot__"  # cache entry holding get_product_snapshot output
+
+    def __init__(self, redis_server=None, db=None, poll_timeout=1.0, sensor_server=None, control_server=None,
+                 product_ids=None):
+        """In-process cache of product metadata and sensor values
+
+        Args:
+            redis_server (redis.StrictRedis): server to read product metadata from
+                --> defaults to get_redis(db=db)
+            db (int): the database number the metadata lives in
+                --> defaults to the configured one (see redis_tools.configure_redis)
+            poll_timeout (float): seconds the listener waits for a message
+                before checking whether it should stop
+            sensor_server (redis.StrictRedis): server holding sensor values and
+                carrying the sensor channels --> defaults to redis_server if
+                given, get_redis(SENSOR) otherwise
+            control_server (redis.StrictRedis): server carrying 'alerts'
+                --> defaults to redis_server if given, get_redis(CONTROL) otherwise
+            product_ids (list): the products to cache; reads of other products
+                always go to redis --> None caches every product
+        """
+        self.redis_server = redis_server or get_redis(db=db)
+        self.sensor_server = sensor_server or redis_server or get_redis(SENSOR)
+        self.control_server = control_server or redis_server or get_redis(CONTROL)
+        self.poll_timeout = poll_timeout
+        self.product_ids = None if product_ids is None else set(product_ids)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._cache = dict()  # redis key --> value
+        self._generations = dict()  # redis key --> number of invalidations seen
+        self._lock = threading.Lock()
+        self._listening = False
+        self._running = False
+        self._pubsubs = None  # one per distinct redis database listened to
+        self._thread = None
+
+    def start(self):
+        """Enables keyspace notifications and starts the invalidation listener"""
+        self._enable_keyspace_notifications()
+        self._running = True
+        self._thread = threading.Thread(target=self._listen, name="metadata-cache")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the invalidation listener and empties the cache"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def get(self, product_id, field):
+        """Returns the string stored at "[product_id]:[field]" (or None)"""
+        key = "{}:{}".format(product_id, field)
+        return self._read(key, lambda: self.redis_server.get(key))
+
+    def get_list(self, product_id, field):
+        """Returns the list stored at "[product_id]:[field]", e.g. 'antennas'"""
+        key = "{}:{}".format(product_id, field)
+        return self._read(key, lambda: self.redis_server.lrange(key, 0, -1))
+
+    def get_sensor(self, product_id, sensor_name):
+        """Returns the sensor dictionary stored by the KATPortal Client
+
+        The stored repr is parsed once, on the read that fills the cache.
+
+        Returns:
+            (dict) with 'value', 'status', 'timestamp', ... or None
+        """
+        key = "{}:{}".format(product_id, sensor_name)
+        server = self.redis_server if sensor_class(sensor_name) == METADATA else self.sensor_server
+
+        def fetch():
+            value = server.get(key)
+            if value is None:
+                return None
+            try:
+                return ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                return value  # stored by the update callback as a bare repr
+        return self._read(key, fetch)
+
+    def snapshot(self, product_id):
+        """Returns get_product_snapshot(product_id), cached until one of its keys changes"""
+        key = "{}:{}".format(product_id, self.SNAPSHOT)
+        return self._read(key, lambda: get_product_snapshot(self.redis_server, product_id))
+
+    def invalidate_product(self, product_id):
+        """Drops every cached entry of a product"""
+        prefix = "{}:".format(product_id)
+        with self._lock:
+            for key in [k for k in self._cache if k.startswith(prefix)]:
+                self._invalidate(key)
+            self._invalidate(prefix + self.SNAPSHOT)  # even if a snapshot read is in flight
+
+    def _read(self, key, fetch):
+        if self.product_ids is not None and key.split(':', 1)[0] not in self.product_ids:
+            return fetch()  # not subscribed to its invalidations
+        with self._lock:
+            if self._listening and key in self._cache:
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+            generation = self._generations.get(key, 0)
+        value = fetch()
+        with self._lock:
+            # Only keep the value if no invalidation raced with the fetch
+            if self._listening and self._generations.get(key, 0) == generation:
+                self._cache[key] = value
+        return value
+
+    def _invalidate(self, key):
+        """Drops a cached key. Must be called with self._lock held."""
+        self._generations[key] = self._generations.get(key, 0) + 1
+        if self._cache.pop(key, None) is not None:
+            self.invalidations += 1
+        product_id, _, field = key.partition(':')
+        if field in _SNAPSHOT_FIELDS:
+            # also bumps the snapshot's generation, so a snapshot read that
+            # raced with this write is not cached
+            self._invalidate("{}:{}".format(product_id, self.SNAPSHOT))
+
+    def _enable_keyspace_notifications(self):
+        servers = [self.redis_server]
+        if _database(self.sensor_server) != _database(self.redis_server):
+            servers.append(self.sensor_server)
+        for server in servers:
+            try:
+                current = server.config_get("notify-keyspace-events")
+                flags = current.get("notify-keyspace-events", "")
+                if "K" not in flags or not ("A" in flags or set("g$lh") <= set(flags)):
+                    server.config_set("notify-keyspace-events", flags + self.KEYSPACE_EVENTS)
+            except redis.RedisError:
+                log.warning("Could not enable keyspace notifications; "
+                            "make sure notify-keyspace-events includes '{}'".format(self.KEYSPACE_EVENTS))
+
+    def _on_keyspace(self, message):
+        key = message['channel'].split("__:", 1)[1]  # strip "__keyspace@[db]__:"
+        with self._lock:
+            self._invalidate(key)
+
+    def _on_sensor_update(self, message):
+        try:
+            parsed = parse_sensor_message(message['channel'], message['data'])
+        except (ValueError, TypeError, IndexError) as e:
+            log.warning("Skipping malformed message on {}: {}".format(message['channel'], e))
+            return
+        if parsed is None:
+            return
+        product_id, updates = parsed
+        with self._lock:
+            for sensor_name, _, _ in updates:
+                self._invalidate("{}:{}".format(product_id, sensor_name))
+
+    def _on_alert(self, message):
+        msg_parts = message['data'].split(':')
+        if len(msg_parts) >= 2 and msg_parts[0] in ('configure', 'deconfigure'):
+            self.invalidate_product(msg_parts[1])
+
+    def _subscribe(self):
+        # one subscription per distinct redis database, wherever the traffic classes live
+        groups = []  # [server, patterns, channels]
+        for server, patterns, channels in [
+                (self.redis_server, self._keyspace_patterns(self.redis_server), {}),
+                (self.sensor_server, dict(self._keyspace_patterns(self.sensor_server),
+                                          **self._sensor_patterns()), {}),
+                (self.control_server, {}, {REDIS_CHANNELS.alerts: self._on_alert})]:
+            for group in groups:
+                if _database(group[0]) == _database(server):
+                    group[1].update(patterns)
+                    group[2].update(channels)
+                    break
+            else:
+                groups.append([server, patterns, channels])
+        self._pubsubs = []
+        for server, patterns, channels in groups:
+            pubsub = server.pubsub(ignore_subscribe_messages=True)
+            self._pubsubs.append(pubsub)
+            if patterns:
+                pubsub.psubscribe(**patterns)
+            if channels:
+                pubsub.subscribe(**channels)
+
+    def _keyspace_patterns(self, server):
+        prefix = "__keyspace@{}__:".format(server.connection_pool.connection_kwargs.get('db', 0))
+        if self.product_ids is None:
+            return {prefix + "*": self._on_keyspace}
+        return dict((prefix + "{}:*".format(product_id), self._on_keyspace) for product_id in self.product_ids)
+
+    def _sensor_patterns(self):
+        patterns = dict()
+        for product_id in self.product_ids if self.product_ids is not None else ['*']:
+            for pattern in sensor_patterns(product_id):
+                patterns[pattern] = self._on_sensor_update
+        return patterns
+
+    def _set_listening(self, listening):
+        with self._lock:
+            self._listening = listening
+            if not listening:
+                self._cache.clear()
+
+    def _listen(self):
+        while self._running:
+            try:
+                if self._pubsubs is None:
+                    self._subscribe()
+                    self._set_listening(True)
+                # handlers are called from within get_message
+                for pubsub in self._pubsubs:
+                    pubsub.get_message(timeout=self.poll_timeout / len(self._pubsubs))
+            except redis.ConnectionError:
+                # notifications may have been missed: stop caching until resubscribed
+                log.warning("Metadata cache lost its redis connection; bypassing cache")
+                self._set_listening(False)
+                self._close_pubsubs()
+                time.sleep(self.poll_timeout)
+        self._set_listening(False)
+        self._close_pubsubs()
+
+    def _close_pubsubs(self):
+        for pubsub in self._pubsubs or []:
+            try:
+                pubsub.close()
+            except redis.RedisError:
+                pass
+        self._pubsubs = None
+
+
+def _database(server):
+    """Identifies the redis database a server is connected to"""
+    kwargs = server.connection_pool.connection_kwargs
+    return (kwargs.get('path') or (kwargs.get('host'), kwargs.get('port')), kwargs.get('db', 0))
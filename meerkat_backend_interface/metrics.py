@@ -0,0 +1,229 @@
+"""
+Minimal Prometheus-style metrics and an HTTP endpoint to scrape them.
+
+Metrics are registered once, at import time, and label combinations used on
+hot paths should be resolved ahead of time with .labels(), so that recording
+a value is a single attribute update (plus a bisect for histograms):
+
+    >>> UPDATES = Counter('sensor_updates_total', 'Sensor updates', ['outcome'])
+    >>> UPDATES_WRITTEN = UPDATES.labels('written')
+    >>> UPDATES_WRITTEN.inc()
+
+start_metrics_server() then serves every registered metric in the Prometheus
+text exposition format on http://<host>:<port>/metrics.
+"""
+
+import bisect
+import threading
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+from .logger import log
+
+# Latency buckets (seconds) suitable for redis round-trips up to CAM queries
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry(object):
+    """A collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.help))
+            lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, value) for name, value in pairs) + "}"
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = dict()  # label values --> child
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        registry.register(self)
+
+    def labels(self, *values):
+        """Returns the child metric of the given label values (creating it once)"""
+        values = tuple(str(value) for value in values)
+        try:
+            return self._children[values]
+        except KeyError:
+            if len(values) != len(self.labelnames):
+                raise ValueError("{} expects labels {}".format(self.name, self.labelnames))
+            child = self._children.setdefault(values, self._new_child())
+            return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def __getattr__(self, attr):
+        # unlabelled metrics forward inc()/set()/observe() to their only child
+        if attr.startswith('_') or self.__dict__.get('labelnames', True):
+            raise AttributeError(attr)
+        return getattr(self._children[()], attr)
+
+
+class _CounterChild(object):
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. the number of updates received"""
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def samples(self):
+        for values, child in sorted(self._children.items()):
+            yield "{}{} {}".format(self.name, _format_labels(self.labelnames, values), child.value)
+
+
+class _GaugeChild(object):
+    def __init__(self):
+        self.value = 0
+        self._function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set_function(self, function):
+        """Makes the gauge report function() at scrape time, e.g. a queue length"""
+        self._function = function
+
+    def get(self):
+        if self._function is not None:
+            try:
+                return self._function()
+            except Exception:
+                log.exception("Failed to evaluate gauge")
+                return float('nan')
+        return self.value
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, e.g. a queue depth"""
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def samples(self):
+        for values, child in sorted(self._children.items()):
+            yield "{}{} {}".format(self.name, _format_labels(self.labelnames, values), child.get())
+
+
+class _HistogramChild(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    """A distribution of observed values, e.g. latencies, in fixed buckets"""
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, help, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def samples(self):
+        for values, child in sorted(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                yield "{}_bucket{} {}".format(
+                    self.name, _format_labels(self.labelnames, values, [('le', le)]), cumulative)
+            labels = _format_labels(self.labelnames, values)
+            yield "{}_sum{} {}".format(self.name, labels, child.sum)
+            yield "{}_count{} {}".format(self.name, labels, cumulative)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # don't write every scrape to stderr
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_metrics_server(port, host='', registry=REGISTRY):
+    """Serves the metrics of a registry over HTTP from a daemon thread
+
+    Args:
+        port (int): port to listen on
+        host (str): address to bind to --> defaults to all interfaces
+        registry (Registry): the metrics to serve
+
+    Returns:
+        the HTTPServer (call .shutdown() to stop it)
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = _ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server")
+    thread.daemon = True
+    thread.start()
+    log.info("Serving metrics on port {}".format(port))
+    return server
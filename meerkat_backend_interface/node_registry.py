@@ -0,0 +1,367 @@
+"""
+A registry of live processing nodes, and the assignment of multicast groups to them.
+
+Every processing node runs a NodeHeartbeat (see scripts/node_heartbeat.py),
+which keeps a "node:[node_id]" hash alive in redis with the capacity the node
+offers: NIC bandwidth in Gb/s, GPU slots, and the channel it listens on. The
+hash expires `ttl` seconds after the last heartbeat, so a node that dies or
+hangs drops out of the registry by itself.
+
+The distributor's GroupDistributor bin-packs the multicast groups of every
+configured product onto the live nodes (pack_groups), tells each node which
+groups to subscribe to on its channel, and, whenever the registry is polled,
+moves the groups of nodes whose heartbeat expired to the surviving ones. A
+dead node's groups are therefore reassigned within ttl + poll interval.
+
+Assignments are published over pubsub, which does not keep messages for
+nodes that are not listening. So whenever a node (re)appears in the registry,
+as a new node, after a restart of its heartbeat, or after its registration
+lapsed, it is sent its full assignment again, and told to leave the groups
+that were moved to other nodes while it was gone.
+"""
+
+import socket
+import threading
+import time
+
+import redis
+
+from .redis_tools import CONTROL, get_redis, publish_to_redis
+from .metrics import Counter, Gauge
+from .logger import log
+
+NODES_KEY = "nodes"  # set of the ids of registered nodes (some may have expired)
+NODE_KEY = "node:{}"  # hash of a node's capacity, expiring with its heartbeat
+ASSIGNMENTS_KEY = "distributor:assignments"  # hash of "[product_id]:[address]" --> node id ("" if unplaced)
+
+LIVE_NODES = Gauge('distributor_live_nodes', 'Processing nodes with a current heartbeat')
+GROUPS_ASSIGNED = Gauge('distributor_groups_assigned', 'Multicast groups assigned to a live node')
+GROUPS_UNPLACED = Gauge('distributor_groups_unplaced', 'Multicast groups no live node has capacity for')
+GROUPS_REASSIGNED = Counter('distributor_groups_reassigned_total',
+                            'Multicast groups moved off nodes whose heartbeat expired')
+MESSAGES_PUBLISHED = Counter('distributor_messages_published_total',
+                             'Messages published to the compute node channels')
+
+
+def node_channel(node_id):
+    """The default channel a node listens on for its group assignments"""
+    return "node:{}:streams".format(node_id)
+
+
+def register_node(server, node_id, gbps, gpu_slots, channel=None, ttl=10.0, started=None):
+    """Registers (or refreshes) a node in the registry for the next ttl seconds
+
+    Args:
+        server (redis.StrictRedis) a redis-py redis server object
+        node_id (str): unique name of the node, e.g. its host name
+        gbps (float): NIC bandwidth the node offers, in Gb/s
+        gpu_slots (int): GPU slots the node offers
+        channel (str): channel the node listens on --> defaults to node_channel(node_id)
+        ttl (float): seconds until the registration expires without a new heartbeat
+        started (float): when the node's heartbeat started; a change tells the
+            distributor that the node restarted and must be sent its groups again
+
+    Returns:
+        True if success, False otherwise
+    """
+    key = NODE_KEY.format(node_id)
+    try:
+        pipe = server.pipeline()
+        mapping = {'gbps': gbps, 'gpu_slots': gpu_slots,
+                   'channel': channel or node_channel(node_id), 'heartbeat': time.time()}
+        if started is not None:
+            mapping['started'] = repr(started)
+        pipe.hmset(key, mapping)
+        pipe.pexpire(key, int(ttl * 1000))
+        pipe.sadd(NODES_KEY, node_id)
+        pipe.execute()
+        return True
+    except redis.RedisError as e:
+        log.error("Failed to register node {}: {}".format(node_id, e))
+        return False
+
+
+def live_nodes(server):
+    """Returns the nodes with a current heartbeat
+
+    Nodes whose registration expired are removed from NODES_KEY.
+
+    Returns:
+        dict of node id --> {'gbps': float, 'gpu_slots': int, 'channel': str,
+                             'heartbeat': float, 'started': float}
+    """
+    node_ids = sorted(_decode(node_id) for node_id in server.smembers(NODES_KEY))
+    pipe = server.pipeline()
+    for node_id in node_ids:
+        pipe.hgetall(NODE_KEY.format(node_id))
+    nodes = dict()
+    expired = []
+    for node_id, fields in zip(node_ids, pipe.execute()):
+        fields = dict((_decode(k), _decode(v)) for k, v in fields.items())
+        if not fields:
+            expired.append(node_id)
+            continue
+        nodes[node_id] = {'gbps': float(fields.get('gbps', 0)),
+                          'gpu_slots': int(float(fields.get('gpu_slots', 0))),
+                          'channel': fields.get('channel') or node_channel(node_id),
+                          'heartbeat': float(fields.get('heartbeat', 0)),
+                          'started': float(fields.get('started', 0))}
+    if expired:
+        server.srem(NODES_KEY, *expired)
+    return nodes
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class NodeHeartbeat(object):
+    """Keeps a node registered from a background thread
+
+    Examples:
+        >>> heartbeat = NodeHeartbeat('blpn07', gbps=40, gpu_slots=2)
+        >>> heartbeat.start()
+    """
+
+    def __init__(self, node_id=None, gbps=0.0, gpu_slots=0, channel=None, ttl=10.0,
+                 interval=None, redis_server=None):
+        """Keeps a node registered from a background thread
+
+        Args:
+            node_id (str): unique name of the node --> defaults to the host name
+            gbps (float): NIC bandwidth the node offers, in Gb/s
+            gpu_slots (int): GPU slots the node offers
+            channel (str): channel the node listens on --> defaults to node_channel(node_id)
+            ttl (float): seconds the registration outlives the last heartbeat
+            interval (float): seconds between heartbeats --> defaults to ttl / 3
+            redis_server (redis.StrictRedis): the registry --> defaults to get_redis(CONTROL)
+        """
+        self.node_id = node_id or socket.gethostname()
+        self.gbps = gbps
+        self.gpu_slots = gpu_slots
+        self.channel = channel or node_channel(self.node_id)
+        self.ttl = ttl
+        self.interval = interval or ttl / 3.0
+        self.redis_server = redis_server or get_redis(CONTROL)
+        self.started = None  # when start() was called
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, name="node-heartbeat")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, deregister=True):
+        """Stops the heartbeat, and by default leaves the registry straight away"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if deregister:
+            try:
+                self.redis_server.delete(NODE_KEY.format(self.node_id))
+                self.redis_server.srem(NODES_KEY, self.node_id)
+            except redis.RedisError:
+                pass  # it expires anyway
+
+    def _run(self):
+        while not self._stop.is_set():
+            register_node(self.redis_server, self.node_id, self.gbps, self.gpu_slots, self.channel, self.ttl,
+                          self.started)
+            self._stop.wait(self.interval)
+
+
+def pack_groups(groups, nodes, assignments, group_gbps=1.0, group_gpu_slots=1):
+    """Assigns multicast groups to nodes, best fit first
+
+    Groups already assigned to a live node stay there. Each other group goes
+    to the node with the least bandwidth left that can still take it (so
+    nodes fill up before others are used, leaving whole nodes free for the
+    next product); ties go to the node with the fewest GPU slots left.
+
+    Args:
+        groups (list): group keys ("[product_id]:[address]"), in priority order
+        nodes (dict): live nodes, as returned by live_nodes
+        assignments (dict): current group key --> node id
+        group_gbps (float): bandwidth one group needs, in Gb/s
+        group_gpu_slots (int): GPU slots one group needs
+
+    Returns:
+        (new assignments as group key --> node id, list of the groups that did not fit)
+    """
+    free = dict((node_id, [node['gbps'], node['gpu_slots']]) for node_id, node in nodes.items())
+    placed = dict()
+    for group in groups:
+        node_id = assignments.get(group)
+        if node_id in free:
+            placed[group] = node_id
+            free[node_id][0] -= group_gbps
+            free[node_id][1] -= group_gpu_slots
+    unplaced = []
+    for group in groups:
+        if group in placed:
+            continue
+        candidates = [(gbps, slots, node_id) for node_id, (gbps, slots) in free.items()
+                      if gbps >= group_gbps and slots >= group_gpu_slots]
+        if not candidates:
+            unplaced.append(group)
+            continue
+        _, _, node_id = min(candidates)
+        placed[group] = node_id
+        free[node_id][0] -= group_gbps
+        free[node_id][1] -= group_gpu_slots
+    return placed, unplaced
+
+
+class GroupDistributor(object):
+    """Distributes the multicast groups of configured products over the live nodes
+
+    Examples:
+        >>> distributor = GroupDistributor(group_gbps=2.0)
+        >>> distributor.configure('array_1_bc856M4k', ['239.9.3.1', '239.9.3.2'])
+        >>> distributor.poll()  # periodically: reassigns the groups of expired nodes
+    """
+
+    def __init__(self, redis_server=None, control_server=None, group_gbps=1.0, group_gpu_slots=1):
+        """Distributes the multicast groups of configured products over the live nodes
+
+        Args:
+            redis_server (redis.StrictRedis): where assignments are persisted
+                --> defaults to get_redis()
+            control_server (redis.StrictRedis): the node registry and channels
+                --> defaults to get_redis(CONTROL)
+            group_gbps (float): bandwidth one group needs, in Gb/s
+            group_gpu_slots (int): GPU slots one group needs
+        """
+        self.redis_server = redis_server or get_redis()
+        self.control_server = control_server or get_redis(CONTROL)
+        self.group_gbps = group_gbps
+        self.group_gpu_slots = group_gpu_slots
+        self.groups = []  # group keys of every configured product, in configure order
+        self.assignments = dict()  # group key --> node id
+        self.unplaced = []  # group keys no live node had capacity for at the last poll
+        self.nodes = dict()  # live nodes, as of the last poll
+        self._sent = dict()  # node id --> groups it was last told to configure
+        self._persisted = None  # ASSIGNMENTS_KEY as last written
+        self._load()
+
+    def _load(self):
+        """Restores the assignments persisted by a previous run"""
+        try:
+            for group, node_id in self.redis_server.hgetall(ASSIGNMENTS_KEY).items():
+                group = _decode(group)
+                self.groups.append(group)
+                if node_id:
+                    self.assignments[group] = _decode(node_id)
+                    self._sent.setdefault(self.assignments[group], set()).add(group)
+        except redis.RedisError:
+            log.warning("Could not restore group assignments from redis")
+        self.groups.sort()
+
+    def configure(self, product_id, addresses):
+        """Sets the multicast groups of a product and assigns them
+
+        The addresses replace those of any earlier configure of the product:
+        groups that are no longer among them are released, and their nodes
+        told to leave them.
+
+        Returns:
+            the number of groups no live node had capacity for
+        """
+        groups = ["{}:{}".format(product_id, address) for address in addresses]
+        prefix = "{}:".format(product_id)
+        self._release([group for group in self.groups if group.startswith(prefix) and group not in groups])
+        for group in groups:
+            if group not in self.groups:
+                self.groups.append(group)
+        return self.poll()
+
+    def deconfigure(self, product_id):
+        """Releases the groups of a product, telling their nodes to leave them,
+        and assigns groups that were waiting for capacity
+
+        Returns:
+            the number of groups no live node had capacity for
+        """
+        prefix = "{}:".format(product_id)
+        self._release([group for group in self.groups if group.startswith(prefix)])
+        return self.poll()
+
+    def _release(self, released):
+        """Forgets groups, telling the live nodes they were assigned to to leave them"""
+        self.groups = [group for group in self.groups if group not in released]
+        for group in released:
+            node_id = self.assignments.pop(group, None)
+            if node_id in self.nodes:
+                self._send(node_id, group, 'deconfigure')
+
+    def poll(self):
+        """Refreshes the live nodes and (re)assigns every group that has no live node
+
+        Nodes that (re)appeared since the last poll are sent their full
+        assignment, and told to leave the groups moved away from them.
+        If the registry cannot be read, the assignments are left as they are.
+
+        Returns:
+            the number of groups no live node had capacity for
+        """
+        try:
+            nodes = live_nodes(self.control_server)
+        except redis.RedisError as e:
+            log.error("Could not read the node registry; keeping the current assignments: {}".format(e))
+            return len(self.unplaced)
+        returned = set(node_id for node_id, node in nodes.items()
+                       if node_id not in self.nodes or self.nodes[node_id]['started'] != node['started'])
+        self.nodes = nodes
+        lost = [group for group, node_id in self.assignments.items() if node_id not in self.nodes]
+        for node_id in set(self.assignments[group] for group in lost):
+            log.warning("Node {} has no current heartbeat; reassigning its groups".format(node_id))
+        placed, unplaced = pack_groups(self.groups, self.nodes, self.assignments,
+                                       self.group_gbps, self.group_gpu_slots)
+        for node_id in sorted(returned):
+            for group in sorted(self._sent.get(node_id, ())):
+                if placed.get(group) != node_id:
+                    self._send(node_id, group, 'deconfigure')  # moved away while the node was gone
+        for group, node_id in sorted(placed.items()):
+            if self.assignments.get(group) != node_id or node_id in returned:
+                if group in lost:
+                    GROUPS_REASSIGNED.inc()
+                self._send(node_id, group, 'configure')
+        if unplaced and unplaced != self.unplaced:
+            log.warning("No live node has capacity for {} groups: {}".format(len(unplaced), ", ".join(unplaced)))
+        self.assignments = placed
+        self.unplaced = unplaced
+        self._persist()
+        return len(unplaced)
+
+    def _send(self, node_id, group, action):
+        """Publishes "[product_id]:[action]:stream:[address]" on the node's channel"""
+        product_id, address = group.split(':', 1)
+        sent = self._sent.setdefault(node_id, set())
+        if action == 'configure':
+            sent.add(group)
+        else:
+            sent.discard(group)
+        if publish_to_redis(self.control_server, self.nodes[node_id]['channel'],
+                            "{}:{}:stream:{}".format(product_id, action, address)):
+            MESSAGES_PUBLISHED.inc()
+
+    def _persist(self):
+        """Writes the assignments to ASSIGNMENTS_KEY, if they changed"""
+        LIVE_NODES.set(len(self.nodes))
+        GROUPS_ASSIGNED.set(len(self.assignments))
+        GROUPS_UNPLACED.set(len(self.unplaced))
+        mapping = dict((group, self.assignments.get(group, "")) for group in self.groups)
+        if mapping == self._persisted:
+            return
+        try:
+            pipe = self.redis_server.pipeline()
+            pipe.delete(ASSIGNMENTS_KEY)
+            if mapping:
+                pipe.hmset(ASSIGNMENTS_KEY, mapping)
+            pipe.execute()
+            self._persisted = mapping
+        except redis.RedisError as e:
+            log.error("Failed to persist group assignments: {}".format(e))
@@ -0,0 +1,123 @@
+import bisect
+import math
+from collections import deque
+
+import numpy as np
+
+TWO_PI = 2.0 * math.pi
+
+
+class PointingBuffer(object):
+    """Rolling, time-ordered history of the pointing of one subarray
+
+    RA/Dec samples (in radians) are kept in preallocated NumPy arrays holding
+    at most `capacity` samples; older samples are discarded. Samples are
+    stored in a contiguous window of arrays twice that size, so reads never
+    have to stitch a wrapped ring back together: when the window reaches the
+    end, the newest `capacity` samples are moved back to the front, which
+    amortises to O(1) per sample. RA is stored unwrapped so that interpolation
+    across 0/2pi does not sweep the long way round.
+
+    The history of targets is kept alongside, as (timestamp, target) changes.
+
+    Examples:
+        >>> buf = PointingBuffer()
+        >>> buf.add_ra(100.0, 1.0); buf.add_dec(100.0, -0.5)
+        >>> buf.add_ra(110.0, 1.1); buf.add_dec(110.0, -0.5)
+        >>> buf.interpolate(np.array([105.0]))
+        (array([1.05]), array([-0.5]))
+    """
+
+    def __init__(self, capacity=36000, target_capacity=1000):
+        """Rolling, time-ordered history of the pointing of one subarray
+
+        Args:
+            capacity (int): maximum number of pointing samples kept
+                --> defaults to 10 hours of 1 Hz updates
+            target_capacity (int): maximum number of target changes kept
+        """
+        self.capacity = capacity
+        self._t = np.empty(2 * capacity)
+        self._ra = np.empty(2 * capacity)
+        self._dec = np.empty(2 * capacity)
+        self._end = 0  # one past the newest sample
+        self._size = 0
+        self._last_ra = None
+        self._last_dec = None
+        self._target_times = deque(maxlen=target_capacity)
+        self._targets = deque(maxlen=target_capacity)
+
+    def __len__(self):
+        return self._size
+
+    def add_ra(self, timestamp, ra):
+        """Records a new RA (radians); adds a sample once a Dec is known too"""
+        if self._last_ra is not None:
+            # unwrap relative to the previous sample
+            ra = self._last_ra + ((ra - self._last_ra + math.pi) % TWO_PI - math.pi)
+        self._last_ra = ra
+        self._append(timestamp)
+
+    def add_dec(self, timestamp, dec):
+        """Records a new Dec (radians); adds a sample once an RA is known too"""
+        self._last_dec = dec
+        self._append(timestamp)
+
+    def add_target(self, timestamp, target):
+        """Records that `target` became active at `timestamp`"""
+        if self._target_times and timestamp < self._target_times[-1]:
+            return  # out of order: the buffer only grows forwards in time
+        self._target_times.append(timestamp)
+        self._targets.append(target)
+
+    def interpolate(self, timestamps):
+        """Linearly interpolates the pointing at many timestamps at once
+
+        Args:
+            timestamps (array-like): UNIX timestamps, in any order
+
+        Returns:
+            (ra, dec): arrays of radians shaped like timestamps, with RA in
+            [0, 2pi). Timestamps outside the buffered span give NaN.
+        """
+        timestamps = np.asarray(timestamps, dtype=float)
+        if self._size == 0:
+            return np.full(timestamps.shape, np.nan), np.full(timestamps.shape, np.nan)
+        start = self._end - self._size
+        t = self._t[start:self._end]
+        ra = np.interp(timestamps, t, self._ra[start:self._end], left=np.nan, right=np.nan)
+        dec = np.interp(timestamps, t, self._dec[start:self._end], left=np.nan, right=np.nan)
+        return np.mod(ra, TWO_PI), dec
+
+    def targets_between(self, start_time, end_time):
+        """Lists the targets that were active at any time in [start_time, end_time]
+
+        Returns:
+            list of (timestamp, target) pairs, the first being the target
+            that was already active at start_time (if known)
+        """
+        times = list(self._target_times)
+        first = max(bisect.bisect_right(times, start_time) - 1, 0)
+        last = bisect.bisect_right(times, end_time)
+        return list(zip(times[first:last], list(self._targets)[first:last]))
+
+    def _append(self, timestamp):
+        if self._last_ra is None or self._last_dec is None:
+            return
+        if self._size and timestamp <= self._t[self._end - 1]:
+            if timestamp == self._t[self._end - 1]:
+                # RA and Dec of the same sample arrive as separate updates
+                self._ra[self._end - 1] = self._last_ra
+                self._dec[self._end - 1] = self._last_dec
+            return
+        if self._end == len(self._t):
+            keep = self.capacity - 1
+            for array in (self._t, self._ra, self._dec):
+                array[:keep] = array[self._end - keep:self._end]
+            self._end = keep
+            self._size = min(self._size, keep)
+        self._t[self._end] = timestamp
+        self._ra[self._end] = self._last_ra
+        self._dec[self._end] = self._last_dec
+        self._end += 1
+        self._size = min(self._size + 1, self.capacity)
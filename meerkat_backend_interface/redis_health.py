@@ -0,0 +1,139 @@
+"""
+Background monitoring of the local redis server.
+
+A RedisHealthMonitor thread pings redis every `interval` seconds, reports
+the round-trip time (None while redis is unreachable) to a callback, and,
+once redis answers again, replays the writes spooled during the outage
+(see spool.py and redis_tools.set_spool). Each traffic class (see
+redis_tools.get_redis) has its own monitor and spool, so an outage of the
+instance of one class does not hold back the writes of the others.
+"""
+
+import threading
+import time
+
+import redis
+
+from .redis_tools import METADATA, TRAFFIC_CLASSES, get_redis, replay_spool, set_spool
+from .spool import WriteSpool
+from .metrics import Counter, Gauge
+from .logger import log
+
+REDIS_RTT = Gauge('redis_rtt_seconds', 'Round-trip time of a redis PING (NaN while unreachable)',
+                  ['traffic_class'])
+REDIS_SPOOLED = Gauge('redis_spooled_operations', 'Writes and publishes waiting in the spool',
+                      ['traffic_class'])
+REDIS_REPLAYED = Counter('redis_replayed_operations_total', 'Spooled writes and publishes replayed',
+                         ['traffic_class'])
+
+
+class RedisHealthMonitor(object):
+    """Pings redis from a background thread and replays the spool when it is back
+
+    Examples:
+        >>> monitor = RedisHealthMonitor(redis.StrictRedis(), spool,
+        ...                              on_update=lambda rtt: io_loop.add_callback(update_sensors, rtt))
+        >>> monitor.start()
+    """
+
+    def __init__(self, redis_server, spool=None, interval=1.0, on_update=None):
+        """Pings redis from a background thread and replays the spool when it is back
+
+        Args:
+            redis_server (redis.StrictRedis): the server to monitor, from
+                get_redis (its traffic_class labels the metrics)
+            spool (spool.WriteSpool): writes to replay once redis answers
+            interval (float): seconds between pings
+            on_update (callable): called (from the monitor thread) with the
+                round-trip time in seconds after each ping, or None if redis
+                did not answer
+        """
+        self.redis_server = redis_server
+        self.traffic_class = getattr(redis_server, 'traffic_class', METADATA)
+        self.spool = spool
+        self.interval = interval
+        self.on_update = on_update
+        self.rtt = None  # of the last ping
+        self._reachable = True
+        self._stop = threading.Event()
+        self._thread = None
+        self._rtt_gauge = REDIS_RTT.labels(self.traffic_class)
+        self._replayed = REDIS_REPLAYED.labels(self.traffic_class)
+        REDIS_SPOOLED.labels(self.traffic_class).set_function(
+            lambda: len(self.spool) if self.spool is not None else 0)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="redis-health-{}".format(self.traffic_class))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def check(self):
+        """Pings redis once (and replays the spool if it answers)
+
+        Returns:
+            the round-trip time in seconds, or None if redis is unreachable
+        """
+        try:
+            started = time.time()
+            self.redis_server.ping()
+            rtt = time.time() - started
+        except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+            rtt = None
+        if (rtt is not None) != self._reachable:
+            self._reachable = rtt is not None
+            if self._reachable:
+                log.info("Redis ({} traffic) is reachable again".format(self.traffic_class))
+            else:
+                log.error("Redis ({} traffic) is unreachable".format(self.traffic_class))
+        if rtt is not None and self.spool is not None and self.spool.active:
+            try:
+                self._replayed.inc(replay_spool(self.redis_server, self.spool))
+            except redis.exceptions.RedisError as e:
+                log.error("Replaying the spool failed, will retry: {}".format(e))
+        self.rtt = rtt
+        self._rtt_gauge.set(float('nan') if rtt is None else rtt)
+        return rtt
+
+    def _run(self):
+        while not self._stop.is_set():
+            rtt = self.check()
+            if self.on_update is not None:
+                try:
+                    self.on_update(rtt)
+                except Exception:
+                    log.exception("Redis health callback failed")
+            self._stop.wait(self.interval)
+
+
+def start_spooling(redis_server, spool_path, interval=1.0, on_update=None):
+    """Spools the writes of each traffic class while its redis instance is
+    down, and monitors every instance
+
+    The writes of redis_server's traffic class are spooled to spool_path,
+    those of each other class to spool_path + ".[class]".
+
+    Args:
+        redis_server (redis.StrictRedis): the server whose health on_update reports
+        spool_path (str): the spool file of redis_server's traffic class
+        interval (float): seconds between pings
+        on_update (callable): see RedisHealthMonitor, for redis_server only
+
+    Returns:
+        the started RedisHealthMonitors, redis_server's first
+    """
+    main_class = getattr(redis_server, 'traffic_class', METADATA)
+    monitors = []
+    for traffic_class in [main_class] + [c for c in TRAFFIC_CLASSES if c != main_class]:
+        if traffic_class == main_class:
+            server, path, callback = redis_server, spool_path, on_update
+        else:
+            server, path, callback = get_redis(traffic_class), "{}.{}".format(spool_path, traffic_class), None
+        spool = WriteSpool(path)
+        set_spool(spool, traffic_class)
+        monitor = RedisHealthMonitor(server, spool, interval, callback)
+        monitor.start()
+        monitors.append(monitor)
+    return monitors
@@ -1,20 +1,308 @@
-from .logger import log
+import logging
+import os
+import socket
+import threading
+import time
+
+import redis
+
+from .logger import log, RateLimit
+from .metrics import Histogram
 
 
 class REDIS_CHANNELS:
     """The redis channels that may be published to"""
     alerts = "alerts"
     sensor_alerts = "sensor_alerts" # Channel for sensor vals (for immediate update on change). 
+    antenna_health = "antenna_health"  # Channel for changes in the number/set of usable antennas
+
+
+# Metadata returned by get_product_snapshot, as (field, redis type) pairs,
+# the type being 'string', 'list' or 'hash'.
+# Each field lives at the key "[product_id]:[field]".
+PRODUCT_METADATA_FIELDS = [
+    ('timestamp', 'string'),
+    ('antennas', 'list'),
+    ('n_channels', 'string'),
+    ('proxy_name', 'string'),
+    ('streams', 'string'),
+    ('cam:url', 'string'),
+    ('target', 'string'),
+    ('pos_request_base_ra', 'string'),
+    ('pos_request_base_dec', 'string'),
+    ('schedule_blocks', 'string'),
+    ('target_info', 'hash'),
+    ('pointing', 'hash'),
+    ]
+_VERSIONED_FIELDS = set(field for field, _ in PRODUCT_METADATA_FIELDS)  # see _bump_versions
+
+# Reads every key passed in KEYS inside a single server-side call, so the
+# result can never interleave with a writer. ARGV[i] gives the type of KEYS[i];
+# hashes come back as flat [field, value, ...] lists.
+_SNAPSHOT_LUA = """
+local values = {}
+for i, key in ipairs(KEYS) do
+    if ARGV[i] == 'list' then
+        values[i] = redis.call('LRANGE', key, 0, -1)
+    elseif ARGV[i] == 'hash' then
+        values[i] = redis.call('HGETALL', key)
+    else
+        values[i] = redis.call('GET', key)
+    end
+end
+return values
+"""
+
+REDIS_LATENCY = Histogram('redis_request_seconds',
+                          'Latency of redis writes (one pipeline each) and publishes', ['op'])
+_WRITE_LATENCY = REDIS_LATENCY.labels('write')
+_PUBLISH_LATENCY = REDIS_LATENCY.labels('publish')
+
+# Every sensor update is written and published, so debug messages about
+# the same key (or sensor channel) are logged at most every 10 s
+_log_limit = RateLimit(interval=10.0)
+
+_spools = dict()  # traffic class --> spool.WriteSpool taking its writes while redis is unreachable (see set_spool)
+
+_scripts = dict()  # lua source --> redis.client.Script, so the sha is only loaded once
+
+# Traffic classes: each can be sent to its own redis instance or database
+# (see configure_redis), and always gets its own connection pools, so that
+# a burst of sensor updates cannot hold up the delivery of lifecycle alerts.
+CONTROL = 'control'  # what drives the pipeline: 'alerts', 'katportal:worker[n]:alerts', 'chan[n]', the node registry
+METADATA = 'metadata'  # product metadata keys (and everything else)
+SENSOR = 'sensor'  # the sensor update firehose: "[product_id]:[sensor_name]" values, "sensors:*" channels and 'sensor_alerts'
+TRAFFIC_CLASSES = (CONTROL, METADATA, SENSOR)
+CHANNEL_CLASSES = {
+    REDIS_CHANNELS.alerts: CONTROL,
+    REDIS_CHANNELS.sensor_alerts: SENSOR,
+    REDIS_CHANNELS.antenna_health: METADATA,  # announces "[product_id]:good_antennas" changes
+}
+
+# Connection settings, in increasing order of precedence: DEFAULT_REDIS_SETTINGS,
+# the $BLUSE_REDIS_* environment variables (REDIS_ENV), then $BLUSE_REDIS_[CLASS]_*
+# for a traffic class, configure_redis() (e.g. from the command line, see
+# add_redis_arguments), then configure_redis(traffic_class), and get_redis() arguments
+DEFAULT_REDIS_SETTINGS = {
+    'host': 'localhost',
+    'port': 6379,
+    'unix_socket_path': None,  # connect over this unix-domain socket instead of TCP
+    'db': 0,
+    'max_connections': None,  # per pool; None is unlimited
+    'socket_timeout': None,  # seconds a command may take; None waits forever
+    'socket_connect_timeout': None,  # seconds to connect (TCP only)
+    'socket_keepalive': True,  # TCP keepalive, so dead peers are noticed (TCP only)
+}
+REDIS_ENV = {
+    'host': 'BLUSE_REDIS_HOST',
+    'port': 'BLUSE_REDIS_PORT',
+    'unix_socket_path': 'BLUSE_REDIS_SOCKET',
+    'db': 'BLUSE_REDIS_DB',
+    'max_connections': 'BLUSE_REDIS_MAX_CONNECTIONS',
+    'socket_timeout': 'BLUSE_REDIS_TIMEOUT',
+    'socket_connect_timeout': 'BLUSE_REDIS_CONNECT_TIMEOUT',
+    'socket_keepalive': 'BLUSE_REDIS_KEEPALIVE',
+}
+_SETTING_TYPES = {'port': int, 'db': int, 'max_connections': int, 'socket_timeout': float,
+                  'socket_connect_timeout': float,
+                  'socket_keepalive': lambda value: value.lower() not in ('0', 'false', 'no', 'off')}
+# idle seconds before probing, seconds between probes, failed probes before the connection is dropped
+_KEEPALIVE_OPTIONS = dict((getattr(socket, name), value) for name, value in
+                          [('TCP_KEEPIDLE', 60), ('TCP_KEEPINTVL', 10), ('TCP_KEEPCNT', 3)]
+                          if hasattr(socket, name))
+
+_configured = dict()  # traffic class (None for all) --> settings given to configure_redis
+_pools = dict()  # (traffic class, settings) --> redis.ConnectionPool shared by every get_redis() for them
+_pools_lock = threading.Lock()
+
+
+def channel_class(channel):
+    """Returns the traffic class of a channel (see CHANNEL_CLASSES)"""
+    if channel in CHANNEL_CLASSES:
+        return CHANNEL_CLASSES[channel]
+    if channel.startswith('sensors:'):
+        return SENSOR  # see sensor_channels.py
+    if channel.startswith(('katportal:worker', 'chan', 'node:')):
+        return CONTROL
+    return METADATA
+
+
+def sensor_class(sensor_name):
+    """Returns the traffic class of the "[product_id]:[sensor_name]" key of a sensor
+
+    Sensors that are also product metadata fields (e.g. 'target', see
+    get_product_snapshot) are stored with the metadata, the rest as SENSOR.
+    """
+    if any(sensor_name == field for field, _ in PRODUCT_METADATA_FIELDS):
+        return METADATA
+    return SENSOR
+
+
+def configure_redis(traffic_class=None, **settings):
+    """Sets the process-wide redis connection settings (None values are ignored)
+
+    Call this before the first get_redis(), e.g. from a start script.
+
+    Args:
+        traffic_class (str): one of TRAFFIC_CLASSES, to only configure the
+            connections of that class --> None configures all of them
+        settings: see DEFAULT_REDIS_SETTINGS
+
+    Examples:
+        >>> configure_redis(unix_socket_path='/var/run/redis/redis.sock', max_connections=32)
+        >>> configure_redis(SENSOR, unix_socket_path='/var/run/redis/sensors.sock')
+        >>> server = get_redis()
+    """
+    if traffic_class is not None and traffic_class not in TRAFFIC_CLASSES:
+        raise ValueError("Unknown traffic class: {}".format(traffic_class))
+    for name, value in settings.items():
+        if name not in DEFAULT_REDIS_SETTINGS:
+            raise TypeError("Unknown redis setting: {}".format(name))
+        if value is not None:
+            _configured.setdefault(traffic_class, dict())[name] = value
+
+
+def redis_settings(traffic_class=METADATA, **overrides):
+    """Returns the effective connection settings of a traffic class (see DEFAULT_REDIS_SETTINGS)"""
+    settings = dict(DEFAULT_REDIS_SETTINGS)
+    for prefix in ['BLUSE_REDIS_', 'BLUSE_REDIS_{}_'.format(traffic_class.upper())]:
+        for name, variable in REDIS_ENV.items():
+            value = os.environ.get(variable.replace('BLUSE_REDIS_', prefix, 1))
+            if value:
+                settings[name] = _SETTING_TYPES.get(name, str)(value)
+    settings.update(_configured.get(None, {}))
+    settings.update(_configured.get(traffic_class, {}))
+    settings.update((name, value) for name, value in overrides.items() if value is not None)
+    return settings
+
+
+def get_redis(traffic_class=METADATA, listener=False, **overrides):
+    """Returns a redis.StrictRedis for a traffic class, using its shared pool
+
+    Every component of a process that asks for the same traffic class and
+    settings shares one connection pool, rather than each opening its own
+    connections. Different traffic classes never share a pool, even when they
+    are stored in the same redis database. The returned server's
+    traffic_class attribute is used to replay spooled writes to the right
+    instance (see replay_spool).
+
+    Args:
+        traffic_class (str): one of TRAFFIC_CLASSES
+        listener (bool): the connection will block on pubsub listen(), so it
+            gets a pool without socket_timeout (which would end the listen)
+        overrides: settings taking precedence over the configured ones,
+            e.g. db=1 (see DEFAULT_REDIS_SETTINGS)
+
+    Returns:
+        redis.StrictRedis
+
+    Examples:
+        >>> server = get_redis()
+        >>> sensor_server = get_redis(SENSOR)
+        >>> pubsub = get_redis(CONTROL, listener=True).pubsub(ignore_subscribe_messages=True)
+    """
+    if traffic_class not in TRAFFIC_CLASSES:
+        raise ValueError("Unknown traffic class: {}".format(traffic_class))
+    settings = redis_settings(traffic_class, **overrides)
+    if listener:
+        settings['socket_timeout'] = None
+    key = (traffic_class, listener, tuple(sorted(settings.items())))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = _make_pool(traffic_class, settings)
+    server = redis.StrictRedis(connection_pool=pool)
+    server.traffic_class = traffic_class
+    return server
+
 
+def _make_pool(traffic_class, settings):
+    if settings['unix_socket_path']:
+        log.info("Connecting %s traffic to redis at unix socket %s (db %s)",
+                 traffic_class, settings['unix_socket_path'], settings['db'])
+        return redis.ConnectionPool(connection_class=redis.UnixDomainSocketConnection,
+                                    path=settings['unix_socket_path'],
+                                    db=settings['db'],
+                                    socket_timeout=settings['socket_timeout'],
+                                    max_connections=settings['max_connections'])
+    log.info("Connecting %s traffic to redis at %s:%s (db %s)",
+             traffic_class, settings['host'], settings['port'], settings['db'])
+    return redis.ConnectionPool(host=settings['host'],
+                                port=settings['port'],
+                                db=settings['db'],
+                                socket_timeout=settings['socket_timeout'],
+                                socket_connect_timeout=settings['socket_connect_timeout'],
+                                socket_keepalive=settings['socket_keepalive'],
+                                socket_keepalive_options=_KEEPALIVE_OPTIONS if settings['socket_keepalive'] else None,
+                                max_connections=settings['max_connections'])
 
-def write_pair_redis(server, key, value, expiration=None):
+
+def add_redis_arguments(parser):
+    """Adds the redis connection options to an argparse parser
+
+    Options left unset fall back to the $BLUSE_REDIS_* environment variables,
+    then to DEFAULT_REDIS_SETTINGS; pass the parsed arguments to
+    configure_redis_from_args.
+    """
+    group = parser.add_argument_group(title="redis", description="connection to the redis server "
+                                      "(unset options fall back to $BLUSE_REDIS_*, then the defaults)")
+    group.add_argument('--redis-host', help='redis host (default: localhost)')
+    group.add_argument('--redis-port', type=int, help='redis port (default: 6379)')
+    group.add_argument('--redis-socket', help='unix-domain socket of redis, used instead of host and port')
+    group.add_argument('--redis-max-connections', type=int, help='connections per pool (default: unlimited)')
+    group.add_argument('--redis-timeout', type=float, help='seconds a redis command may take (default: no limit)')
+    group.add_argument('--redis-connect-timeout', type=float, help='seconds to connect to redis (default: no limit)')
+    group.add_argument('--no-redis-keepalive', dest='redis_keepalive', action='store_false', default=None,
+                       help='disable TCP keepalive on redis connections')
+    for traffic_class in [CONTROL, SENSOR]:
+        group.add_argument('--redis-{}-host'.format(traffic_class),
+                           help='redis host for {} traffic (default: --redis-host)'.format(traffic_class))
+        group.add_argument('--redis-{}-port'.format(traffic_class), type=int,
+                           help='redis port for {} traffic (default: --redis-port)'.format(traffic_class))
+        group.add_argument('--redis-{}-socket'.format(traffic_class),
+                           help='redis unix-domain socket for {} traffic'.format(traffic_class))
+        group.add_argument('--redis-{}-db'.format(traffic_class), type=int,
+                           help='redis database for {} traffic (default: 0)'.format(traffic_class))
+    return group
+
+
+def configure_redis_from_args(args):
+    """Calls configure_redis with the options added by add_redis_arguments"""
+    configure_redis(host=args.redis_host,
+                    port=args.redis_port,
+                    unix_socket_path=args.redis_socket,
+                    max_connections=args.redis_max_connections,
+                    socket_timeout=args.redis_timeout,
+                    socket_connect_timeout=args.redis_connect_timeout,
+                    socket_keepalive=args.redis_keepalive)
+    for traffic_class in [CONTROL, SENSOR]:
+        configure_redis(traffic_class,
+                        host=getattr(args, 'redis_{}_host'.format(traffic_class)),
+                        port=getattr(args, 'redis_{}_port'.format(traffic_class)),
+                        unix_socket_path=getattr(args, 'redis_{}_socket'.format(traffic_class)),
+                        db=getattr(args, 'redis_{}_db'.format(traffic_class)))
+
+
+def _get_script(server, source):
+    """Returns a (cached) registered lua script for the given source"""
+    if source not in _scripts:
+        _scripts[source] = server.register_script(source)
+    return _scripts[source]
+
+
+def write_pair_redis(server, key, value, expiration=None, versioned=True):
     """Creates a key-value pair self.redis_server's redis-server.
 
+    Keys of the product metadata fields (see PRODUCT_METADATA_FIELDS) also
+    bump the product's version counters (see _bump_versions) within the same
+    MULTI/EXEC transaction.
+
     Args:
         server (redis.StrictRedis) a redis-py redis server object
         key (str): the key of the key-value pair
         value (str): the value of the key-value pair
         expiration (number): number of seconds before key expiration
+        versioned (bool): whether to bump the product's version counters
 
     Returns:
         True if success, False otherwise, and logs either an 'debug' or 'error' message
@@ -23,40 +311,264 @@ def write_pair_redis(server, key, value, expiration=None):
         >>> server = BLBackendInterface('localhost', 5000)
         >>> server._write_to_redis("aliens:found", "yes")
     """
+    op = ['set', key, value, expiration, versioned]
+    if _spool_if_replaying(server, op):
+        return True
     try:
-        server.set(key, value, ex=expiration)
-        log.debug("Created redis key/value: {} --> {}".format(key, value))
+        _execute(server, op)
+        if log.isEnabledFor(logging.DEBUG) and _log_limit.allow(key) is not None:
+            log.debug("Created redis key/value: %s --> %s", key, value)
         return True
+    except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+        if _spool_when_down(server, op):
+            return True
+        log.error("Failed to create redis key/value pair")
+        return False
     except:
         log.error("Failed to create redis key/value pair")
         return False
 
 
-def write_list_redis(server, key, values):
+def write_list_redis(server, key, values, versioned=True):
     """Creates a new list and rpushes values to it
 
         If a list already exists at the given key, then
-        delete it and rpush values to a new empty list
+        delete it and rpush values to a new empty list.
+        Both happen in one MULTI/EXEC transaction together with
+        the version bump, so readers never see a half-written list.
 
         Args:
             server (redis.StrictRedis) a redis-py redis server object
             key (str): key identifying the list
             values (list): list of values to rpush to redis list
+            versioned (bool): whether to bump the product's version counters
 
         Returns:
             True if success, False otherwise, and logs either an 'debug' or 'error' message
     """
+    op = ['list', key, list(values), versioned]
+    if _spool_if_replaying(server, op):
+        return True
     try:
-        if server.exists(key):
-            server.delete(key)
-        server.rpush(key, *values)
-        log.debug("Pushed to list: {} --> {}".format(key, values))
+        _execute(server, op)
+        if log.isEnabledFor(logging.DEBUG) and _log_limit.allow(key) is not None:
+            log.debug("Pushed to list: %s --> %s", key, values)
         return True
+    except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+        if _spool_when_down(server, op):
+            return True
+        log.error("Failed to rpush to {}".format(key))
+        return False
     except:
         log.error("Failed to rpush to {}".format(key))
         return False
 
 
+def write_hash_redis(server, key, mapping, replace=True, versioned=True):
+    """Writes a mapping of fields to values into a redis hash
+
+        Args:
+            server (redis.StrictRedis) a redis-py redis server object
+            key (str): key identifying the hash
+            mapping (dict): field --> value pairs to write
+            replace (bool): if True, fields not in mapping are removed,
+                otherwise the mapping is merged into the existing hash
+            versioned (bool): whether to bump the product's version counters
+
+        Returns:
+            True if success, False otherwise, and logs either an 'debug' or 'error' message
+    """
+    op = ['hash', key, mapping, replace, versioned]
+    if _spool_if_replaying(server, op):
+        return True
+    try:
+        _execute(server, op)
+        if log.isEnabledFor(logging.DEBUG) and _log_limit.allow(key) is not None:
+            log.debug("Wrote hash: %s --> %s", key, mapping)
+        return True
+    except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+        if _spool_when_down(server, op):
+            return True
+        log.error("Failed to write hash {}".format(key))
+        return False
+    except:
+        log.error("Failed to write hash {}".format(key))
+        return False
+
+
+def _queue_op(pipe, op, traffic_class=METADATA):
+    """Queues a write operation (as built by the write_*_redis functions) on a pipeline
+
+    Versions are only bumped on the METADATA server, where the versions
+    hashes and the snapshot they describe live.
+    """
+    kind = op[0]
+    if kind == 'publish':
+        pipe.publish(op[1], op[2])
+        return
+    key = op[1]
+    if kind == 'set':
+        pipe.set(key, op[2], ex=op[3])
+    elif kind == 'list':
+        pipe.delete(key)
+        pipe.rpush(key, *op[2])
+    elif kind == 'hash':
+        if op[3]:
+            pipe.delete(key)
+        pipe.hmset(key, op[2])
+    else:
+        raise ValueError("Unknown redis operation {!r}".format(kind))
+    if op[-1] and traffic_class == METADATA:  # versioned
+        _bump_versions(pipe, key)
+
+
+def _execute(server, op):
+    """Applies one write operation in its own MULTI/EXEC transaction"""
+    pipe = server.pipeline()
+    _queue_op(pipe, op, getattr(server, 'traffic_class', METADATA))
+    started = time.time()
+    pipe.execute()
+    _WRITE_LATENCY.observe(time.time() - started)
+
+
+def set_spool(spool, traffic_class=METADATA):
+    """Sets the spool that takes a traffic class's writes and publishes while
+    its redis instance is unreachable
+
+    With a spool set, the write_*_redis and publish_to_redis functions
+    append their operation to it (and return True) when redis cannot be
+    reached, and keep doing so until replay_spool has replayed everything.
+    Each traffic class has its own spool, so an outage of e.g. the sensor
+    instance does not hold back the writes of the others.
+
+    Args:
+        spool (spool.WriteSpool): the spool --> None stops spooling
+        traffic_class (str): one of TRAFFIC_CLASSES
+    """
+    if spool is None:
+        _spools.pop(traffic_class, None)
+    else:
+        _spools[traffic_class] = spool
+
+
+def _spool_for(server):
+    """Returns the spool of the server's traffic class, or None"""
+    return _spools.get(getattr(server, 'traffic_class', METADATA))
+
+
+def _spool_if_replaying(server, op):
+    """Spools op, rather than writing it, if older operations are still spooled"""
+    spool = _spool_for(server)
+    if spool is None or not spool.active:
+        return False
+    with spool.lock:
+        if not spool.active:  # replayed in the meantime
+            return False
+        spool.append([getattr(server, 'traffic_class', METADATA)] + op)
+        return True
+
+
+def _spool_when_down(server, op):
+    """Spools op after redis could not be reached, if there is a spool"""
+    spool = _spool_for(server)
+    if spool is None:
+        return False
+    if not spool.active:
+        log.warning("Redis is unreachable; spooling writes to {}".format(spool.path))
+    spool.append([getattr(server, 'traffic_class', METADATA)] + op)
+    return True
+
+
+def replay_spool(server, spool, batch_size=1000):
+    """Replays spooled operations in their original order, then empties the spool
+
+    The operations are sent in pipelined batches of batch_size, each in one
+    MULTI/EXEC transaction. New writes are held back (spooled behind the
+    replayed ones) until the replay is done. spool.lock is only held while
+    the spool is read or rewritten, and for the last batch, so writers are
+    not blocked for the whole replay. Operations are replayed to the
+    server of their traffic class (see get_redis).
+
+    Args:
+        server (redis.StrictRedis) a redis-py redis server object, used for
+            the operations of its own traffic class
+        spool (spool.WriteSpool): the spool to replay
+        batch_size (int): operations per pipeline
+
+    Returns:
+        the number of operations replayed
+
+    Raises:
+        redis.exceptions.ConnectionError if redis goes away again; the
+        operations not yet replayed are kept in the spool
+    """
+    replayed = 0
+    while True:
+        with spool.lock:
+            ops = spool.read()
+            if len(ops) <= batch_size:
+                # the last batch: replayed under the lock, so that no new write overtakes it
+                _replay_batches(server, spool, ops, batch_size)
+                spool.clear()
+                replayed += len(ops)
+                break
+        _replay_batches(server, spool, ops, batch_size)
+        with spool.lock:
+            spool.replace(spool.read()[len(ops):])  # keeps the writes spooled during the replay
+        replayed += len(ops)
+    if replayed:
+        log.info("Replayed {} spooled redis operations".format(replayed))
+    return replayed
+
+
+def _replay_batches(server, spool, ops, batch_size):
+    """Sends ops, the oldest operations of spool, in pipelined batches
+
+    If a batch fails, the operations not yet replayed (and any spooled
+    since ops were read) are kept in the spool and the error is raised.
+    """
+    done = 0
+    try:
+        while done < len(ops):
+            traffic_class = ops[done][0] if ops[done][0] in TRAFFIC_CLASSES else METADATA
+            if traffic_class == getattr(server, 'traffic_class', METADATA):
+                pipe = server.pipeline()
+            else:
+                pipe = get_redis(traffic_class).pipeline()
+            n = 0
+            for op in ops[done:done + batch_size]:
+                if op[0] in TRAFFIC_CLASSES:
+                    if op[0] != traffic_class:
+                        break  # the next batch goes to another server
+                    op = op[1:]
+                elif traffic_class != METADATA:
+                    break
+                _queue_op(pipe, op, traffic_class)
+                n += 1
+            pipe.execute()
+            done += n
+    except Exception:
+        with spool.lock:
+            spool.replace(spool.read()[done:])
+        raise
+
+
+def _bump_versions(pipe, key):
+    """Queues the version bumps for a write to "[product_id]:[field]".
+
+    HINCRBY "[product_id]:versions" [field] counts the writes to that one
+    field, and INCR "[product_id]:version" counts writes to the product as a
+    whole (the version returned by get_product_snapshot). Only the fields
+    of PRODUCT_METADATA_FIELDS are versioned, so the stream of sensor
+    updates does not make every snapshot look out of date.
+    """
+    product_id, sep, field = key.partition(':')
+    if not sep or field not in _VERSIONED_FIELDS:
+        return
+    pipe.hincrby("{}:versions".format(product_id), field, 1)
+    pipe.incr("{}:version".format(product_id))
+
+
 def publish_to_redis(server, channel, message):
     """Publishes a message to a channel in self.redis_server's redis-server.
 
@@ -72,10 +584,130 @@ def publish_to_redis(server, channel, message):
         >>> server = BLBackendInterface('localhost', 5000)
         >>> server._publish_to_redis("alerts", "Found aliens!!!")
     """
+    op = ['publish', channel, message]
+    if _spool_if_replaying(server, op):
+        return True
     try:
+        started = time.time()
         server.publish(channel, message)
-        log.debug("Published to {} --> {}".format(channel, message))
+        _PUBLISH_LATENCY.observe(time.time() - started)
+        if log.isEnabledFor(logging.DEBUG) and (
+                channel_class(channel) != SENSOR
+                or _log_limit.allow((channel, message.partition(':')[0]) if channel == REDIS_CHANNELS.sensor_alerts
+                                    else channel) is not None):
+            log.debug("Published to %s --> %s", channel, message)
         return True
+    except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+        if _spool_when_down(server, op):
+            return True
+        log.error("Failed to publish to {} --> {}".format(channel, message))
+        return False
     except:
         log.error("Failed to publish to {} --> {}".format(channel, message))
         return False
+
+
+def bump_product_version(server, product_id):
+    """Increments the metadata version counter of a product.
+
+    write_pair_redis and write_list_redis already do this for every write
+    of a metadata field;
+    this is only needed when metadata was changed by other means.
+
+    Args:
+        server (redis.StrictRedis) a redis-py redis server object
+        product_id (str): the product id given in the ?configure request
+
+    Returns:
+        The new version (int) if success, None otherwise
+    """
+    try:
+        return server.incr("{}:version".format(product_id))
+    except:
+        log.error("Failed to bump metadata version of {}".format(product_id))
+        return None
+
+
+def get_product_snapshot(server, product_id):
+    """Fetches all metadata of a product in a single round-trip.
+
+    The keys are read by a lua script, which redis executes atomically, so
+    the snapshot is consistent: no write can land between two of its reads.
+
+    Args:
+        server (redis.StrictRedis) a redis-py redis server object
+        product_id (str): the product id given in the ?configure request
+
+    Returns:
+        A dictionary of field --> value (None for missing keys, a list for
+        'antennas' and a dictionary for hash fields) plus a 'version' entry,
+        or None if the read failed
+
+    Examples:
+        >>> snapshot = get_product_snapshot(server, "array_1_bc856M4k")
+        >>> snapshot['version'], snapshot['antennas']
+        (3, ['m000', 'm001'])
+    """
+    keys = ["{}:{}".format(product_id, field) for field, _ in PRODUCT_METADATA_FIELDS]
+    keys.append("{}:version".format(product_id))
+    types = [kind for _, kind in PRODUCT_METADATA_FIELDS] + ['string']
+    try:
+        values = _get_script(server, _SNAPSHOT_LUA)(keys=keys, args=types, client=server)
+    except redis.RedisError:
+        log.error("Failed to read metadata snapshot of {}".format(product_id))
+        return None
+    snapshot = dict()
+    for (field, kind), value in zip(PRODUCT_METADATA_FIELDS, values):
+        if kind == 'hash':
+            value = dict(zip(value[::2], value[1::2]))
+        snapshot[field] = value
+    snapshot['version'] = int(values[-1] or 0)
+    return snapshot
+
+
+def get_product_versions(server, product_id):
+    """Fetches the per-field version counters of a product.
+
+    Args:
+        server (redis.StrictRedis) a redis-py redis server object
+        product_id (str): the product id given in the ?configure request
+
+    Returns:
+        A dictionary of field --> version (int), or None if the read failed
+    """
+    try:
+        versions = server.hgetall("{}:versions".format(product_id))
+    except:
+        log.error("Failed to read versions of {}".format(product_id))
+        return None
+    return dict((field, int(version)) for field, version in versions.items())
+
+
+def get_changed_fields(server, product_id, known_versions):
+    """Finds which fields of a product were written since they were last read.
+
+    This is meant for polling consumers: fetch the small versions hash each
+    cycle and only re-fetch the fields it reports as changed.
+
+    Args:
+        server (redis.StrictRedis) a redis-py redis server object
+        product_id (str): the product id given in the ?configure request
+        known_versions (dict): field --> version, as returned by the previous call
+            (or an empty dict on the first call)
+
+    Returns:
+        (changed, versions): the list of fields whose version differs from
+        known_versions, and the current versions to pass to the next call.
+        On failure, ([], known_versions).
+
+    Examples:
+        >>> changed, versions = get_changed_fields(server, product_id, versions)
+        >>> if 'target' in changed:
+        ...     target = server.get("{}:target".format(product_id))
+    """
+    versions = get_product_versions(server, product_id)
+    if versions is None:
+        return [], known_versions
+    changed = [field for field, version in versions.items()
+               if known_versions.get(field) != version]
+    return changed, versions
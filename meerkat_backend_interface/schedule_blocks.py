@@ -0,0 +1,158 @@
+"""
+Incremental tracking of the schedule blocks assigned to each subarray.
+
+The portal gives a block's id, but no version, so a block is only fetched
+(future_targets) when its id first appears, and then again every
+revalidate_interval seconds to notice edits by the operator. A fetched block
+whose fingerprint (a hash of its targets) is unchanged is left alone;
+otherwise the change is described as a diff of its targets:
+
+    {"block": "20181015-0003", "change": "modified",
+     "added": [target, ...], "removed": [target, ...], "modified": [target, ...]}
+
+where "change" is "added" or "removed" for blocks that appeared or were
+unassigned, and each target is as returned by future_targets. The katportal
+client publishes the diffs of every refresh as one JSON list on
+"schedule_blocks:[product_id]" (see schedule_block_channel).
+"""
+
+import hashlib
+import json
+import time
+
+SCHEDULE_BLOCK_CHANNEL_PREFIX = "schedule_blocks"
+
+
+def schedule_block_channel(product_id):
+    """Returns the channel a product's schedule block diffs are published on"""
+    return "{}:{}".format(SCHEDULE_BLOCK_CHANNEL_PREFIX, product_id)
+
+
+def block_fingerprint(targets):
+    """Returns a hash of a block's targets, which changes if any of them does"""
+    return hashlib.sha1(json.dumps(targets, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _keyed_targets(targets):
+    """Keys targets by their description, numbering repeated visits of a target
+
+    Returns:
+        list of ((description, visit), target), in order
+    """
+    keyed = []
+    visits = dict()
+    for target in targets:
+        description = target.get('target', target.get('name')) if isinstance(target, dict) else None
+        if description is None:
+            description = repr(target)
+        visits[description] = visits.get(description, 0) + 1
+        keyed.append(((description, visits[description]), target))
+    return keyed
+
+
+def diff_targets(old, new):
+    """Compares two versions of a block's targets
+
+    A target is matched across versions by its description (and which visit
+    of that description it is); a matched target whose other fields (e.g.
+    track_duration) changed is modified.
+
+    Returns:
+        (added, removed, modified): lists of targets, in the order of new (removed: of old)
+
+    Examples:
+        >>> diff_targets([{'target': 'a', 'track_duration': 20.0}],
+        ...              [{'target': 'a', 'track_duration': 30.0}, {'target': 'b', 'track_duration': 20.0}])
+        ([{'target': 'b', 'track_duration': 20.0}], [], [{'target': 'a', 'track_duration': 30.0}])
+    """
+    old_keyed = _keyed_targets(old)
+    new_keyed = _keyed_targets(new)
+    old_targets = dict(old_keyed)
+    new_targets = dict(new_keyed)
+    added = [target for key, target in new_keyed if key not in old_targets]
+    removed = [target for key, target in old_keyed if key not in new_targets]
+    modified = [target for key, target in new_keyed if key in old_targets and old_targets[key] != target]
+    return added, removed, modified
+
+
+class ScheduleBlockTracker(object):
+    """Keeps the schedule blocks of every product, and works out what changed
+
+    Examples:
+        >>> tracker = ScheduleBlockTracker()
+        >>> tracker.to_fetch('array_1_bc856M4k', ['20181015-0003'])
+        ['20181015-0003']
+        >>> tracker.update('array_1_bc856M4k', ['20181015-0003'], {'20181015-0003': targets})
+        [{'block': '20181015-0003', 'change': 'added', 'added': targets, 'removed': [], 'modified': []}]
+    """
+
+    def __init__(self, revalidate_interval=60.0):
+        """Keeps the schedule blocks of every product, and works out what changed
+
+        Args:
+            revalidate_interval (float): seconds after which a block is fetched
+                again, to notice edits (the portal does not version blocks)
+        """
+        self.revalidate_interval = revalidate_interval
+        self._ids = dict()  # product id --> assigned block ids, in portal order
+        self._blocks = dict()  # product id --> block id --> (targets, fingerprint, time fetched)
+
+    def products(self):
+        return list(self._ids)
+
+    def track(self, product_id):
+        """Starts tracking a product, whose blocks are then listed by
+        products() for refreshing even if none could be fetched yet"""
+        self._ids.setdefault(product_id, [])
+
+    def blocks(self, product_id):
+        """Returns the targets of each assigned block, in portal order"""
+        blocks = self._blocks.get(product_id, {})
+        return [blocks[sb_id][0] for sb_id in self._ids.get(product_id, []) if sb_id in blocks]
+
+    def to_fetch(self, product_id, sb_ids, now=None):
+        """Returns the block ids that are new or due for revalidation"""
+        now = now or time.time()
+        blocks = self._blocks.get(product_id, {})
+        return [sb_id for sb_id in sb_ids
+                if sb_id not in blocks or now - blocks[sb_id][2] >= self.revalidate_interval]
+
+    def update(self, product_id, sb_ids, fetched, now=None):
+        """Records the assigned block ids and the blocks just fetched
+
+        Args:
+            product_id (str): the product id given in the ?configure request
+            sb_ids (list): the ids of every block now assigned
+            fetched (dict): block id --> targets, for the blocks fetched
+            now (float): the current time --> defaults to time.time()
+
+        Returns:
+            list of diffs (see the module docstring), empty if nothing changed
+        """
+        now = now or time.time()
+        blocks = self._blocks.setdefault(product_id, dict())
+        diffs = []
+        for sb_id in self._ids.get(product_id, []):
+            if sb_id not in sb_ids and sb_id in blocks:
+                diffs.append({'block': sb_id, 'change': 'removed', 'added': [],
+                              'removed': blocks.pop(sb_id)[0], 'modified': []})
+        for sb_id in sb_ids:
+            if sb_id not in fetched:
+                continue
+            targets = fetched[sb_id]
+            fingerprint = block_fingerprint(targets)
+            if sb_id not in blocks:
+                diffs.append({'block': sb_id, 'change': 'added', 'added': targets,
+                              'removed': [], 'modified': []})
+            elif blocks[sb_id][1] != fingerprint:
+                added, removed, modified = diff_targets(blocks[sb_id][0], targets)
+                diffs.append({'block': sb_id, 'change': 'modified', 'added': added,
+                              'removed': removed, 'modified': modified})
+            blocks[sb_id] = (targets, fingerprint, now)
+        self._ids[product_id] = list(sb_ids)
+        return diffs
+
+    def forget(self, product_id):
+        """Drops the blocks of a deconfigured product"""
+        self._ids.pop(product_id, None)
+        self._blocks.pop(product_id, None)
@@ -0,0 +1,184 @@
+import itertools
+import time
+from collections import deque
+
+import tornado.gen
+import tornado.ioloop
+
+from .logger import log
+from .metrics import Histogram
+
+
+class PRIORITIES:
+    """Priority classes of scheduled work, most urgent first"""
+    capture = 0    # capture-start/stop: recorders are waiting on the metadata
+    configure = 1  # configure, capture-done, deconfigure
+    schedule = 2   # capture-init (schedule block queries) and other refreshes
+
+
+PRIORITY_NAMES = {
+    PRIORITIES.capture: 'capture',
+    PRIORITIES.configure: 'configure',
+    PRIORITIES.schedule: 'schedule',
+    }
+
+DISPATCH_LATENCY = Histogram('scheduler_dispatch_seconds',
+                             'Time from a job being submitted to it starting', ['priority'])
+_DISPATCH_LATENCY = dict((priority, DISPATCH_LATENCY.labels(name))
+                         for priority, name in PRIORITY_NAMES.items())
+
+
+class Job(object):
+    """A unit of scheduled work: a coroutine function and its arguments"""
+
+    def __init__(self, seq, priority, key, host, deadline, droppable, fn, args):
+        self.seq = seq
+        self.priority = priority
+        self.key = key
+        self.host = host
+        self.deadline = deadline
+        self.droppable = droppable
+        self.fn = fn
+        self.args = args
+        self.submitted = time.time()
+
+
+class PriorityScheduler(object):
+    """Runs coroutines on an ioloop by priority, with per-host concurrency limits
+
+    Jobs that share a key (the product id) run one at a time in submission
+    order, so e.g. a product's capture-init never overtakes its configure.
+    Among the jobs that are free to run, the most urgent priority class goes
+    first, then the oldest. At most `host_limit` jobs run at once against
+    the same host (the CAM portal of the product).
+
+    Every job has a deadline by which it should have started. A job that
+    starts late is counted as a miss; if it was submitted as droppable it is
+    discarded instead of run.
+
+    Examples:
+        >>> scheduler = PriorityScheduler(io_loop)
+        >>> scheduler.submit(PRIORITIES.capture, product_id, client._capture_start, product_id,
+        ...                  host='portal.mkat', deadline=2.0)
+    """
+
+    def __init__(self, io_loop=None, host_limit=2):
+        """Runs coroutines on an ioloop by priority, with per-host concurrency limits
+
+        Args:
+            io_loop (tornado.ioloop.IOLoop): loop to run the jobs on
+                --> defaults to the current ioloop
+            host_limit (int): maximum number of concurrent jobs per host
+        """
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.current()
+        self.host_limit = host_limit
+        self._seq = itertools.count()
+        self._queues = dict()  # key --> deque of Jobs waiting, in submission order
+        self._busy_keys = set()
+        self._host_load = dict()  # host --> number of running jobs
+        self._stats = dict()
+
+    def submit(self, priority, key, fn, *args, **kwargs):
+        """Queues fn(*args) to run on the ioloop
+
+        Args:
+            priority (int): one of PRIORITIES
+            key (str): jobs with the same key run sequentially (e.g. the product id)
+            fn (callable): returns a tornado Future (e.g. a coroutine)
+            host (str): keyword-only, the host the job talks to, for the concurrency limit
+            deadline (float): keyword-only, seconds within which the job should start
+            droppable (bool): keyword-only, discard the job rather than start it late
+
+        Must be called from the ioloop thread (use io_loop.add_callback otherwise).
+        """
+        deadline = kwargs.get('deadline')
+        job = Job(next(self._seq), priority, key, kwargs.get('host'),
+                  None if deadline is None else time.time() + deadline,
+                  kwargs.get('droppable', False), fn, args)
+        self._queues.setdefault(key, deque()).append(job)
+        self._priority_stats(priority)['submitted'] += 1
+        self._dispatch()
+
+    def stats(self):
+        """Returns per-priority counters
+
+        Returns:
+            dict of priority --> dict with 'depth' (jobs waiting), 'running',
+            'submitted', 'started', 'dropped', 'missed' (deadline misses),
+            'wait_mean' and 'wait_max' (seconds between submission and start)
+        """
+        depths = dict()
+        for queue in self._queues.values():
+            for job in queue:
+                depths[job.priority] = depths.get(job.priority, 0) + 1
+        stats = dict()
+        for priority, counters in self._stats.items():
+            stats[priority] = dict(counters)
+            stats[priority]['depth'] = depths.get(priority, 0)
+            started = counters['started'] or 1
+            stats[priority]['wait_mean'] = counters['wait_total'] / started
+            del stats[priority]['wait_total']
+        return stats
+
+    def _priority_stats(self, priority):
+        if priority not in self._stats:
+            self._stats[priority] = {'submitted': 0, 'started': 0, 'running': 0, 'dropped': 0,
+                                     'missed': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+        return self._stats[priority]
+
+    def _next_job(self):
+        """Picks the most urgent job that is allowed to start now, or None"""
+        best = None
+        for key, queue in self._queues.items():
+            if key in self._busy_keys or not queue:
+                continue
+            job = queue[0]
+            if job.host is not None and self._host_load.get(job.host, 0) >= self.host_limit:
+                continue
+            if best is None or (job.priority, job.seq) < (best.priority, best.seq):
+                best = job
+        return best
+
+    def _dispatch(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            queue = self._queues[job.key]
+            queue.popleft()
+            if not queue:
+                del self._queues[job.key]
+            now = time.time()
+            stats = self._priority_stats(job.priority)
+            if job.deadline is not None and now > job.deadline:
+                stats['missed'] += 1
+                if job.droppable:
+                    stats['dropped'] += 1
+                    log.warning("Dropping {} for {}: missed its start deadline by {:.3f} s".format(
+                        getattr(job.fn, '__name__', job.fn), job.key, now - job.deadline))
+                    continue
+            wait = now - job.submitted
+            stats['started'] += 1
+            stats['running'] += 1
+            stats['wait_total'] += wait
+            stats['wait_max'] = max(stats['wait_max'], wait)
+            if job.priority in _DISPATCH_LATENCY:
+                _DISPATCH_LATENCY[job.priority].observe(wait)
+            self._busy_keys.add(job.key)
+            if job.host is not None:
+                self._host_load[job.host] = self._host_load.get(job.host, 0) + 1
+            self.io_loop.add_callback(self._run, job)
+
+    @tornado.gen.coroutine
+    def _run(self, job):
+        try:
+            yield job.fn(*job.args)
+        except Exception:
+            log.exception("Scheduled {} for {} failed".format(
+                getattr(job.fn, '__name__', job.fn), job.key))
+        finally:
+            self._priority_stats(job.priority)['running'] -= 1
+            self._busy_keys.discard(job.key)
+            if job.host is not None:
+                self._host_load[job.host] -= 1
+            self._dispatch()
@@ -0,0 +1,121 @@
+"""
+Hierarchical pubsub channels for sensor updates.
+
+Sensor updates are published per product, sensor group and sensor:
+
+    sensors:[product_id]:[group]:[sensor_name]  -->  [value, timestamp]
+    sensors:[product_id]:[group]:_batch         -->  [[sensor_name, value, timestamp], ...]
+
+so a processing node can PSUBSCRIBE to only the updates it needs, e.g.
+"sensors:array_1_bc856M4k:pointing:*" for the pointing of one subarray, or
+"sensors:*:antenna:*_marked_faulty" for the antenna flags of all of them.
+When several updates of the same group are published together, they are sent
+as one batched message on the group's "_batch" channel instead (which a
+pattern ending in ":*" also matches); subscribe to sensor_patterns() to
+receive both forms, and decode either with parse_sensor_message(). Messages
+are JSON.
+"""
+
+import fnmatch
+import json
+import re
+
+from .redis_tools import publish_to_redis
+
+SENSOR_CHANNEL_PREFIX = "sensors"
+
+# (group, pattern) checked in order; sensors matching none are in DEFAULT_GROUP
+SENSOR_GROUPS = [
+    ('antenna', re.compile(r'^m\d{3}_')),  # e.g. m000_marked_faulty
+    ('pointing', re.compile(r'(target|pos_request_base_ra|pos_request_base_dec)$')),
+]
+DEFAULT_GROUP = 'other'
+BATCH = "_batch"  # in place of the sensor name, for batched updates of a group
+
+
+def sensor_group(sensor_name):
+    """Returns the group a sensor is published under (see SENSOR_GROUPS)"""
+    for group, pattern in SENSOR_GROUPS:
+        if pattern.search(sensor_name):
+            return group
+    return DEFAULT_GROUP
+
+
+def sensor_channel(product_id, sensor_name):
+    """Returns the channel single updates of a sensor are published on"""
+    return "{}:{}:{}:{}".format(SENSOR_CHANNEL_PREFIX, product_id, sensor_group(sensor_name), sensor_name)
+
+
+def group_channel(product_id, group):
+    """Returns the channel batched updates of a sensor group are published on"""
+    return "{}:{}:{}:{}".format(SENSOR_CHANNEL_PREFIX, product_id, group, BATCH)
+
+
+def sensor_patterns(product_id='*', group='*', sensor_name='*'):
+    """Returns the PSUBSCRIBE patterns that receive the given updates, in both forms
+
+    Batches carry every sensor of their group, so subscribers to a single
+    sensor (or sensor pattern) should still filter what parse_sensor_message returns.
+
+    Examples:
+        >>> pubsub.psubscribe(*sensor_patterns('array_1_bc856M4k', 'pointing'))
+    """
+    patterns = ["{}:{}:{}:{}".format(SENSOR_CHANNEL_PREFIX, product_id, group, sensor_name)]
+    if not fnmatch.fnmatchcase(BATCH, sensor_name):  # or the batches would be delivered twice
+        patterns.append(group_channel(product_id, group))
+    return patterns
+
+
+def parse_sensor_message(channel, data):
+    """Decodes a message published on a sensor channel
+
+    Args:
+        channel (str): the channel it was published on
+        data (str): the message
+
+    Returns:
+        (product_id, [(sensor_name, value, timestamp), ...]), or None if
+        channel is not a sensor channel
+
+    Raises:
+        ValueError, TypeError or IndexError if the message is malformed
+    """
+    if isinstance(channel, bytes):
+        channel = channel.decode('utf-8')
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    parts = channel.split(':')
+    if len(parts) != 4 or parts[0] != SENSOR_CHANNEL_PREFIX:
+        return None
+    message = json.loads(data)
+    if parts[3] == BATCH:
+        return parts[1], [tuple(update) for update in message]
+    return parts[1], [(parts[3], message[0], message[1])]
+
+
+def publish_sensor_updates(server, product_id, updates):
+    """Publishes a product's sensor updates, batched per sensor group
+
+    A group with a single update is published on its sensor's channel, a
+    group with several on the group's batch channel, as one message.
+
+    Args:
+        server (redis.StrictRedis) a redis-py redis server object
+        product_id (str): the product the sensors belong to
+        updates (list): (sensor_name, value, timestamp) tuples, oldest first
+
+    Returns:
+        the number of messages published
+    """
+    groups = dict()  # group --> updates
+    for update in updates:
+        groups.setdefault(sensor_group(update[0]), []).append(update)
+    for group, group_updates in groups.items():
+        if len(group_updates) == 1:
+            sensor_name, value, timestamp = group_updates[0]
+            publish_to_redis(server, sensor_channel(product_id, sensor_name),
+                             json.dumps([value, timestamp], default=str))
+        else:
+            publish_to_redis(server, group_channel(product_id, group),
+                             json.dumps([list(update) for update in group_updates], default=str))
+    return len(groups)
@@ -0,0 +1,158 @@
+import fnmatch
+import numbers
+import time
+
+from .metrics import Counter
+
+FILTERED_UPDATES = Counter('sensor_filter_updates_total',
+                           'Sensor updates checked by the update filter, by outcome', ['reason'])
+_FORWARDED = FILTERED_UPDATES.labels('forwarded')
+_DUPLICATE = FILTERED_UPDATES.labels('duplicate')
+_DEADBAND = FILTERED_UPDATES.labels('deadband')
+_INTERVAL = FILTERED_UPDATES.labels('interval')
+
+
+class FilterRule(object):
+    """How updates of the sensors matching a pattern are filtered
+
+    Args:
+        drop_duplicates (bool): drop updates whose value and status are
+            both unchanged since the last forwarded update
+        deadband (float): drop numeric updates that differ from the last
+            forwarded value by less than this (and have the same status)
+        min_interval (float): forward at most one update per this many
+            seconds; the newest update held back is forwarded by flush_due()
+        period (float): for angles, the value at which they wrap around
+            (e.g. 360 for degrees), so that the deadband is applied to the
+            shortest angular difference
+    """
+
+    def __init__(self, drop_duplicates=True, deadband=None, min_interval=None, period=None):
+        self.drop_duplicates = drop_duplicates
+        self.deadband = deadband
+        self.min_interval = min_interval
+        self.period = period
+
+    def difference(self, value, last_value):
+        """Returns how far apart two numeric values are, modulo period if set"""
+        difference = abs(value - last_value)
+        if self.period is not None:
+            difference %= self.period
+            difference = min(difference, self.period - difference)
+        return difference
+
+
+# Pointing changes below an arcsecond (values are in degrees) don't matter to us
+DEFAULT_FILTER_RULES = [
+    ('*pos_request_base_ra', FilterRule(deadband=1.0 / 3600, period=360.0)),
+    ('*pos_request_base_dec', FilterRule(deadband=1.0 / 3600)),
+    ('*', FilterRule()),
+    ]
+
+
+class SensorUpdateFilter(object):
+    """Suppresses sensor updates that carry no meaningful change
+
+    Every update is checked against an in-memory table of the last forwarded
+    (value, status, time) of its sensor, using the first rule whose pattern
+    matches the sensor name. Status changes are always forwarded.
+
+    Examples:
+        >>> update_filter = SensorUpdateFilter([('*_temperature', FilterRule(deadband=0.5))])
+        >>> update_filter.accept('array_1', 'm000_temperature', 20.0, 'nominal')
+        True
+        >>> update_filter.accept('array_1', 'm000_temperature', 20.2, 'nominal')
+        False
+        >>> FILTERED_UPDATES.labels('deadband').value
+        1
+    """
+
+    def __init__(self, rules=DEFAULT_FILTER_RULES):
+        """Suppresses sensor updates that carry no meaningful change
+
+        Args:
+            rules (list): (fnmatch pattern, FilterRule) pairs, first match wins.
+                Sensors that match no pattern are always forwarded.
+        """
+        self.rules = list(rules)
+        self._rule_cache = dict()  # sensor name --> FilterRule (or None)
+        self._last = dict()  # (product_id, sensor name) --> (value, status, time forwarded)
+        self._pending = dict()  # (product_id, sensor name) --> (value, status) held back by min_interval
+
+    def rule_for(self, sensor_name):
+        """Returns the FilterRule of a sensor (or None), matched only once per name"""
+        try:
+            return self._rule_cache[sensor_name]
+        except KeyError:
+            rule = None
+            for pattern, candidate in self.rules:
+                if fnmatch.fnmatchcase(sensor_name, pattern):
+                    rule = candidate
+                    break
+            self._rule_cache[sensor_name] = rule
+            return rule
+
+    def accept(self, product_id, sensor_name, value, status=None, now=None):
+        """Decides whether an update should be forwarded, and records it if so
+
+        Args:
+            product_id (str): the product id the sensor belongs to
+            sensor_name (str): the name of the sensor
+            value: the new value
+            status (str): the new status, e.g. 'nominal'
+            now (float): the current time --> defaults to time.time()
+
+        Returns:
+            True if the update should be written and published, False otherwise
+        """
+        key = (product_id, sensor_name)
+        rule = self.rule_for(sensor_name)
+        last = self._last.get(key)
+        if rule is not None and last is not None and status == last[1]:
+            last_value = last[0]
+            if rule.drop_duplicates and value == last_value:
+                _DUPLICATE.inc()
+                return False
+            if (rule.deadband is not None and _is_number(value) and _is_number(last_value)
+                    and rule.difference(value, last_value) < rule.deadband):
+                _DEADBAND.inc()
+                return False
+        now = time.time() if now is None else now
+        if (rule is not None and rule.min_interval is not None and last is not None
+                and now - last[2] < rule.min_interval):
+            self._pending[key] = (value, status)
+            _INTERVAL.inc()
+            return False
+        self._pending.pop(key, None)
+        self._last[key] = (value, status, now)
+        _FORWARDED.inc()
+        return True
+
+    def flush_due(self, now=None):
+        """Releases updates held back by min_interval whose interval has passed
+
+        Call this periodically so that the last update before a quiet period
+        is not lost.
+
+        Returns:
+            list of (product_id, sensor_name, value, status) to forward
+        """
+        now = time.time() if now is None else now
+        due = []
+        for key, (value, status) in list(self._pending.items()):
+            if now - self._last[key][2] >= self.rule_for(key[1]).min_interval:
+                del self._pending[key]
+                self._last[key] = (value, status, now)
+                _FORWARDED.inc()
+                due.append((key[0], key[1], value, status))
+        return due
+
+    def forget(self, product_id):
+        """Drops the last-value table entries of a product"""
+        for table in (self._last, self._pending):
+            for key in [key for key in table if key[0] == product_id]:
+                del table[key]
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
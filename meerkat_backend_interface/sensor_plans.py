@@ -0,0 +1,192 @@
+"""
+Which sensors the katportal client reads at each lifecycle stage.
+
+STAGE_SENSORS lists, per stage, the sensor name patterns whose values are
+written to redis when the stage's request arrives, and how each is read:
+
+    ONCE        fetched from CAM; a value fetched earlier (e.g. prefetched
+                during the previous stage) is used if it is at most max_age
+                seconds old
+    SUBSCRIBED  subscribed to from ?capture-init on (see subscribe_sensors),
+                so the value last received over the websocket is current
+
+SensorQueryPlanner merges the patterns of every stage, so that the sensor
+names of a product are resolved with one CAM query, and works out which of a
+stage's values are already held. While a stage is handled, the ONCE values of
+the stages that can follow it (see lifecycle.TRANSITIONS) are prefetched, so
+most requests are answered without waiting on CAM.
+"""
+
+import re
+import time
+
+from .lifecycle import TRANSITIONS
+
+ONCE = 'once'
+SUBSCRIBED = 'subscribed'
+
+_REGEX_CHARS = set('.^$*+?{}[]\\|()')
+
+
+class SensorQuery(object):
+    """Sensors to read at a stage: those whose name contains a match of pattern
+
+    Args:
+        pattern (str): regular expression searched for in sensor names, as by
+            the portal's sensor_names
+        mode (str): ONCE or SUBSCRIBED
+        max_age (float): seconds a ONCE value fetched earlier may still be
+            used --> None: for as long as the product is configured
+    """
+
+    def __init__(self, pattern, mode=ONCE, max_age=None):
+        self.pattern = pattern
+        self.mode = mode
+        self.max_age = max_age
+        self._regex = re.compile(pattern)
+
+    def matches(self, sensor_name):
+        return self._regex.search(sensor_name) is not None
+
+
+def product_sensor(name):
+    """Returns a pattern matching the subarray's own sensor called name, with or
+    without a component prefix (e.g. 'target' or 'cbf_1_target'), but not
+    those of its antennas (e.g. 'm000_target')"""
+    return r'^(?!m\d{3}_)(\w+_)?' + name + '$'
+
+
+POINTING_SENSORS = [product_sensor(name) for name in ['target', 'pos_request_base_ra', 'pos_request_base_dec']]
+
+# stage --> the sensors whose values are written at that stage
+STAGE_SENSORS = {
+    'configure'    : [],
+    'capture-init' : [SensorQuery(pattern, SUBSCRIBED) for pattern in POINTING_SENSORS],
+    'capture-start': [SensorQuery(pattern, SUBSCRIBED) for pattern in POINTING_SENSORS]
+                     + [SensorQuery('weight', ONCE, max_age=60.0)],
+    'capture-stop' : [],
+    'capture-done' : [],
+    'deconfigure'  : [],
+}
+
+
+def next_stages(stage):
+    """Returns the stages whose requests are valid after the given one's"""
+    state = TRANSITIONS[stage][1]
+    return sorted(request for request, (states, _) in TRANSITIONS.items() if state in states)
+
+
+def merge_patterns(patterns):
+    """Removes duplicate patterns, and plain strings that contain another plain
+    string of the list (whose matches are a subset of the other's)
+
+    Examples:
+        >>> merge_patterns(['target', 'cbf_target', 'weight', 'target'])
+        ['target', 'weight']
+    """
+    merged = []
+    for pattern in patterns:
+        if pattern not in merged:
+            merged.append(pattern)
+    literals = [pattern for pattern in merged if not _REGEX_CHARS & set(pattern)]
+    return [pattern for pattern in merged
+            if not any(other != pattern and other in pattern for other in literals)
+            or _REGEX_CHARS & set(pattern)]
+
+
+class SensorQueryPlanner(object):
+    """Plans the sensor reads of every product's lifecycle stages
+
+    Examples:
+        >>> planner = SensorQueryPlanner()
+        >>> names = client.sensor_names(planner.patterns)  # once per product
+        >>> planner.resolve('array_1_bc856M4k', names)
+        >>> served, missing = planner.plan('array_1_bc856M4k', 'capture-start', subscribed=True)
+    """
+
+    def __init__(self, stage_sensors=STAGE_SENSORS):
+        """Plans the sensor reads of every product's lifecycle stages
+
+        Args:
+            stage_sensors (dict): stage --> list of SensorQuery (see STAGE_SENSORS)
+        """
+        self.stage_sensors = dict(stage_sensors)
+        self.patterns = merge_patterns(query.pattern for queries in self.stage_sensors.values()
+                                       for query in queries)
+        self._stage_names = dict()  # (product id, stage) --> [(sensor name, SensorQuery)]
+        self._subscribed = dict()  # product id --> names of its SUBSCRIBED sensors
+        self._values = dict()  # product id --> sensor name --> (value, time obtained)
+
+    def resolved(self, product_id):
+        return product_id in self._subscribed
+
+    def resolve(self, product_id, sensor_names):
+        """Records the sensor names the merged patterns matched for a product"""
+        self._subscribed[product_id] = set()
+        for stage, queries in self.stage_sensors.items():
+            stage_names = []
+            for sensor_name in sensor_names:
+                query = next((query for query in queries if query.matches(sensor_name)), None)
+                if query is None:
+                    continue
+                stage_names.append((sensor_name, query))
+                if query.mode == SUBSCRIBED:
+                    self._subscribed[product_id].add(sensor_name)
+            self._stage_names[(product_id, stage)] = stage_names
+
+    def subscribed_names(self, product_id):
+        """Returns the sensors to subscribe to for a product, sorted"""
+        return sorted(self._subscribed.get(product_id, ()))
+
+    def is_subscribed(self, product_id, sensor_name):
+        return sensor_name in self._subscribed.get(product_id, ())
+
+    def record(self, product_id, sensor_name, value, now=None):
+        """Records a value just fetched from CAM or received over the websocket"""
+        self._values.setdefault(product_id, dict())[sensor_name] = (value, now or time.time())
+
+    def plan(self, product_id, stage, subscribed=False, now=None):
+        """Splits the sensors of a stage into values already held and sensors to fetch
+
+        Args:
+            product_id (str): the product id given in the ?configure request
+            stage (str): the lifecycle stage, e.g. 'capture-start'
+            subscribed (bool): whether the product's subscription is live, so
+                that the values received of SUBSCRIBED sensors are current
+            now (float): the current time --> defaults to time.time()
+
+        Returns:
+            (dict of sensor name --> ('subscription' or 'prefetched', value),
+             list of the sensor names to fetch)
+        """
+        now = now or time.time()
+        values = self._values.get(product_id, {})
+        served = dict()
+        missing = []
+        for sensor_name, query in self._stage_names.get((product_id, stage), ()):
+            value, obtained = values.get(sensor_name, (None, None))
+            if value is not None and subscribed and self.is_subscribed(product_id, sensor_name):
+                served[sensor_name] = ('subscription', value)
+            elif (value is not None and query.mode == ONCE
+                  and (query.max_age is None or now - obtained <= query.max_age)):
+                served[sensor_name] = ('prefetched', value)
+            else:
+                missing.append(sensor_name)
+        return served, missing
+
+    def prefetch_names(self, product_id, stage, subscribed=False, now=None):
+        """Returns the ONCE sensors of the stages that can follow stage that
+        would have to be fetched if their request came now"""
+        names = set()
+        for following in next_stages(stage):
+            _, missing = self.plan(product_id, following, subscribed, now)
+            names.update(sensor_name for sensor_name in missing
+                         if not self.is_subscribed(product_id, sensor_name))
+        return sorted(names)
+
+    def forget(self, product_id):
+        """Drops everything held for a deconfigured product"""
+        self._subscribed.pop(product_id, None)
+        self._values.pop(product_id, None)
+        for key in [key for key in self._stage_names if key[0] == product_id]:
+            del self._stage_names[key]
@@ -0,0 +1,253 @@
+"""
+Sharding of products across a pool of katportal worker processes.
+
+A single BLKATPortalClient handles every product on one Python thread. With
+many products, a KATPortalSupervisor can instead run several of them, each
+in its own process, and forward every alert on the 'alerts' channel to the
+worker that owns the product. Ownership is decided by consistent hashing on
+the product id, so when a worker dies only its own products move: they are
+handed to the surviving workers by replaying the alerts that brought them to
+their current state. Alerts for a worker that has not yet subscribed to its
+channel are held by the supervisor until it has.
+"""
+
+import bisect
+import hashlib
+import multiprocessing
+import time
+
+from .redis_tools import REDIS_CHANNELS, publish_to_redis, get_redis, CONTROL
+from .metrics import Counter, Gauge, start_metrics_server
+from .tracing import Trace, format_alert, parse_alert
+from .logger import log
+
+ALERTS_ROUTED = Counter('katportal_supervisor_alerts_routed_total', 'Alerts forwarded to workers')
+PRODUCTS_MOVED = Counter('katportal_supervisor_products_moved_total',
+                         'Products moved from a dead worker to a live one')
+LIVE_WORKERS = Gauge('katportal_supervisor_live_workers', 'Worker processes alive')
+
+
+def worker_channel(worker_id):
+    """The redis channel a katportal worker listens on instead of 'alerts'"""
+    return "katportal:worker{}:alerts".format(worker_id)
+
+
+class HashRing(object):
+    """Consistent hash ring mapping keys (product ids) to nodes (workers)
+
+    Each node is placed on the ring `replicas` times, so keys are spread
+    evenly and removing a node only moves the keys it owned.
+
+    Examples:
+        >>> ring = HashRing([0, 1, 2])
+        >>> ring.get('array_1_bc856M4k')
+        2
+    """
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self._hashes = []  # sorted
+        self._nodes = dict()  # hash --> node
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(set(self._nodes.values()))
+
+    def add(self, node):
+        for i in range(self.replicas):
+            h = self._hash("{}:{}".format(node, i))
+            bisect.insort(self._hashes, h)
+            self._nodes[h] = node
+
+    def remove(self, node):
+        for i in range(self.replicas):
+            h = self._hash("{}:{}".format(node, i))
+            self._hashes.remove(h)
+            del self._nodes[h]
+
+    def get(self, key):
+        """Returns the node owning key, or None if the ring is empty"""
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[self._hashes[i]]
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+
+def run_worker(worker_id, metrics_port=0, slack=False, spool_path=None, archive_dir=None, sensor_alerts=True,
+               ready=None):
+    """Entry point of a worker process: a BLKATPortalClient on its own channel,
+    which sets ready (a multiprocessing.Event) once it is subscribed"""
+    from .katportal_server import BLKATPortalClient
+    from .slack_tools import get_notifier
+    from .redis_health import start_spooling
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    if spool_path:
+        start_spooling(get_redis(), spool_path)
+    client = BLKATPortalClient(worker_id=worker_id, notifier=get_notifier() if slack else None,
+                               archive_dir=archive_dir, sensor_alerts=sensor_alerts)
+    client.start(ready)
+
+
+class KATPortalSupervisor(object):
+    """Routes alerts to a pool of katportal worker processes
+
+    Examples:
+        >>> supervisor = KATPortalSupervisor(n_workers=4)
+        >>> supervisor.start()  # blocks
+    """
+
+    LIFECYCLE = ['configure', 'capture-init', 'capture-start', 'capture-stop', 'capture-done']
+
+    def __init__(self, n_workers, redis_server=None, poll_timeout=1.0, metrics_port=0, slack=False,
+                 spool_path=None, archive_dir=None, sensor_alerts=True):
+        """Routes alerts to a pool of katportal worker processes
+
+        Args:
+            n_workers (int): number of worker processes to start
+            redis_server (redis.StrictRedis): server carrying the alerts
+                --> defaults to get_redis(CONTROL)
+            poll_timeout (float): seconds between checks that workers are alive
+            metrics_port (int): port the supervisor serves metrics on; worker
+                n serves its own on metrics_port + 1 + n --> 0 disables metrics
+            slack (bool): whether the workers post antenna health changes to slack
+            spool_path (str): worker n spools redis writes to spool_path + ".worker[n]"
+                while redis is down --> None disables spooling
+            archive_dir (str): directory the workers archive each observation's
+                metadata to --> None disables archiving
+            sensor_alerts (bool): whether the workers also publish sensor
+                updates on the old 'sensor_alerts' channel
+        """
+        self.n_workers = n_workers
+        self.metrics_port = metrics_port
+        self.slack = slack
+        self.spool_path = spool_path
+        self.archive_dir = archive_dir
+        self.sensor_alerts = sensor_alerts
+        self.redis_server = redis_server or get_redis(CONTROL)
+        self.poll_timeout = poll_timeout
+        self.workers = dict()  # worker id --> multiprocessing.Process
+        self.ready = dict()  # worker id --> multiprocessing.Event, set once it listens on its channel
+        self._held = dict()  # worker id --> alerts routed to it before it was ready
+        self.ring = HashRing()
+        self.owners = dict()  # product id --> worker id
+        self.histories = dict()  # product id --> alerts to replay to bring a new owner up to date
+        LIVE_WORKERS.set_function(lambda: len(self.workers))
+
+    def start(self):
+        """Starts the workers, then routes alerts until interrupted"""
+        if self.metrics_port:
+            start_metrics_server(self.metrics_port)
+        for worker_id in range(self.n_workers):
+            worker_port = self.metrics_port + 1 + worker_id if self.metrics_port else 0
+            worker_spool = "{}.worker{}".format(self.spool_path, worker_id) if self.spool_path else None
+            self.ready[worker_id] = multiprocessing.Event()
+            process = multiprocessing.Process(target=run_worker,
+                                              args=(worker_id, worker_port, self.slack, worker_spool,
+                                                    self.archive_dir, self.sensor_alerts, self.ready[worker_id]),
+                                              name="katportal-worker{}".format(worker_id))
+            process.daemon = True
+            process.start()
+            self.workers[worker_id] = process
+            self.ring.add(worker_id)
+        log.info("Started {} katportal workers".format(self.n_workers))
+        pubsub = self.redis_server.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(REDIS_CHANNELS.alerts)
+        while True:
+            message = pubsub.get_message(timeout=self.poll_timeout)
+            if message is not None:
+                self.route(message['data'])
+            self.check_workers()
+
+    def stop(self):
+        for process in self.workers.values():
+            process.terminate()
+
+    def route(self, data):
+        """Forwards an alert to the worker owning its product
+
+        Args:
+            data (str): the alert, "[msg_type]:[product_id](:[trace_id])"
+
+        Returns:
+            None
+        """
+        alert = parse_alert(data)
+        if alert is None:
+            log.info("Not routing this message --> {}".format(data))
+            return
+        msg_type, product_id, trace_id = alert
+        worker_id = self.ring.get(product_id)
+        if worker_id is None:
+            log.error("No katportal workers left to handle {}".format(data))
+            return
+        self._record(msg_type, product_id, data)
+        self.owners[product_id] = worker_id
+        self._send(worker_id, data)
+        ALERTS_ROUTED.inc()
+        if msg_type == 'deconfigure':
+            self.owners.pop(product_id, None)
+
+    def check_workers(self):
+        """Forwards the alerts held for workers that became ready, and moves
+        the products of dead workers to the surviving ones"""
+        for worker_id, process in list(self.workers.items()):
+            if process.is_alive():
+                if self._held.get(worker_id) and self.ready[worker_id].is_set():
+                    self._send(worker_id)
+                continue
+            log.error("katportal worker {} died (exit code {})".format(worker_id, process.exitcode))
+            del self.workers[worker_id]
+            self.ring.remove(worker_id)
+            self._held.pop(worker_id, None)  # its products' histories are replayed below
+            orphans = [product_id for product_id, owner in self.owners.items() if owner == worker_id]
+            for product_id in orphans:
+                new_owner = self.ring.get(product_id)
+                if new_owner is None:
+                    log.error("No katportal workers left to take over {}".format(product_id))
+                    continue
+                started = time.time()
+                for data in self.histories.get(product_id, []):
+                    self._send(new_owner, self._replay(data))
+                self.owners[product_id] = new_owner
+                PRODUCTS_MOVED.inc()
+                log.warning("Moved {} from worker {} to worker {} in {:.3f} s".format(
+                    product_id, worker_id, new_owner, time.time() - started))
+
+    def _replay(self, data):
+        """Returns a recorded alert under a new trace id, and writes a trace
+        linking it to the original one, so that the replayed request can be
+        told apart from the original in the traces"""
+        msg_type, product_id, trace_id = parse_alert(data)
+        trace = Trace(None, product_id, msg_type, 'supervisor', replay_of=trace_id)
+        trace.add_span('replay', time.time())
+        trace.write(self.redis_server)
+        return format_alert(msg_type, product_id, trace.trace_id)
+
+    def _send(self, worker_id, data=None):
+        """Publishes an alert on a worker's channel, after any held for it,
+        or holds it if the worker is not listening yet"""
+        held = self._held.setdefault(worker_id, [])
+        if data is not None:
+            held.append(data)
+        if not self.ready[worker_id].is_set():
+            return
+        for alert in held:
+            publish_to_redis(self.redis_server, worker_channel(worker_id), alert)
+        del held[:]
+
+    def _record(self, msg_type, product_id, data):
+        """Keeps the shortest alert sequence that reproduces a product's state"""
+        if msg_type == 'configure':
+            self.histories[product_id] = [data]
+        elif msg_type == 'deconfigure':
+            self.histories.pop(product_id, None)
+        elif msg_type in self.LIFECYCLE and product_id in self.histories:
+            history = self.histories[product_id]
+            history[:] = [d for d in history if d.split(':')[0] != msg_type]
+            history.append(data)
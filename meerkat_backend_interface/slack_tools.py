@@ -1,10 +1,204 @@
+import atexit
 import os
-import slacker
+import threading
+import time
+
+import requests
+from six.moves import queue
+
+from .logger import log
+
+SLACK_API_URL = "https://slack.com/api"
+
+
+class SlackNotifier(object):
+    """Posts messages to slack from a background thread
+
+    notify() only puts the message on a bounded queue, so it never blocks
+    the caller (e.g. a tornado ioloop). The thread collects the messages that
+    arrive within `coalesce_window` seconds of each other, merges repeats of
+    the same message, and posts one message per channel, at most one post
+    every `min_interval` seconds, over a single reused HTTPS session.
+    Messages still queued are posted when close() is called, which also
+    happens at interpreter exit.
+
+    Examples:
+        >>> notifier = SlackNotifier()
+        >>> notifier.notify('SKA is on fire!!!')
+        >>> notifier.notify('Found aliens!', '#listen')
+    """
+
+    POLL_INTERVAL = 1.0  # seconds between checks of whether the notifier was closed
+
+    def __init__(self, token=None, channel='#active_observations', base_url=SLACK_API_URL,
+                 max_queue=1000, coalesce_window=2.0, min_interval=1.0, timeout=10.0):
+        """Posts messages to slack from a background thread
+
+        Args:
+            token (str): slack API token --> defaults to $SLACK_TOKEN
+            channel (str): the chat to send to (starts with # if a channel)
+                --> defaults to '#active_observations'
+            base_url (str): URL of the slack web API (e.g. a local stand-in for testing)
+            max_queue (int): messages that may wait to be posted; further ones are dropped
+            coalesce_window (float): seconds to wait for more messages to post together
+            min_interval (float): minimum seconds between posts (slack allows ~1 per second)
+            timeout (float): seconds to wait for slack to answer a post
+        """
+        self.token = token if token is not None else os.environ.get('SLACK_TOKEN')
+        self.channel = channel
+        self.base_url = base_url.rstrip('/')
+        self.coalesce_window = coalesce_window
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.stats = {'queued': 0, 'dropped': 0, 'posted': 0, 'failed': 0}
+        self._queue = queue.Queue(max_queue)
+        self._session = requests.Session()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stop = threading.Event()  # set by close(); the thread posts what is queued, then stops
+        self._last_post = 0.0
+        if not self.token:
+            log.warning("No slack token ($SLACK_TOKEN); slack notifications are disabled")
+
+    def notify(self, message, channel=None):
+        """Queues a message to be posted, without blocking
+
+        Args:
+            message (str): the message to send
+            channel (str): the chat to send to --> defaults to self.channel
+
+        Returns:
+            True if the message was queued, False if it was dropped
+        """
+        if self._closed or not self.token:
+            return False
+        try:
+            self._queue.put_nowait((channel or self.channel, message))
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+        self.stats['queued'] += 1
+        if self._thread is None:
+            self._start()
+        return True
+
+    def close(self, timeout=10.0):
+        """Posts the messages still queued, then stops the thread
+
+        Args:
+            timeout (float): seconds to wait for the remaining posts
+        """
+        self._closed = True
+        self._stop.set()
+        if self._thread is not None:
+            try:
+                self._queue.put_nowait(None)  # wakes the thread
+            except queue.Full:
+                pass  # the thread checks self._stop while it waits for messages
+            self._thread.join(timeout)
+            self._thread = None
+        self._session.close()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slack-notifier")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.POLL_INTERVAL)
+            except queue.Empty:
+                item = False
+            batch = []
+            # gather what arrives within the window (everything left, once closing)
+            window_end = time.time() + self.coalesce_window
+            while item:
+                batch.append(item)
+                if self._stop.is_set():
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, window_end - time.time()))
+                except queue.Empty:
+                    break
+            if item is None or self._stop.is_set():
+                stopping = True
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        batch.append(item)
+            for channel, text in self._coalesce(batch):
+                self._post(channel, text)
+
+    @staticmethod
+    def _coalesce(batch):
+        """Merges a batch of (channel, message) into one text per channel,
+        with repeated messages shown once with their count"""
+        channels = []
+        messages = dict()  # channel --> list of [message, count], in arrival order
+        for channel, message in batch:
+            if channel not in messages:
+                channels.append(channel)
+                messages[channel] = []
+            for entry in messages[channel]:
+                if entry[0] == message:
+                    entry[1] += 1
+                    break
+            else:
+                messages[channel].append([message, 1])
+        return [(channel, "\n".join(message if count == 1 else "{} (x{})".format(message, count)
+                                    for message, count in messages[channel]))
+                for channel in channels]
+
+    def _post(self, channel, text, retries=1):
+        wait = self._last_post + self.min_interval - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_post = time.time()
+        try:
+            response = self._session.post("{}/chat.postMessage".format(self.base_url),
+                                          data={'token': self.token, 'channel': channel, 'text': text},
+                                          timeout=self.timeout)
+            if response.status_code == 429 and retries > 0:
+                time.sleep(float(response.headers.get('Retry-After', 1)))
+                return self._post(channel, text, retries - 1)
+            response.raise_for_status()
+            body = response.json()
+            if not body.get('ok'):
+                raise ValueError(body.get('error', 'unknown error'))
+            self.stats['posted'] += 1
+        except (requests.RequestException, ValueError) as e:
+            self.stats['failed'] += 1
+            log.error("Failed to post to slack channel {}: {}".format(channel, e))
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier():
+    """Returns the shared SlackNotifier (created on first use, closed at exit)"""
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = SlackNotifier()
+            atexit.register(_notifier.close)
+    return _notifier
 
 
 def notify_slack(message, channel='#active_observations'):
     """Publishes message to slack channel
 
+    The message is posted from a background thread (see SlackNotifier), so
+    this returns immediately.
+
     Args:
         message (str): the message to send
         channel (str): the chat to send to (starts with # if a channel)
@@ -16,6 +210,4 @@ def notify_slack(message, channel='#active_observations'):
         >>> notify_slack('SKA is on fire!!!')
         >>> notify_slack('Found aliens!', '#listen')
     """
-    token = os.environ['SLACK_TOKEN']
-    slack = slacker.Slacker(token)
-    slack.chat.post_message(channel, message)
+    get_notifier().notify(message, channel)
@@ -0,0 +1,101 @@
+"""
+An append-only local file of redis operations that could not be applied.
+
+While redis is unreachable, redis_tools appends every write and publish it
+is asked to do to the spool instead (see redis_tools.set_spool), so that
+nothing is lost and callers can carry on. Once redis is back, the spooled
+operations are replayed in their original order (redis_tools.replay_spool)
+and the spool is emptied. The file survives a restart of the process, so
+operations spooled before a crash are replayed by the next run.
+"""
+
+import json
+import os
+import threading
+
+from .logger import log
+
+
+class WriteSpool(object):
+    """An append-only file of JSON-encoded operations
+
+    Examples:
+        >>> spool = WriteSpool('/tmp/bluse_katcp.spool')
+        >>> spool.append(['set', 'array_1:n_channels', 4096, None, True])
+        >>> spool.active
+        True
+        >>> for op in spool.read(): ...
+        >>> spool.clear()
+    """
+
+    def __init__(self, path):
+        """An append-only file of JSON-encoded operations
+
+        Args:
+            path (str): the spool file (created when the first operation is spooled)
+        """
+        self.path = path
+        self.lock = threading.RLock()  # held by replays, so no append can overtake them
+        self._file = None
+        self._count = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                self._count = sum(1 for line in f if line.strip())
+            if self._count:
+                log.warning("{} operations left in the spool {} will be replayed".format(self._count, path))
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def active(self):
+        """Whether operations are waiting to be replayed
+
+        While they are, new operations must be spooled too, to keep their order.
+        """
+        return self._count > 0
+
+    def append(self, op):
+        """Appends an operation (a JSON-serialisable list)"""
+        with self.lock:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write(json.dumps(op, default=str) + "\n")
+            self._file.flush()  # survives a crash of this process
+            self._count += 1
+
+    def read(self):
+        """Returns the spooled operations, oldest first"""
+        with self.lock:
+            if self._file is not None:
+                self._file.flush()
+            if not os.path.exists(self.path):
+                return []
+            ops = []
+            with open(self.path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        ops.append(json.loads(line))
+                    except ValueError:
+                        log.error("Skipping corrupt spool entry: {!r}".format(line))
+            return ops
+
+    def replace(self, ops):
+        """Rewrites the spool to hold only the given operations (e.g. those
+        not yet replayed when a replay was interrupted)"""
+        with self.lock:
+            self.clear()
+            for op in ops:
+                self.append(op)
+
+    def clear(self):
+        """Empties the spool (once its operations have been replayed)"""
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._count = 0
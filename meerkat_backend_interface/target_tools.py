@@ -0,0 +1,129 @@
+"""
+Parsing of CAM target descriptions into structured fields.
+
+CAM reports targets as katpoint description strings, e.g.
+
+    "PKS 0408-65 | J0408-6545, radec bfcal single_accumulation, 4:08:20.38, -65:45:09.1, (800.0 8400.0 -3.708 3.807 -0.7202)"
+
+i.e. "name [| alias ...], tags, longitude, latitude, flux model", where the
+first tag is the body type and the trailing fields are optional. Building a
+full katpoint.Target is comparatively slow and pulls in pyephem, so this
+module does the plain string work once at ingest and hands consumers floats.
+"""
+
+import math
+
+HOURS_TO_RAD = math.pi / 12.0
+DEGREES_TO_RAD = math.pi / 180.0
+
+
+def sexagesimal_to_float(text):
+    """Converts 'D:M:S' (or a plain number) into a float of the first unit
+
+    Examples:
+        >>> sexagesimal_to_float('-65:45:09.1')
+        -65.75252777777778
+        >>> sexagesimal_to_float('12.5')
+        12.5
+    """
+    text = text.strip()
+    if ':' not in text:
+        return float(text)
+    negative = text.startswith('-')
+    parts = text.lstrip('+-').split(':')
+    value = 0.0
+    scale = 1.0
+    for part in parts:
+        value += float(part) / scale
+        scale *= 60.0
+    return -value if negative else value
+
+
+def parse_flux_model(text):
+    """Parses a katpoint flux model '(min_MHz max_MHz a b c ...)'
+
+    Returns:
+        (dict) with 'min_freq_MHz', 'max_freq_MHz' and 'coefs' (list of floats),
+        or None if there is no model
+    """
+    numbers = text.strip().strip('()').split()
+    if len(numbers) < 2:
+        return None
+    values = [float(number) for number in numbers]
+    return {'min_freq_MHz': values[0], 'max_freq_MHz': values[1], 'coefs': values[2:]}
+
+
+def parse_target_description(description):
+    """Parses a katpoint target description string into structured fields
+
+    Coordinates are returned in radians. For 'radec' targets these are 'ra'
+    (given in hours by CAM) and 'dec' (given in degrees); 'azel' targets give
+    'az'/'el' and 'gal' targets 'l'/'b', all given in degrees. Other body types
+    ('special', 'tle', 'xephem') only get their name and tags.
+
+    Args:
+        description (str): the target description, as reported by CAM
+
+    Returns:
+        (dict) with 'name', 'aliases', 'tags', 'body_type', the coordinates
+        above and 'flux_model' (see parse_flux_model)
+
+    Raises:
+        ValueError if the description is empty or its coordinates are malformed
+
+    Examples:
+        >>> target = parse_target_description(
+        ...     "PKS 0408-65, radec bfcal, 4:08:20.38, -65:45:09.1, (800.0 8400.0 -3.708 3.807 -0.7202)")
+        >>> target['name'], target['tags'], round(target['ra'], 4), round(target['dec'], 4)
+        ('PKS 0408-65', ['radec', 'bfcal'], 1.0835, -1.1476)
+    """
+    fields = description.split(',')
+    names = [name.strip() for name in fields[0].split('|')]
+    if not names[0]:
+        raise ValueError("Empty target description: {!r}".format(description))
+    tags = fields[1].split() if len(fields) > 1 else []
+    target = {
+        'name': names[0],
+        'aliases': names[1:],
+        'tags': tags,
+        'body_type': tags[0] if tags else None,
+        'flux_model': None,
+        }
+    if target['body_type'] in ('radec', 'azel', 'gal') and len(fields) >= 4:
+        if target['body_type'] == 'radec':
+            target['ra'] = sexagesimal_to_float(fields[2]) * HOURS_TO_RAD
+            target['dec'] = sexagesimal_to_float(fields[3]) * DEGREES_TO_RAD
+        elif target['body_type'] == 'azel':
+            target['az'] = sexagesimal_to_float(fields[2]) * DEGREES_TO_RAD
+            target['el'] = sexagesimal_to_float(fields[3]) * DEGREES_TO_RAD
+        else:
+            target['l'] = sexagesimal_to_float(fields[2]) * DEGREES_TO_RAD
+            target['b'] = sexagesimal_to_float(fields[3]) * DEGREES_TO_RAD
+        if len(fields) >= 5:
+            target['flux_model'] = parse_flux_model(fields[4])
+    return target
+
+
+def target_to_hash(target, description=None):
+    """Flattens the output of parse_target_description into a redis hash mapping
+
+    Lists are space separated ('tags', 'flux_coefs') or '|' separated
+    ('aliases'), floats are written with full precision.
+    """
+    mapping = {
+        'name': target['name'],
+        'aliases': '|'.join(target['aliases']),
+        'tags': ' '.join(target['tags']),
+        'body_type': target['body_type'] or '',
+        }
+    for coord in ('ra', 'dec', 'az', 'el', 'l', 'b'):
+        if coord in target:
+            mapping[coord] = repr(target[coord])
+    flux_model = target['flux_model']
+    if flux_model is not None:
+        mapping['flux_min_freq_MHz'] = repr(flux_model['min_freq_MHz'])
+        mapping['flux_max_freq_MHz'] = repr(flux_model['max_freq_MHz'])
+        mapping['flux_coefs'] = ' '.join(repr(coef) for coef in flux_model['coefs'])
+    if description is not None:
+        mapping['description'] = description
+    return mapping
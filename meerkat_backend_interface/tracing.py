@@ -0,0 +1,164 @@
+"""
+Trace IDs that follow a request from the KATCP server to the metadata in redis.
+
+Every request to the KATCP server mints a trace id, which travels in the
+alert it publishes ("[msg_type]:[product_id]:[trace_id]"). Each module that
+handles the request records the time it spends in named spans (e.g.
+'publish', 'dispatch', 'cam:sensor_values', 'redis_write') against that id,
+and writes them to a capped redis list when it is done. read_traces() merges
+the records of all modules back together by trace id; see
+scripts/trace_waterfall.py for a latency waterfall of them.
+"""
+
+import json
+import time
+import uuid
+from contextlib import contextmanager
+
+import redis
+
+from .logger import log
+
+TRACE_KEY = "traces"  # redis list of trace records, newest first
+TRACE_MAXLEN = 10000  # records kept in TRACE_KEY
+
+
+def new_trace_id():
+    """Returns a new random trace id"""
+    return uuid.uuid4().hex[:16]
+
+
+def format_alert(msg_type, product_id, trace_id=None):
+    """Returns the alert message "[msg_type]:[product_id](:[trace_id])" """
+    if trace_id is None:
+        return "{}:{}".format(msg_type, product_id)
+    return "{}:{}:{}".format(msg_type, product_id, trace_id)
+
+
+def parse_alert(data):
+    """Splits an alert message into its parts
+
+    Alerts without a trace id (from older senders) are still accepted.
+
+    Args:
+        data (str): "[msg_type]:[product_id]" or "[msg_type]:[product_id]:[trace_id]"
+
+    Returns:
+        (msg_type, product_id, trace_id or None), or None if data is not an alert
+    """
+    msg_parts = data.split(':')
+    if len(msg_parts) < 2:
+        return None
+    trace_id = msg_parts[2] if len(msg_parts) > 2 and msg_parts[2] else None
+    return msg_parts[0], msg_parts[1], trace_id
+
+
+class Trace(object):
+    """The spans one module records for one traced request
+
+    Examples:
+        >>> trace = Trace(trace_id, 'array_1_bc856M4k', 'capture-start', 'katportal')
+        >>> with trace.span('cam:sensor_values'):
+        ...     values = yield self._get_sensor_values(...)
+        >>> trace.write(redis_server)
+    """
+
+    def __init__(self, trace_id, product_id, stage, component, replay_of=None):
+        """The spans one module records for one traced request
+
+        Args:
+            trace_id (str): the id of the request --> None mints a new one
+            product_id (str): the product the request is about
+            stage (str): the request, e.g. 'capture-start'
+            component (str): the module recording the spans, e.g. 'katcp'
+            replay_of (str): the trace id of the original request, if this
+                one replays it (e.g. to a new katportal worker)
+        """
+        self.trace_id = trace_id or new_trace_id()
+        self.product_id = product_id
+        self.stage = stage
+        self.component = component
+        self.replay_of = replay_of
+        self.created = time.time()
+        self.spans = []  # (name, start, end)
+
+    def add_span(self, name, start, end=None):
+        """Records a span that has already finished (end defaults to now)"""
+        self.spans.append((name, start, time.time() if end is None else end))
+
+    @contextmanager
+    def span(self, name):
+        """Records the time spent in a with block (also across yields in a coroutine)"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_span(name, start)
+
+    def to_dict(self):
+        record = {'trace_id': self.trace_id, 'product_id': self.product_id, 'stage': self.stage,
+                  'component': self.component,
+                  'spans': [[name, start, end] for name, start, end in self.spans]}
+        if self.replay_of is not None:
+            record['replay_of'] = self.replay_of
+        return record
+
+    def write(self, server, key=TRACE_KEY, maxlen=TRACE_MAXLEN):
+        """Appends the trace to a capped redis list
+
+        Returns:
+            True if successful, False otherwise
+        """
+        try:
+            pipe = server.pipeline()
+            pipe.lpush(key, json.dumps(self.to_dict()))
+            pipe.ltrim(key, 0, maxlen - 1)
+            pipe.execute()
+            return True
+        except redis.exceptions.RedisError:
+            log.exception("Failed to write trace {}".format(self.trace_id))
+            return False
+
+
+def read_traces(server, product_id=None, stage=None, trace_id=None, limit=None, key=TRACE_KEY):
+    """Reads the traces written by all modules, merged by trace id
+
+    Args:
+        server (redis.StrictRedis): the redis server the traces are written to
+        product_id (str): only return the traces of this product
+        stage (str): only return the traces of this stage, e.g. 'capture-start'
+        trace_id (str): only return this trace
+        limit (int): return at most this many traces (the most recent)
+
+    Returns:
+        list of dicts with 'trace_id', 'product_id', 'stage', 'replay_of' (the
+        trace id of the request it replays, or None) and 'spans', a list of
+        (component, name, start, end) sorted by start; most recent first
+    """
+    traces = dict()
+    order = []
+    for record in server.lrange(key, 0, -1):
+        try:
+            record = json.loads(record)
+        except ValueError:
+            continue
+        if ((product_id is not None and record['product_id'] != product_id)
+                or (stage is not None and record['stage'] != stage)
+                or (trace_id is not None and record['trace_id'] != trace_id)):
+            continue
+        trace = traces.get(record['trace_id'])
+        if trace is None:
+            trace = traces[record['trace_id']] = {'trace_id': record['trace_id'],
+                                                  'product_id': record['product_id'],
+                                                  'stage': record['stage'], 'replay_of': None,
+                                                  'spans': []}
+            order.append(record['trace_id'])
+        if record.get('replay_of') is not None:
+            trace['replay_of'] = record['replay_of']
+        trace['spans'].extend((record['component'], name, start, end)
+                              for name, start, end in record['spans'])
+    result = []
+    for tid in order[:limit]:
+        traces[tid]['spans'].sort(key=lambda span: span[2])
+        result.append(traces[tid])
+    return result
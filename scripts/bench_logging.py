@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Benchmarks the logging overhead of one sensor update on the katportal hot path.
+
+Times the functions a sensor update goes through, against a stub redis
+server that accepts every command without I/O, so that what is left is
+their own work, most of it logging:
+
+    * write: one redis_tools.write_pair_redis
+    * publish: one redis_tools.publish_to_redis on 'sensor_alerts'
+    * update: one BLKATPortalClient.on_update_callback_fn, which writes,
+      archives, queues and publishes the update (needs katportalclient)
+
+each with the BLUSE.interface logger at INFO and at DEBUG, writing to
+os.devnull either directly or through the queued handler set_logger uses:
+
+    python scripts/bench_logging.py
+
+Output goes to os.devnull, so this measures formatting and handler costs
+only; writing to a slow terminal or a full pipe makes the direct handler
+slower still, while the queued handler keeps that I/O off the calling thread.
+"""
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import sys
+import timeit
+
+from six.moves import queue
+
+from meerkat_backend_interface.logger import get_logger, QueueHandler, QueueListener
+from meerkat_backend_interface.redis_tools import REDIS_CHANNELS, write_pair_redis, publish_to_redis
+
+FORMAT = "[ %(levelname)s - %(asctime)s - %(filename)s:%(lineno)s] %(message)s"
+PRODUCT_ID = "bench_array"
+
+
+class StubPipeline(object):
+    """Accepts any pipeline command, and executes none"""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        return []
+
+
+class StubServer(object):
+    """Stands in for a redis.StrictRedis, so that no time is spent on I/O"""
+
+    traffic_class = 'metadata'
+
+    def pipeline(self, *args, **kwargs):
+        return StubPipeline()
+
+    def publish(self, channel, message):
+        return 0
+
+
+def sensor_name(i):
+    return "m{:03d}_pos_request_base_ra".format(i % 64)
+
+
+def bench(name, fn, n, repeat):
+    best = min(timeit.repeat(lambda: [fn(i) for i in range(n)], number=1, repeat=repeat))
+    print("{:<40} {:>8.2f} us/update".format(name, 1e6 * best / n))
+
+
+def katportal_client(server):
+    """Returns a BLKATPortalClient writing to server, or None without katportalclient"""
+    try:
+        from meerkat_backend_interface.katportal_server import BLKATPortalClient
+    except ImportError as e:
+        print("Not timing on_update_callback_fn: {}".format(e))
+        return None
+    client = BLKATPortalClient()
+    client.redis_server = client.sensor_server = server
+    client.subscribed_sensors[PRODUCT_ID] = set(sensor_name(i) for i in range(64))
+    return client
+
+
+def update(client, i):
+    client.on_update_callback_fn(PRODUCT_ID, {'msg_data': {
+        'name': sensor_name(i), 'value': 123.456 + i, 'status': 'nominal',
+        'timestamp': 1539604800.0 + i, 'received_timestamp': 1539604800.1 + i}})
+    if i % 1000 == 0:
+        client._pending_updates.clear()  # the ioloop that would publish them is not running
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', type=int, default=100000, help='updates per timing run')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timing runs')
+    args = parser.parse_args()
+
+    log = get_logger()
+    log.propagate = False
+    devnull = open(os.devnull, 'w')
+    stream_handler = logging.StreamHandler(devnull)
+    stream_handler.setFormatter(logging.Formatter(FORMAT))
+    records = queue.Queue(-1)
+    listener = QueueListener(records, stream_handler)
+    listener.start()
+    queue_handler = QueueHandler(records)
+
+    server = StubServer()
+    client = katportal_client(server)
+    benchmarks = [
+        ('write', lambda i: write_pair_redis(server, "{}:{}".format(PRODUCT_ID, sensor_name(i)), 123.456 + i)),
+        ('publish', lambda i: publish_to_redis(server, REDIS_CHANNELS.sensor_alerts,
+                                               "{}:{}".format(sensor_name(i), 123.456 + i))),
+    ]
+    if client is not None:
+        benchmarks.append(('update', lambda i: update(client, i)))
+
+    for level in (logging.INFO, logging.DEBUG):
+        log.setLevel(level)
+        for handler_name, handler in (('stream', stream_handler), ('queued', queue_handler)):
+            log.handlers = [handler]
+            for name, fn in benchmarks:
+                bench("{}, {}, {} handler".format(name, logging.getLevelName(level), handler_name),
+                      fn, args.n, args.repeat)
+    listener.stop()
+    devnull.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
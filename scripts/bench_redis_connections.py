@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Benchmarks redis latency over TCP loopback against a unix-domain socket.
+
+Times the writes the backend makes most often, each through the same
+redis_tools functions and a connection from get_redis():
+
+    * set: one versioned write_pair_redis (a MULTI/EXEC pipeline)
+    * publish: one publish_sensor_updates of a single sensor update
+    * sensor update: both of the above, as for every katportal sensor update
+
+Redis must listen on both, e.g. started with
+
+    redis-server --port 6379 --unixsocket /tmp/redis.sock --unixsocketperm 700
+    python scripts/bench_redis_connections.py --socket /tmp/redis.sock
+
+The keys written ("bench_array:*") are deleted afterwards.
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+from meerkat_backend_interface.redis_tools import get_redis, write_pair_redis
+from meerkat_backend_interface.sensor_channels import publish_sensor_updates
+
+PRODUCT_ID = "bench_array"
+
+
+def write(server, i):
+    write_pair_redis(server, "{}:m{:03d}_pos_request_base_ra".format(PRODUCT_ID, i % 64), 123.456)
+
+
+def publish(server, i):
+    publish_sensor_updates(server, PRODUCT_ID, [("m{:03d}_pos_request_base_ra".format(i % 64), 123.456, 1539604800.0)])
+
+
+def sensor_update(server, i):
+    write(server, i)
+    publish(server, i)
+
+
+def bench(server, fn, n):
+    """Returns the per-call latencies in seconds, sorted"""
+    for i in range(min(n, 100)):  # warm up the connection and the lua/pipeline paths
+        fn(server, i)
+    latencies = []
+    for i in range(n):
+        started = time.time()
+        fn(server, i)
+        latencies.append(time.time() - started)
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', type=int, default=10000, help='calls per pattern')
+    parser.add_argument('--host', default='localhost', help='redis host')
+    parser.add_argument('--port', type=int, default=6379, help='redis port')
+    parser.add_argument('--socket', required=True, help='unix-domain socket of the same redis server')
+    args = parser.parse_args()
+
+    transports = [('tcp', get_redis(host=args.host, port=args.port, unix_socket_path='')),
+                  ('unix', get_redis(unix_socket_path=args.socket))]
+    print("{:<15} {:<6} {:>10} {:>10} {:>10}".format('pattern', 'via', 'mean us', 'p50 us', 'p99 us'))
+    for name, fn in [('set', write), ('publish', publish), ('sensor update', sensor_update)]:
+        for transport, server in transports:
+            latencies = bench(server, fn, args.n)
+            print("{:<15} {:<6} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                name, transport, 1e6 * sum(latencies) / len(latencies),
+                1e6 * latencies[len(latencies) // 2], 1e6 * latencies[int(len(latencies) * 0.99)]))
+
+    server = transports[0][1]
+    keys = list(server.scan_iter(match="{}:*".format(PRODUCT_ID)))
+    if keys:
+        server.delete(*keys)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Benchmarks target_tools.parse_target_description against katpoint.Target.
+
+Feed it a corpus of recorded target strings (one description per line, e.g.
+dumped from the [product_id]:target keys or the CAM target sensor history):
+
+    python scripts/bench_target_parse.py --corpus targets.txt
+
+Without --corpus, a synthetic corpus of radec calibrator strings is used.
+"""
+from __future__ import print_function
+
+import argparse
+import random
+import timeit
+
+from meerkat_backend_interface.target_tools import parse_target_description
+
+
+def synthetic_corpus(n):
+    """Generates n radec target descriptions in the format CAM reports"""
+    rng = random.Random(0)
+    corpus = []
+    for i in range(n):
+        corpus.append("J{:04d}-{:04d} | PKS {:04d}, radec bfcal single_accumulation, "
+                      "{}:{:02d}:{:05.2f}, -{}:{:02d}:{:04.1f}, ({} {} {:.3f} {:.3f} {:.4f})".format(
+                          i % 2400, i % 9000, i, rng.randint(0, 23), rng.randint(0, 59),
+                          rng.uniform(0, 60), rng.randint(0, 89), rng.randint(0, 59),
+                          rng.uniform(0, 60), 800.0, 8400.0, rng.uniform(-5, 5),
+                          rng.uniform(-5, 5), rng.uniform(-1, 1)))
+    return corpus
+
+
+def bench(name, parse, corpus, repeat):
+    best = min(timeit.repeat(lambda: [parse(line) for line in corpus], number=1, repeat=repeat))
+    print("{:<30} {:>10.2f} us/target  ({} targets, best of {})".format(
+        name, 1e6 * best / len(corpus), len(corpus), repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--corpus', help='file with one target description per line')
+    parser.add_argument('-n', type=int, default=100000, help='size of the synthetic corpus')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timing runs')
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = [line.strip() for line in f if line.strip()]
+    else:
+        corpus = synthetic_corpus(args.n)
+
+    bench('target_tools', parse_target_description, corpus, args.repeat)
+    try:
+        import katpoint
+    except ImportError:
+        print("katpoint not installed; skipping comparison")
+        return
+    bench('katpoint.Target', katpoint.Target, corpus, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Benchmarks how sensor update load delays the delivery of lifecycle alerts.
+
+Publishes alerts through a CONTROL connection and times their delivery to a
+subscriber, first with no other traffic, then while threads write and
+publish sensor updates as fast as they can (as on_update_callback_fn does
+during an antenna sensor burst) through SENSOR connections to, in turn,
+
+    * the same redis instance as the alerts
+    * a separate instance (--sensor-port), as with --redis-sensor-port
+
+For example, with a second redis server on port 6380:
+
+    python scripts/bench_traffic_classes.py --sensor-port 6380
+
+Alerts go to a 'bench:alerts' channel, so running processes are not
+disturbed; the keys written ("bench_array:*") are deleted afterwards.
+"""
+from __future__ import print_function
+
+import argparse
+import threading
+import time
+
+from meerkat_backend_interface.redis_tools import (
+    CONTROL,
+    SENSOR,
+    get_redis,
+    publish_to_redis,
+    write_pair_redis)
+from meerkat_backend_interface.sensor_channels import publish_sensor_updates
+
+PRODUCT_ID = "bench_array"
+CHANNEL = "bench:alerts"
+
+
+def sensor_load(server, stop, counts):
+    """Writes and publishes sensor updates until stop is set"""
+    i = 0
+    while not stop.is_set():
+        sensor_name = "m{:03d}_ap_indexer_position".format(i % 64)
+        write_pair_redis(server, "{}:{}".format(PRODUCT_ID, sensor_name), i)
+        publish_sensor_updates(server, PRODUCT_ID, [(sensor_name, i, time.time())])
+        i += 1
+    counts.append(i)
+
+
+def alert_latencies(args):
+    """Returns the delivery latency of args.n alerts, in seconds, sorted"""
+    control = get_redis(CONTROL, host=args.host, port=args.port)
+    pubsub = get_redis(CONTROL, listener=True, host=args.host, port=args.port).pubsub(
+        ignore_subscribe_messages=True)
+    pubsub.subscribe(CHANNEL)
+    latencies = []
+    for i in range(args.n):
+        publish_to_redis(control, CHANNEL, "capture-start:{}:{!r}".format(PRODUCT_ID, time.time()))
+        message = None
+        while message is None:
+            message = pubsub.get_message(timeout=10.0)
+        latencies.append(time.time() - float(message['data'].rsplit(b':', 1)[1]))
+        time.sleep(args.interval)
+    pubsub.close()
+    return sorted(latencies)
+
+
+def run(name, args, sensor_port=None):
+    stop = threading.Event()
+    counts = []
+    threads = []
+    if sensor_port is not None:
+        for _ in range(args.load_threads):
+            server = get_redis(SENSOR, host=args.host, port=sensor_port)
+            thread = threading.Thread(target=sensor_load, args=(server, stop, counts))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        time.sleep(0.5)  # let the load build up
+    started = time.time()
+    latencies = alert_latencies(args)
+    elapsed = time.time() - started
+    stop.set()
+    for thread in threads:
+        thread.join()
+    print("{:<26} {:>9.1f} {:>9.1f} {:>9.1f} {:>12.0f}".format(
+        name, 1e6 * latencies[len(latencies) // 2], 1e6 * latencies[int(len(latencies) * 0.99)],
+        1e6 * latencies[-1], sum(counts) / (elapsed + 0.5) if counts else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', type=int, default=2000, help='alerts per run')
+    parser.add_argument('--interval', type=float, default=0.001, help='seconds between alerts')
+    parser.add_argument('--load-threads', type=int, default=4, help='threads writing sensor updates')
+    parser.add_argument('--host', default='localhost', help='redis host')
+    parser.add_argument('--port', type=int, default=6379, help='redis port of the control traffic')
+    parser.add_argument('--sensor-port', type=int, help='redis port of a separate instance for sensor traffic')
+    args = parser.parse_args()
+
+    print("{:<26} {:>9} {:>9} {:>9} {:>12}".format(
+        'alert delivery', 'p50 us', 'p99 us', 'max us', 'updates/s'))
+    run("no sensor load", args)
+    run("sensors on same instance", args, sensor_port=args.port)
+    if args.sensor_port:
+        run("sensors on own instance", args, sensor_port=args.sensor_port)
+
+    for port in set([args.port, args.sensor_port or args.port]):
+        server = get_redis(SENSOR, host=args.host, port=port)
+        keys = list(server.scan_iter(match="{}:*".format(PRODUCT_ID)))
+        if keys:
+            server.delete(*keys)
+
+
+if __name__ == '__main__':
+    main()
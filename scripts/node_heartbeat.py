@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+Registers a processing node with the distributor and keeps it registered.
+
+Run on every processing node, next to the process that subscribes to the
+multicast groups, e.g.
+
+    python scripts/node_heartbeat.py --gbps 40 --gpu-slots 2
+
+The node then receives "[product_id]:configure:stream:[address]" and
+"[product_id]:deconfigure:stream:[address]" messages on its channel
+(node:[node_id]:streams by default). If this process stops, the node's
+groups are moved to other nodes once its registration expires (--ttl).
+"""
+import argparse
+import signal
+import socket
+import sys
+
+from meerkat_backend_interface.node_registry import NodeHeartbeat, node_channel
+from meerkat_backend_interface.redis_tools import add_redis_arguments, configure_redis_from_args
+from meerkat_backend_interface.logger import set_logger
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--node-id', default=socket.gethostname(), help='unique name of this node')
+    parser.add_argument('--gbps', type=float, required=True, help='NIC bandwidth offered, in Gb/s')
+    parser.add_argument('--gpu-slots', type=int, required=True, help='GPU slots offered')
+    parser.add_argument('--channel', help='channel to receive assignments on (default: node:[node_id]:streams)')
+    parser.add_argument('--ttl', type=float, default=10.0,
+                        help='seconds the registration outlives the last heartbeat')
+    add_redis_arguments(parser)
+    args = parser.parse_args()
+    configure_redis_from_args(args)
+    log = set_logger()
+
+    heartbeat = NodeHeartbeat(args.node_id, args.gbps, args.gpu_slots, args.channel, args.ttl)
+    log.info("Registering node {} on channel {}".format(heartbeat.node_id, args.channel or node_channel(args.node_id)))
+    heartbeat.start()
+
+    def on_shutdown(sig, frame):
+        heartbeat.stop()
+        sys.exit(0)
+    signal.signal(signal.SIGINT, on_shutdown)
+    signal.signal(signal.SIGTERM, on_shutdown)
+    while True:
+        signal.pause()
+
+
+if __name__ == '__main__':
+    main()
@@ -11,8 +11,7 @@ import uuid
 import tornado.gen
 from katportalclient import KATPortalClient
 
-import redis
-from src.redis_tools import REDIS_CHANNELS, write_pair_redis
+from meerkat_backend_interface.redis_tools import REDIS_CHANNELS, CONTROL, write_pair_redis, get_redis
 
 logger = logging.getLogger('BLUSE.interface')
 
@@ -55,13 +54,13 @@ def main():
 if __name__ == '__main__':
     # TODO: Add sensors to subscribe to on ?configure request
     sensors = ["target", "pos_request_base_ra", "pos_request_base_dec"]
-    redis_server = redis.StrictRedis()
+    redis_server = get_redis()
     io_loop = tornado.ioloop.IOLoop.current()
-    pub_sub = redis_server.pubsub(ignore_subscribe_messages=True)
+    pub_sub = get_redis(CONTROL, listener=True).pubsub(ignore_subscribe_messages=True)
     pub_sub.subscribe(REDIS_CHANNELS.alerts)
     for message in pub_sub.listen():
         msg_parts = message['data'].split(':')
-        if len(msg_parts) == 2 and msg_parts[0] == 'configure':
+        if len(msg_parts) >= 2 and msg_parts[0] == 'configure':
             product_id = msg_parts[1]
             cam_url = redis_server.get("{}:cam:url".format(product_id))
             io_loop.add_callback(main)
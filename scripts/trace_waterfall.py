@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Prints a latency waterfall of the traced requests of a product.
+
+Every request to the KATCP server is traced through the katportal client
+(see meerkat_backend_interface/tracing.py). For the most recent capture-start
+requests of a product, for example:
+
+    python scripts/trace_waterfall.py array_1_bc856M4k --stage capture-start
+
+Each span is drawn on a time axis starting at the first span of its trace.
+Gaps between spans are time spent outside any span, e.g. in redis pubsub
+between 'publish' and 'dispatch'. Alerts that the supervisor replays to a
+new katportal worker get their own trace, marked as a replay of the original.
+"""
+from __future__ import print_function
+
+import argparse
+
+from meerkat_backend_interface.redis_tools import add_redis_arguments, configure_redis_from_args, get_redis
+from meerkat_backend_interface.tracing import read_traces
+
+
+def waterfall(trace, width=50):
+    """Returns the lines of the waterfall of one trace"""
+    spans = trace['spans']
+    t0 = min(start for _, _, start, _ in spans)
+    total = max(end for _, _, _, end in spans) - t0
+    scale = width / total if total > 0 else 0
+    lines = ["{} {} {}  total {:.1f} ms".format(
+        trace['trace_id'], trace['product_id'], trace['stage'], 1e3 * total)]
+    if trace.get('replay_of') is not None:
+        lines[0] += "  (replay of {})".format(trace['replay_of'])
+    for component, name, start, end in spans:
+        offset = int((start - t0) * scale)
+        length = max(1, int((end - start) * scale))
+        lines.append("  {:<10} {:<20} +{:>9.1f} ms {:>9.1f} ms |{:<{width}}|".format(
+            component, name, 1e3 * (start - t0), 1e3 * (end - start),
+            ' ' * offset + '#' * length, width=width))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('product_id', nargs='?', help='product to show the traces of (default: all)')
+    parser.add_argument('--stage', help='only show this request, e.g. capture-start')
+    parser.add_argument('--trace-id', help='only show this trace')
+    parser.add_argument('-n', type=int, default=5, help='number of (most recent) traces to show')
+    add_redis_arguments(parser)
+    args = parser.parse_args()
+    configure_redis_from_args(args)
+
+    server = get_redis()
+    traces = read_traces(server, product_id=args.product_id, stage=args.stage,
+                         trace_id=args.trace_id, limit=args.n)
+    if not traces:
+        print("No matching traces")
+    for trace in traces:
+        print("\n".join(waterfall(trace)))
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,7 @@ requires = [
     'katpoint',
     'lxml==4.2.3',
     'MarkupSafe==1.0',
+    'numpy',
     'omnijson==0.1.2',
     'pipreqs==0.4.9',
     'ply==3.11',
@@ -30,7 +31,6 @@ requires = [
     'requests>=2.20.0',
     'singledispatch==3.4.0.3',
     'six==1.11.0',
-    'slacker==0.9.65',
     'subprocess32==3.5.2',
     'tornado==4.5.3',
     'ujson==1.35',
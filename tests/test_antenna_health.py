@@ -0,0 +1,27 @@
+from meerkat_backend_interface.antenna_health import AntennaHealth
+
+
+def test_all_antennas_start_good():
+    health = AntennaHealth(['m000', 'm001', 'm002'], ['marked_faulty', 'data_suspect'])
+    assert health.good_count == 3
+    assert health.good_mask == 0b111
+    assert health.good_antennas() == ['m000', 'm001', 'm002']
+
+
+def test_aggregates_follow_flags():
+    health = AntennaHealth(['m000', 'm001', 'm002'], ['marked_faulty', 'data_suspect'])
+    assert health.update('m001_marked_faulty', True)
+    assert (health.good_count, health.good_mask) == (2, 0b101)
+    assert not health.update('m001_data_suspect', 'true')  # m001 was already unusable
+    assert not health.update('m001_marked_faulty', 'false')  # data_suspect is still raised
+    assert health.update('m001_data_suspect', '0')
+    assert (health.good_count, health.good_mask) == (3, 0b111)
+
+
+def test_repeated_and_unknown_values_change_nothing():
+    health = AntennaHealth(['m000', 'm001'], ['marked_faulty'])
+    assert health.update('m000_marked_faulty', True)
+    assert not health.update('m000_marked_faulty', True)
+    assert not health.update('m005_marked_faulty', True)
+    assert not health.update('m000_windspeed', True)
+    assert health.good_antennas() == ['m001']
@@ -0,0 +1,42 @@
+from meerkat_backend_interface.archive import ArchiveWriter, ArchiveReader
+
+
+def write_archive(path, n, chunk_records=10):
+    archive = ArchiveWriter(path, chunk_records=chunk_records)
+    archive.append('lifecycle', 'capture-init', timestamp=0.0)
+    for i in range(n):
+        archive.append('sensor', 'target', 'target {}'.format(i), timestamp=1.0 + i)
+    archive.close(wait=True)
+
+
+def test_round_trip(tmpdir):
+    path = str(tmpdir.join('test.blarc'))
+    write_archive(path, 25)
+    archive = ArchiveReader(path)
+    assert archive.finalized
+    assert len(archive.index) == 3
+    assert (archive.start_time, archive.end_time) == (0.0, 25.0)
+    records = archive.read()
+    assert records[0] == (0.0, 'lifecycle', 'capture-init', None)
+    assert records[-1] == (25.0, 'sensor', 'target', 'target 24')
+    assert len(records) == 26
+
+
+def test_time_slices_and_kinds(tmpdir):
+    path = str(tmpdir.join('test.blarc'))
+    write_archive(path, 25)
+    archive = ArchiveReader(path)
+    assert [record[0] for record in archive.read(12.0, 14.5)] == [12.0, 13.0, 14.0]
+    assert archive.read(kinds=['lifecycle']) == [(0.0, 'lifecycle', 'capture-init', None)]
+    assert archive.read(100.0, 200.0) == []
+
+
+def test_unfinalized_archives_are_recovered(tmpdir):
+    path = str(tmpdir.join('test.blarc'))
+    write_archive(path, 25)
+    last_chunk = ArchiveReader(path).index[-1][2]
+    with open(path, 'rb+') as f:
+        f.truncate(last_chunk + 5)  # as if the writer died while writing the last chunk
+    archive = ArchiveReader(path)
+    assert not archive.finalized
+    assert len(archive.read()) == 20
@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip('katcp')  # katcp_server needs katcp, which is not installed everywhere
+
+from meerkat_backend_interface.katcp_server import BLBackendInterface
+
+STREAMS = {"cam.http": {"camdata": "http://monctl.devnmk.camlab.kat.ac.za/api/client/2"},
+           "stream_type2": {"stream_name1": "stream_address1", "stream_name2": "stream_address2"}}
+
+
+def test_identical_arguments_hash_the_same():
+    first = BLBackendInterface._config_hash(['m000', 'm001'], 4096, STREAMS, 'BLUSE_3')
+    reordered = dict(reversed(list(STREAMS.items())))
+    assert BLBackendInterface._config_hash(['m000', 'm001'], 4096, reordered, 'BLUSE_3') == first
+
+
+def test_any_change_changes_the_hash():
+    first = BLBackendInterface._config_hash(['m000', 'm001'], 4096, STREAMS, 'BLUSE_3')
+    assert BLBackendInterface._config_hash(['m000'], 4096, STREAMS, 'BLUSE_3') != first
+    assert BLBackendInterface._config_hash(['m000', 'm001'], 32768, STREAMS, 'BLUSE_3') != first
+    assert BLBackendInterface._config_hash(['m000', 'm001'], 4096, {}, 'BLUSE_3') != first
+    assert BLBackendInterface._config_hash(['m000', 'm001'], 4096, STREAMS, 'BLUSE_4') != first
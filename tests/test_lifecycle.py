@@ -0,0 +1,78 @@
+import pytest
+
+from meerkat_backend_interface import lifecycle
+from meerkat_backend_interface.lifecycle import ProductLifecycle, InvalidTransition, DECONFIGURED
+
+
+class StubPipeline(object):
+    def __init__(self, server):
+        self.server = server
+
+    def set(self, key, value, ex=None):
+        self.server.data[key] = value
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+    def execute(self):
+        return []
+
+
+class StubServer(object):
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+
+    def pipeline(self):
+        return StubPipeline(self)
+
+    def scan_iter(self, match=None):
+        return [key for key in self.data if key.endswith(':state')]
+
+    def get(self, key):
+        return self.data.get(key)
+
+
+def test_every_transition_leads_to_a_known_state():
+    for request, (valid_states, new_state) in lifecycle.TRANSITIONS.items():
+        assert new_state in lifecycle.STATES + [DECONFIGURED]
+        for state in valid_states:
+            assert state is None or state in lifecycle.STATES
+
+
+def test_capture_cycle():
+    server = StubServer()
+    products = ProductLifecycle(server)
+    for request, state in [('configure', 'configured'), ('capture-init', 'initialised'),
+                           ('capture-start', 'capturing'), ('capture-stop', 'stopped'),
+                           ('capture-start', 'capturing'), ('capture-done', 'done'),
+                           ('capture-init', 'initialised')]:
+        assert products.next_state('array_1', request) == state
+        products.set_state('array_1', state)
+    assert server.data['array_1:state'] == 'initialised'
+
+
+def test_invalid_requests_are_rejected():
+    products = ProductLifecycle(StubServer())
+    with pytest.raises(InvalidTransition):
+        products.next_state('array_1', 'capture-start')
+    products.set_state('array_1', 'configured')
+    with pytest.raises(InvalidTransition):
+        products.next_state('array_1', 'capture-stop')
+    with pytest.raises(InvalidTransition):
+        products.next_state('array_1', 'capture-start')
+
+
+def test_deconfigure_forgets_the_product():
+    server = StubServer()
+    products = ProductLifecycle(server)
+    products.set_state('array_1', 'capturing')
+    products.set_state('array_1', products.next_state('array_1', 'deconfigure'))
+    assert products.state('array_1') is None
+    assert server.data['array_1:state'] == DECONFIGURED
+    with pytest.raises(InvalidTransition):
+        products.next_state('array_1', 'deconfigure')
+
+
+def test_load_restores_live_products():
+    server = StubServer({'array_1:state': b'capturing', 'array_2:state': 'deconfigured'})
+    assert ProductLifecycle(server).load() == ['array_1']
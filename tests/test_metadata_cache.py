@@ -0,0 +1,52 @@
+from meerkat_backend_interface import metadata_cache
+from meerkat_backend_interface.metadata_cache import MetadataCache
+
+
+def keyspace(key):
+    return {'channel': "__keyspace@0__:{}".format(key), 'data': 'set'}
+
+
+def listening_cache():
+    cache = MetadataCache(redis_server=object())  # never started, so it has no connection of its own
+    cache._listening = True
+    return cache
+
+
+def test_snapshot_is_cached_until_a_field_changes(monkeypatch):
+    reads = []
+    monkeypatch.setattr(metadata_cache, 'get_product_snapshot',
+                        lambda server, product_id: reads.append(product_id) or {'version': len(reads)})
+    cache = listening_cache()
+    assert cache.snapshot('array_1') == {'version': 1}
+    assert cache.snapshot('array_1') == {'version': 1}
+    cache._on_keyspace(keyspace('array_1:m000_observer'))  # not part of the snapshot
+    assert cache.snapshot('array_1') == {'version': 1}
+    cache._on_keyspace(keyspace('array_1:antennas'))
+    assert cache.snapshot('array_1') == {'version': 2}
+    assert reads == ['array_1', 'array_1']
+
+
+def test_snapshot_racing_a_write_is_not_cached(monkeypatch):
+    cache = listening_cache()
+    reads = []
+
+    def read_during_write(server, product_id):
+        reads.append(product_id)
+        if len(reads) == 1:
+            cache._on_keyspace(keyspace('array_1:version'))  # lands while the snapshot is read
+        return {'version': len(reads)}
+    monkeypatch.setattr(metadata_cache, 'get_product_snapshot', read_during_write)
+    assert cache.snapshot('array_1') == {'version': 1}
+    assert cache.snapshot('array_1') == {'version': 2}
+    assert cache.snapshot('array_1') == {'version': 2}
+    assert len(reads) == 2
+
+
+def test_configure_drops_snapshot(monkeypatch):
+    reads = []
+    monkeypatch.setattr(metadata_cache, 'get_product_snapshot',
+                        lambda server, product_id: reads.append(product_id) or {'version': len(reads)})
+    cache = listening_cache()
+    cache.snapshot('array_1')
+    cache._on_alert({'channel': 'alerts', 'data': 'deconfigure:array_1'})
+    assert cache.snapshot('array_1') == {'version': 2}
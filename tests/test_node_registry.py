@@ -0,0 +1,71 @@
+from meerkat_backend_interface import node_registry
+from meerkat_backend_interface.node_registry import GroupDistributor, pack_groups
+
+
+def node(gbps, gpu_slots):
+    return {'gbps': gbps, 'gpu_slots': gpu_slots, 'channel': None, 'heartbeat': 0.0, 'started': 0.0}
+
+
+def test_pack_groups_best_fit():
+    nodes = {'big': node(10.0, 10), 'small': node(2.0, 10)}
+    placed, unplaced = pack_groups(['p:1', 'p:2', 'p:3'], nodes, {}, group_gbps=1.0)
+    # the fullest node that can take a group gets it, so 'big' stays free for longer
+    assert placed == {'p:1': 'small', 'p:2': 'small', 'p:3': 'big'}
+    assert unplaced == []
+
+
+def test_pack_groups_keeps_live_assignments():
+    nodes = {'a': node(4.0, 4), 'b': node(2.0, 4)}
+    placed, _ = pack_groups(['p:1', 'p:2'], nodes, {'p:1': 'a', 'p:2': 'gone'})
+    assert placed['p:1'] == 'a'
+    assert placed['p:2'] == 'b'
+
+
+def test_pack_groups_capacity():
+    nodes = {'a': node(10.0, 1)}
+    placed, unplaced = pack_groups(['p:1', 'p:2'], nodes, {}, group_gbps=1.0, group_gpu_slots=1)
+    assert placed == {'p:1': 'a'}
+    assert unplaced == ['p:2']
+    assert pack_groups(['p:1'], {}, {}) == ({}, ['p:1'])
+
+
+class StubServer(object):
+    """Persists nothing; only GroupDistributor's own state is looked at"""
+
+    def hgetall(self, key):
+        return {}
+
+    def pipeline(self):
+        return self
+
+    def __getattr__(self, command):
+        return lambda *args, **kwargs: None
+
+
+def distributor(monkeypatch, nodes):
+    sent = []
+    monkeypatch.setattr(node_registry, 'live_nodes', lambda server: nodes)
+    monkeypatch.setattr(node_registry, 'publish_to_redis',
+                        lambda server, channel, message: sent.append((channel, message)) or True)
+    return GroupDistributor(StubServer(), StubServer()), sent
+
+
+def test_configure_replaces_the_groups_of_a_product(monkeypatch):
+    groups, sent = distributor(monkeypatch, {'a': dict(node(10.0, 10), channel='node:a:streams')})
+    groups.configure('p', ['239.9.3.1', '239.9.3.2'])
+    del sent[:]
+    groups.configure('p', ['239.9.3.2', '239.9.3.3'])
+    assert groups.groups == ['p:239.9.3.2', 'p:239.9.3.3']
+    assert sorted(groups.assignments) == ['p:239.9.3.2', 'p:239.9.3.3']
+    assert sent == [('node:a:streams', 'p:deconfigure:stream:239.9.3.1'),
+                    ('node:a:streams', 'p:configure:stream:239.9.3.3')]
+
+
+def test_deconfigure_releases_only_that_product(monkeypatch):
+    groups, sent = distributor(monkeypatch, {'a': dict(node(10.0, 10), channel='node:a:streams')})
+    groups.configure('p', ['239.9.3.1'])
+    groups.configure('q', ['239.9.3.1'])
+    del sent[:]
+    groups.deconfigure('p')
+    assert groups.groups == ['q:239.9.3.1']
+    assert sent == [('node:a:streams', 'p:deconfigure:stream:239.9.3.1')]
@@ -0,0 +1,52 @@
+import math
+
+import numpy as np
+
+from meerkat_backend_interface.pointing import PointingBuffer
+
+
+def test_empty_buffer():
+    ra, dec = PointingBuffer().interpolate([100.0, 110.0])
+    assert np.isnan(ra).all() and np.isnan(dec).all()
+    assert PointingBuffer().targets_between(0.0, 100.0) == []
+
+
+def test_interpolate():
+    buf = PointingBuffer()
+    buf.add_ra(100.0, 1.0)
+    buf.add_dec(100.0, -0.5)
+    buf.add_ra(110.0, 1.1)
+    buf.add_dec(110.0, -0.4)
+    assert len(buf) == 2
+    ra, dec = buf.interpolate([105.0, 90.0, 120.0])
+    assert np.allclose(ra[0], 1.05) and np.allclose(dec[0], -0.45)
+    assert np.isnan(ra[1:]).all() and np.isnan(dec[1:]).all()
+
+
+def test_interpolate_across_zero_ra():
+    buf = PointingBuffer()
+    buf.add_dec(100.0, 0.0)
+    buf.add_ra(100.0, 2 * math.pi - 0.1)
+    buf.add_ra(110.0, 0.1)
+    ra, _ = buf.interpolate([105.0])
+    assert np.allclose(ra, 0.0) or np.allclose(ra, 2 * math.pi)
+
+
+def test_capacity():
+    buf = PointingBuffer(capacity=10)
+    for i in range(35):
+        buf.add_ra(float(i), 0.01 * i)
+        buf.add_dec(float(i), 0.0)
+    assert len(buf) == 10
+    ra, _ = buf.interpolate([24.0, 25.0, 34.0])
+    assert np.isnan(ra[0])
+    assert np.allclose(ra[1:], [0.25, 0.34])
+
+
+def test_targets_between():
+    buf = PointingBuffer()
+    buf.add_target(100.0, 'a')
+    buf.add_target(200.0, 'b')
+    buf.add_target(150.0, 'late')  # out of order: ignored
+    assert buf.targets_between(120.0, 180.0) == [(100.0, 'a')]
+    assert buf.targets_between(120.0, 250.0) == [(100.0, 'a'), (200.0, 'b')]
@@ -0,0 +1,114 @@
+import redis
+
+from meerkat_backend_interface import redis_tools
+from meerkat_backend_interface.redis_tools import (PRODUCT_METADATA_FIELDS, METADATA, SENSOR,
+                                                   get_product_snapshot, write_hash_redis,
+                                                   write_list_redis, write_pair_redis)
+
+
+class StubScript(object):
+    """Runs the snapshot script against the dict of the server it is called with"""
+
+    def __call__(self, keys, args, client):
+        if client.error is not None:
+            raise client.error
+        values = []
+        for key, kind in zip(keys, args):
+            value = client.data.get(key)
+            if kind == 'hash':
+                value = [item for pair in sorted((value or {}).items()) for item in pair]
+            elif kind == 'list':
+                value = value or []
+            values.append(value)
+        return values
+
+
+class StubPipeline(object):
+    """Records the commands queued on it, and hands them to its server on execute"""
+
+    def __init__(self, server):
+        self.server = server
+        self.queued = []
+
+    def __getattr__(self, command):
+        return lambda *args, **kwargs: self.queued.append((command,) + args)
+
+    def execute(self):
+        self.server.executed.append(self.queued)
+
+
+class StubServer(object):
+
+    def __init__(self, data=None, error=None, traffic_class=METADATA):
+        self.data = data or dict()
+        self.error = error
+        self.traffic_class = traffic_class
+        self.executed = []  # the commands of each transaction
+
+    def register_script(self, source):
+        return StubScript()
+
+    def pipeline(self, *args, **kwargs):
+        return StubPipeline(self)
+
+
+def setup_function(function):
+    redis_tools._scripts.clear()
+
+
+def test_snapshot_reads_every_field():
+    server = StubServer({'array_1:antennas': ['m000', 'm001'], 'array_1:n_channels': '4096',
+                         'array_1:version': '3'})
+    snapshot = get_product_snapshot(server, 'array_1')
+    assert snapshot['antennas'] == ['m000', 'm001']
+    assert snapshot['n_channels'] == '4096'
+    assert snapshot['version'] == 3
+    assert set(snapshot) == set(field for field, _ in PRODUCT_METADATA_FIELDS) | {'version'}
+
+
+def test_snapshot_of_unknown_product():
+    snapshot = get_product_snapshot(StubServer(), 'array_2')
+    assert snapshot['version'] == 0
+    assert snapshot['target'] is None
+    assert snapshot['antennas'] == []
+
+
+def test_snapshot_read_failure():
+    assert get_product_snapshot(StubServer(error=redis.ConnectionError()), 'array_1') is None
+
+
+def test_snapshot_reads_hashes():
+    server = StubServer({'array_1:pointing': {'ra': '1.5', 'dec': '-0.5'},
+                         'array_1:target_info': {'name': 'PKS 0408-65'}})
+    snapshot = get_product_snapshot(server, 'array_1')
+    assert snapshot['pointing'] == {'ra': '1.5', 'dec': '-0.5'}
+    assert snapshot['target_info'] == {'name': 'PKS 0408-65'}
+    assert get_product_snapshot(StubServer(), 'array_1')['pointing'] == {}
+
+
+def test_metadata_writes_bump_versions():
+    server = StubServer()
+    assert write_list_redis(server, 'array_1:antennas', ['m000', 'm001'])
+    commands = server.executed[0]
+    assert ('hincrby', 'array_1:versions', 'antennas', 1) in commands
+    assert ('incr', 'array_1:version') in commands
+
+
+def test_sensor_writes_are_not_versioned():
+    server = StubServer()
+    assert write_pair_redis(server, 'array_1:m000_observer', 'value')
+    assert write_pair_redis(server, 'current:obs:id', 'value')
+    assert [command[0] for command in server.executed[0]] == ['set']
+    assert [command[0] for command in server.executed[1]] == ['set']
+
+
+def test_structured_writes_bump_versions():
+    server = StubServer()
+    assert write_hash_redis(server, 'array_1:pointing', {'ra': '1.5'}, replace=False)
+    assert ('hincrby', 'array_1:versions', 'pointing', 1) in server.executed[0]
+
+
+def test_versions_are_only_bumped_on_the_metadata_server():
+    server = StubServer(traffic_class=SENSOR)
+    assert write_pair_redis(server, 'array_1:target', 'J1939-6342, radec, ...')
+    assert [command[0] for command in server.executed[0]] == ['set']
@@ -0,0 +1,47 @@
+from meerkat_backend_interface.schedule_blocks import ScheduleBlockTracker, diff_targets
+
+A = {'target': 'a', 'track_duration': 20.0}
+B = {'target': 'b', 'track_duration': 20.0}
+
+
+def test_diff_targets():
+    a_longer = dict(A, track_duration=30.0)
+    assert diff_targets([A], [a_longer, B]) == ([B], [], [a_longer])
+    assert diff_targets([A, B], [B]) == ([], [A], [])
+    assert diff_targets([A], [A]) == ([], [], [])
+
+
+def test_diff_targets_repeated_visits():
+    # the second visit of a target is matched with the second visit, not the first
+    assert diff_targets([A, B], [A, B, A]) == ([A], [], [])
+    assert diff_targets([A, B, A], [A, B]) == ([], [A], [])
+
+
+def test_tracker_added_modified_removed():
+    tracker = ScheduleBlockTracker(revalidate_interval=60.0)
+    assert tracker.to_fetch('array_1', ['sb1'], now=100.0) == ['sb1']
+    diffs = tracker.update('array_1', ['sb1'], {'sb1': [A]}, now=100.0)
+    assert diffs == [{'block': 'sb1', 'change': 'added', 'added': [A], 'removed': [], 'modified': []}]
+    assert tracker.blocks('array_1') == [[A]]
+
+    # fetched again only once revalidate_interval has passed
+    assert tracker.to_fetch('array_1', ['sb1'], now=130.0) == []
+    assert tracker.to_fetch('array_1', ['sb1'], now=160.0) == ['sb1']
+    assert tracker.update('array_1', ['sb1'], {'sb1': [A]}, now=160.0) == []
+    diffs = tracker.update('array_1', ['sb1'], {'sb1': [A, B]}, now=220.0)
+    assert diffs == [{'block': 'sb1', 'change': 'modified', 'added': [B], 'removed': [], 'modified': []}]
+
+    diffs = tracker.update('array_1', [], {}, now=230.0)
+    assert diffs == [{'block': 'sb1', 'change': 'removed', 'added': [], 'removed': [A, B], 'modified': []}]
+    assert tracker.blocks('array_1') == []
+
+
+def test_tracker_track_and_forget():
+    tracker = ScheduleBlockTracker()
+    tracker.track('array_1')
+    assert tracker.products() == ['array_1']
+    tracker.update('array_1', ['sb1'], {'sb1': [A]})
+    tracker.track('array_1')  # leaves the known blocks alone
+    assert tracker.blocks('array_1') == [[A]]
+    tracker.forget('array_1')
+    assert tracker.products() == []
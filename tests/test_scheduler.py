@@ -0,0 +1,60 @@
+import tornado.gen
+import tornado.ioloop
+
+from meerkat_backend_interface.scheduler import PriorityScheduler, PRIORITIES
+
+
+def run_jobs(submissions, n_started, host_limit=1):
+    """Submits (priority, key, name, kwargs) jobs and returns the order in which they started"""
+    io_loop = tornado.ioloop.IOLoop()
+    started = []
+
+    @tornado.gen.coroutine
+    def job(name):
+        started.append(name)
+        yield tornado.gen.sleep(0.001)
+
+    @tornado.gen.coroutine
+    def main():
+        scheduler = PriorityScheduler(io_loop, host_limit=host_limit)
+        for priority, key, name, kwargs in submissions:
+            scheduler.submit(priority, key, job, name, **kwargs)
+        while len(started) < n_started:
+            yield tornado.gen.sleep(0.001)
+        raise tornado.gen.Return(scheduler.stats())
+
+    try:
+        stats = io_loop.run_sync(main, timeout=5)
+    finally:
+        io_loop.close()
+    return started, stats
+
+
+def test_most_urgent_first():
+    started, _ = run_jobs([
+        (PRIORITIES.schedule, 'array_1', 'first', {'host': 'cam'}),  # takes the only slot of the host
+        (PRIORITIES.schedule, 'array_2', 'capture-init', {'host': 'cam'}),
+        (PRIORITIES.configure, 'array_3', 'configure', {'host': 'cam'}),
+        (PRIORITIES.capture, 'array_4', 'capture-start', {'host': 'cam'}),
+        ], 4)
+    assert started == ['first', 'capture-start', 'configure', 'capture-init']
+
+
+def test_jobs_of_a_product_keep_their_order():
+    started, _ = run_jobs([
+        (PRIORITIES.configure, 'array_1', 'configure', {}),
+        (PRIORITIES.schedule, 'array_1', 'capture-init', {}),
+        (PRIORITIES.capture, 'array_1', 'capture-start', {}),
+        ], 3)
+    assert started == ['configure', 'capture-init', 'capture-start']
+
+
+def test_late_droppable_jobs_are_dropped():
+    started, stats = run_jobs([
+        (PRIORITIES.schedule, 'array_1', 'late', {'deadline': -1.0, 'droppable': True}),
+        (PRIORITIES.capture, 'array_1', 'late but needed', {'deadline': -1.0}),
+        ], 1)
+    assert started == ['late but needed']
+    assert stats[PRIORITIES.schedule]['dropped'] == 1
+    assert stats[PRIORITIES.capture]['missed'] == 1
+    assert stats[PRIORITIES.capture]['started'] == 1
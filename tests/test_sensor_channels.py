@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+from meerkat_backend_interface.sensor_channels import (
+    group_channel, parse_sensor_message, sensor_channel, sensor_group)
+
+
+def test_sensor_group():
+    assert sensor_group('m000_marked_faulty') == 'antenna'
+    assert sensor_group('cbf_1_target') == 'pointing'
+    assert sensor_group('weight') == 'other'
+
+
+def test_parse_single_update():
+    channel = sensor_channel('array_1', 'target')
+    assert channel == 'sensors:array_1:pointing:target'
+    assert parse_sensor_message(channel, json.dumps(['J1939-6342', 100.0])) == (
+        'array_1', [('target', 'J1939-6342', 100.0)])
+
+
+def test_parse_batch():
+    data = json.dumps([['m000_marked_faulty', False, 100.0], ['m001_marked_faulty', True, 101.0]])
+    assert parse_sensor_message(group_channel('array_1', 'antenna').encode('utf-8'), data.encode('utf-8')) == (
+        'array_1', [('m000_marked_faulty', False, 100.0), ('m001_marked_faulty', True, 101.0)])
+
+
+def test_parse_other_channels():
+    assert parse_sensor_message('alerts', 'configure:array_1') is None
+    assert parse_sensor_message('sensors:array_1', '[]') is None
+
+
+def test_parse_malformed():
+    with pytest.raises(ValueError):
+        parse_sensor_message('sensors:array_1:pointing:target', 'not json')
@@ -0,0 +1,52 @@
+from meerkat_backend_interface.sensor_filter import (FilterRule, SensorUpdateFilter, DEFAULT_FILTER_RULES,
+                                                     FILTERED_UPDATES)
+
+
+def test_duplicates_are_dropped_until_the_status_changes():
+    update_filter = SensorUpdateFilter()
+    assert update_filter.accept('array_1', 'm000_marked_faulty', True, 'nominal')
+    assert not update_filter.accept('array_1', 'm000_marked_faulty', True, 'nominal')
+    assert update_filter.accept('array_1', 'm000_marked_faulty', True, 'warn')
+    assert update_filter.accept('array_2', 'm000_marked_faulty', True, 'nominal')  # another product
+
+
+def test_deadband():
+    update_filter = SensorUpdateFilter()
+    arcsecond = 1.0 / 3600
+    assert update_filter.accept('array_1', 'subarray_1_pos_request_base_dec', -30.0, 'nominal')
+    assert not update_filter.accept('array_1', 'subarray_1_pos_request_base_dec', -30.0 + arcsecond / 2, 'nominal')
+    assert update_filter.accept('array_1', 'subarray_1_pos_request_base_dec', -30.0 + 2 * arcsecond, 'nominal')
+
+
+def test_ra_deadband_wraps_around():
+    update_filter = SensorUpdateFilter()
+    arcsecond = 1.0 / 3600
+    assert update_filter.accept('array_1', 'subarray_1_pos_request_base_ra', 360.0 - arcsecond / 4, 'nominal')
+    assert not update_filter.accept('array_1', 'subarray_1_pos_request_base_ra', arcsecond / 4, 'nominal')
+    assert update_filter.accept('array_1', 'subarray_1_pos_request_base_ra', 180.0, 'nominal')
+
+
+def test_min_interval_holds_back_the_newest_update():
+    update_filter = SensorUpdateFilter([('*_windspeed', FilterRule(min_interval=1.0))])
+    assert update_filter.accept('array_1', 'anc_windspeed', 1.0, 'nominal', now=0.0)
+    assert not update_filter.accept('array_1', 'anc_windspeed', 2.0, 'nominal', now=0.2)
+    assert not update_filter.accept('array_1', 'anc_windspeed', 3.0, 'nominal', now=0.4)
+    assert update_filter.flush_due(now=0.5) == []
+    assert update_filter.flush_due(now=1.0) == [('array_1', 'anc_windspeed', 3.0, 'nominal')]
+
+
+def test_forget():
+    update_filter = SensorUpdateFilter(DEFAULT_FILTER_RULES)
+    assert update_filter.accept('array_1', 'm000_data_suspect', False, 'nominal')
+    update_filter.forget('array_1')
+    assert update_filter.accept('array_1', 'm000_data_suspect', False, 'nominal')
+
+
+def test_outcomes_are_counted():
+    before = dict((reason, FILTERED_UPDATES.labels(reason).value) for reason in ['forwarded', 'duplicate'])
+    update_filter = SensorUpdateFilter()
+    update_filter.accept('array_1', 'm000_marked_faulty', False, 'nominal')
+    update_filter.accept('array_1', 'm000_marked_faulty', False, 'nominal')
+    update_filter.accept('array_1', 'm000_marked_faulty', False, 'nominal')
+    assert FILTERED_UPDATES.labels('forwarded').value - before['forwarded'] == 1
+    assert FILTERED_UPDATES.labels('duplicate').value - before['duplicate'] == 2
@@ -0,0 +1,62 @@
+from meerkat_backend_interface.sensor_plans import (
+    ONCE, POINTING_SENSORS, SUBSCRIBED, SensorQuery, SensorQueryPlanner, merge_patterns)
+
+
+def test_merge_patterns():
+    assert merge_patterns(['target', 'cbf_target', 'weight', 'target']) == ['target', 'weight']
+    # regular expressions are kept as they are
+    assert merge_patterns(['target', 'm0.._target']) == ['target', 'm0.._target']
+
+
+def test_pointing_sensors_are_the_subarrays_own():
+    plans = SensorQueryPlanner({
+        'capture-init': [SensorQuery(pattern, SUBSCRIBED) for pattern in POINTING_SENSORS]})
+    plans.resolve('array_1', ['target', 'cbf_1_target', 'subarray_1_pos_request_base_ra', 'm000_target',
+                              'm012_pos_request_base_dec', 'target_list'])
+    assert plans.subscribed_names('array_1') == ['cbf_1_target', 'subarray_1_pos_request_base_ra', 'target']
+
+
+def planner():
+    planner = SensorQueryPlanner({
+        'capture-init': [SensorQuery('target', SUBSCRIBED)],
+        'capture-start': [SensorQuery('target', SUBSCRIBED), SensorQuery('weight', ONCE, max_age=60.0)],
+        'capture-stop': [],
+    })
+    planner.resolve('array_1', ['target', 'cbf_weight'])
+    return planner
+
+
+def test_plan_before_any_value():
+    served, missing = planner().plan('array_1', 'capture-start', subscribed=True, now=100.0)
+    assert served == {}
+    assert sorted(missing) == ['cbf_weight', 'target']
+
+
+def test_plan_serves_subscribed_and_prefetched_values():
+    plans = planner()
+    assert plans.subscribed_names('array_1') == ['target']
+    plans.record('array_1', 'target', 'J1939-6342', now=100.0)
+    plans.record('array_1', 'cbf_weight', 1.0, now=100.0)
+    served, missing = plans.plan('array_1', 'capture-start', subscribed=True, now=150.0)
+    assert served == {'target': ('subscription', 'J1939-6342'), 'cbf_weight': ('prefetched', 1.0)}
+    assert missing == []
+    # a subscribed value is only current while the subscription is live
+    served, missing = plans.plan('array_1', 'capture-start', subscribed=False, now=150.0)
+    assert missing == ['target']
+    # and a prefetched one only for max_age
+    served, missing = plans.plan('array_1', 'capture-start', subscribed=True, now=200.0)
+    assert missing == ['cbf_weight']
+
+
+def test_prefetch_names():
+    plans = planner()
+    assert plans.prefetch_names('array_1', 'capture-init', now=100.0) == ['cbf_weight']
+    plans.record('array_1', 'cbf_weight', 1.0, now=100.0)
+    assert plans.prefetch_names('array_1', 'capture-init', now=110.0) == []
+
+
+def test_forget():
+    plans = planner()
+    plans.forget('array_1')
+    assert not plans.resolved('array_1')
+    assert plans.plan('array_1', 'capture-start') == ({}, [])
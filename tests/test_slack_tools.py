@@ -0,0 +1,50 @@
+import threading
+import time
+
+from meerkat_backend_interface.slack_tools import SlackNotifier
+
+
+class RecordingNotifier(SlackNotifier):
+    """Records its posts instead of sending them to slack"""
+
+    def __init__(self, **kwargs):
+        super(RecordingNotifier, self).__init__(token='test', min_interval=0.0, **kwargs)
+        self.posts = []
+
+    def _post(self, channel, text, retries=1):
+        self.posts.append((channel, text))
+
+
+def test_repeats_are_coalesced():
+    notifier = RecordingNotifier(coalesce_window=0.1)
+    notifier.notify('capture-start of array_1')
+    notifier.notify('capture-start of array_1')
+    notifier.notify('Found aliens!', '#listen')
+    notifier.close()
+    assert sorted(notifier.posts) == [('#active_observations', 'capture-start of array_1 (x2)'),
+                                      ('#listen', 'Found aliens!')]
+
+
+def test_close_does_not_block_on_a_full_queue():
+    notifier = RecordingNotifier(max_queue=2, coalesce_window=0.0)
+    posting = threading.Event()
+    release = threading.Event()
+    post = notifier._post
+
+    def slow_post(channel, text, retries=1):
+        posting.set()
+        release.wait(5.0)
+        post(channel, text, retries)
+    notifier._post = slow_post
+    notifier.notify('first')
+    assert posting.wait(5.0)  # the thread is busy posting 'first'
+    notifier.notify('second')
+    notifier.notify('third')
+    assert not notifier.notify('fourth')  # the queue is full
+    thread = notifier._thread
+    started = time.time()
+    notifier.close(timeout=0.1)
+    assert time.time() - started < 1.0
+    release.set()
+    thread.join(5.0)
+    assert notifier.posts == [('#active_observations', 'first'), ('#active_observations', 'second\nthird')]
@@ -0,0 +1,68 @@
+import redis
+
+from meerkat_backend_interface.redis_tools import METADATA, replay_spool
+from meerkat_backend_interface.spool import WriteSpool
+
+
+class StubPipeline(object):
+
+    def __init__(self, server):
+        self.server = server
+        self.queued = []
+
+    def publish(self, channel, message):
+        self.queued.append(message)
+
+    def execute(self):
+        if self.server.fail_after is not None and len(self.server.published) >= self.server.fail_after:
+            raise redis.ConnectionError()
+        self.server.published.extend(self.queued)
+        self.server.on_execute()
+
+
+class StubServer(object):
+    traffic_class = METADATA
+
+    def __init__(self, fail_after=None, on_execute=lambda: None):
+        self.published = []
+        self.fail_after = fail_after
+        self.on_execute = on_execute
+
+    def pipeline(self, *args, **kwargs):
+        return StubPipeline(self)
+
+
+def spooled(tmpdir, n):
+    spool = WriteSpool(str(tmpdir.join('test.spool')))
+    for i in range(n):
+        spool.append([METADATA, 'publish', 'chan', str(i)])
+    return spool
+
+
+def test_replay_in_order(tmpdir):
+    spool = spooled(tmpdir, 5)
+    server = StubServer()
+    assert replay_spool(server, spool, batch_size=2) == 5
+    assert server.published == ['0', '1', '2', '3', '4']
+    assert not spool.active
+
+
+def test_writes_during_replay_follow_it(tmpdir):
+    spool = spooled(tmpdir, 5)
+    server = StubServer(on_execute=lambda: len(server.published) == 2 and spool.append(
+        [METADATA, 'publish', 'chan', 'late']))
+    assert replay_spool(server, spool, batch_size=2) == 6
+    assert server.published == ['0', '1', '2', '3', '4', 'late']
+
+
+def test_interrupted_replay_keeps_the_rest(tmpdir):
+    spool = spooled(tmpdir, 5)
+    server = StubServer(fail_after=2)
+    try:
+        replay_spool(server, spool, batch_size=2)
+    except redis.ConnectionError:
+        pass
+    assert [op[-1] for op in spool.read()] == ['2', '3', '4']
+    server.fail_after = None
+    replay_spool(server, spool, batch_size=2)
+    assert server.published == ['0', '1', '2', '3', '4']
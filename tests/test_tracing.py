@@ -0,0 +1,32 @@
+import json
+
+from meerkat_backend_interface.tracing import Trace, format_alert, parse_alert, read_traces
+
+
+class StubServer(object):
+
+    def __init__(self, records):
+        self.records = [json.dumps(record) for record in records]
+
+    def lrange(self, key, start, end):
+        return self.records
+
+
+def test_alerts_round_trip():
+    assert parse_alert(format_alert('capture-start', 'array_1', 'abc')) == ('capture-start', 'array_1', 'abc')
+    assert parse_alert('capture-start:array_1') == ('capture-start', 'array_1', None)
+    assert parse_alert('junk') is None
+
+
+def test_replays_are_marked():
+    katcp = Trace('abc', 'array_1', 'configure', 'katcp')
+    katcp.add_span('publish', 1.0, 1.1)
+    replay = Trace(None, 'array_1', 'configure', 'supervisor', replay_of='abc')
+    replay.add_span('replay', 5.0, 5.0)
+    worker = Trace(replay.trace_id, 'array_1', 'configure', 'katportal')
+    worker.add_span('dispatch', 5.1, 5.2)
+    traces = read_traces(StubServer([worker.to_dict(), replay.to_dict(), katcp.to_dict()]))
+    assert [trace['trace_id'] for trace in traces] == [replay.trace_id, 'abc']
+    assert traces[0]['replay_of'] == 'abc'
+    assert [span[1] for span in traces[0]['spans']] == ['replay', 'dispatch']
+    assert traces[1]['replay_of'] is None